@@ -1,12 +1,14 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-from fpdf import FPDF
+from datetime import datetime, timedelta
 import io
-import bcrypt
-import plotly.express as px
-import gspread
-from gspread.exceptions import WorksheetNotFound
+import os
+import json
+import time
+import threading
+import heapq
+import bisect
+from collections import Counter, deque
 
 st.set_page_config(
     page_title="PT. BKA - Sistem Kontrol Stok & Penggajian",
@@ -63,239 +65,2678 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- GOOGLE SHEETS CONNECTION & SETUP ---
-def get_gsheet_connection():
+@st.cache_resource(show_spinner=False)
+def get_app_state():
+    """Process-wide state shared by every session (locks, flags, worksheet handles)."""
+    return {
+        'lock': threading.RLock(),
+        'sheets_client_lock': threading.Lock(),
+        'schema_lock': threading.Lock(),
+        'schema_checked': False,
+        'worksheets': {},
+        'data_versions': {},
+        'snapshot_reconcile_started': set(),
+        'snapshot_current': {},
+    }
+
+# --- SHEETS CLIENT ---
+# Semua panggilan gspread lewat sheets_call: kuota per menit (token bucket), retry dengan
+# exponential backoff + jitter untuk 429/5xx, dan pembacaan identik yang sedang berjalan digabung.
+# Penulisan hanya diulang pada 429 (ditolak sebelum diterapkan): 5xx bisa datang setelah perubahan
+# tersimpan, dan mengulang hapus baris atau append akan menghapus baris lain atau menggandakan data.
+SHEETS_BUDGET_PER_MINUTE = {'read': 60, 'write': 60}
+SHEETS_MAX_RETRIES = 5
+SHEETS_BACKOFF_BASE = 1.0
+SHEETS_BACKOFF_MAX = 32.0
+SHEETS_RETRY_STATUSES = {429, 500, 502, 503, 504}
+SHEETS_WRITE_RETRY_STATUSES = {429}
+# Saat Google Sheets tidak terjangkau, panggilan dari halaman langsung gagal tanpa menunggu jaringan;
+# hanya thread sinkronisasi jurnal yang mencoba lagi (lihat WRITE JOURNAL).
+OFFLINE_RETRY_SECONDS = 30
+_sheets_probe = threading.local()
+
+def _sheets_client_state():
+    # Lock sendiri, bukan state['lock']: fungsi yang memegang state['lock'] bisa menunggu pembacaan
+    # single-flight, dan leader-nya (mis. sedang backoff setelah 429) tidak boleh terblokir di sini.
+    state = get_app_state()
+    client = state.get('sheets_client')
+    if client is not None:
+        return client
+    with state['sheets_client_lock']:
+        if 'sheets_client' not in state:
+            now = time.monotonic()
+            state['sheets_client'] = {
+                'lock': threading.Lock(),
+                'buckets': {kind: {'tokens': float(limit), 'updated': now} for kind, limit in SHEETS_BUDGET_PER_MINUTE.items()},
+                'inflight': {},
+                'offline': None,
+                'metrics': {'calls': 0, 'reads': 0, 'writes': 0, 'coalesced': 0, 'budget_waits': 0,
+                            'budget_wait_seconds': 0.0, 'rate_limited': 0, 'retries': 0, 'failures': 0},
+            }
+        return state['sheets_client']
+
+def _acquire_sheets_token(kind):
+    """Blocks until the per-minute budget for kind ('read' or 'write') has a token."""
+    client = _sheets_client_state()
+    limit = SHEETS_BUDGET_PER_MINUTE[kind]
+    waited = 0.0
+    while True:
+        with client['lock']:
+            bucket = client['buckets'][kind]
+            now = time.monotonic()
+            bucket['tokens'] = min(limit, bucket['tokens'] + (now - bucket['updated']) * limit / 60.0)
+            bucket['updated'] = now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                if waited:
+                    client['metrics']['budget_waits'] += 1
+                    client['metrics']['budget_wait_seconds'] += waited
+                return
+            delay = (1 - bucket['tokens']) * 60.0 / limit
+        time.sleep(delay)
+        waited += delay
+
+def _sheets_error_status(error):
+    """HTTP status of a failed call (gspread APIError carries the requests response)."""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if status is not None else getattr(error, 'code', None)
+
+# Kelas error (requests, urllib3, google-auth) yang berarti server tidak terjangkau, dicocokkan lewat nama
+# agar modul-modul itu tidak perlu diimpor di sini.
+NETWORK_ERROR_NAMES = {'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'SSLError', 'ProxyError', 'TransportError'}
+
+def _is_network_error(error):
+    """True when the call failed without an HTTP response, i.e. Google Sheets could not be reached.
+
+    Other OS errors, such as a missing secrets.toml, are configuration problems, not an outage.
+    """
+    if _sheets_error_status(error) is not None:
+        return False
+    import socket
+    if isinstance(error, (ConnectionError, TimeoutError, socket.gaierror)):
+        return True
+    return any(cls.__name__ in NETWORK_ERROR_NAMES for cls in type(error).__mro__)
+
+def get_offline_status():
+    """None while Google Sheets is reachable, else {'since', 'error'} of the current outage."""
+    client = _sheets_client_state()
+    with client['lock']:
+        return dict(client['offline']) if client['offline'] else None
+
+def mark_offline(error):
+    client = _sheets_client_state()
+    with client['lock']:
+        went_offline = client['offline'] is None
+        if went_offline:
+            client['offline'] = {'since': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        client['offline']['error'] = str(error)
+    if went_offline:
+        # Thread sinkronisasi yang memeriksa koneksi, juga untuk sesi yang hanya membaca.
+        wake_journal_sync()
+
+def _mark_online():
+    client = _sheets_client_state()
+    with client['lock']:
+        was_offline = client['offline'] is not None
+        client['offline'] = None
+    if was_offline:
+        # Data yang dibaca dari salinan lokal selama offline dibaca ulang dari Google Sheets.
+        for sheet_name in SHEET_SCHEMA:
+            bump_data_version(sheet_name)
+        wake_journal_sync()
+
+def _call_with_backoff(kind, func, args, kwargs):
+    import random
+    client = _sheets_client_state()
+    metrics = client['metrics']
+    if client['offline'] is not None and not getattr(_sheets_probe, 'active', False):
+        raise ConnectionError("Google Sheets sedang offline.")
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        _acquire_sheets_token(kind)
+        with client['lock']:
+            metrics['calls'] += 1
+            metrics['reads' if kind == 'read' else 'writes'] += 1
+        try:
+            result = func(*args, **kwargs)
+            if client['offline'] is not None:
+                _mark_online()
+            return result
+        except Exception as e:
+            if _is_network_error(e):
+                mark_offline(e)
+            status = _sheets_error_status(e)
+            retry_statuses = SHEETS_RETRY_STATUSES if kind == 'read' else SHEETS_WRITE_RETRY_STATUSES
+            give_up = status not in retry_statuses or attempt == SHEETS_MAX_RETRIES
+            with client['lock']:
+                metrics['rate_limited'] += status == 429
+                metrics['failures' if give_up else 'retries'] += 1
+            if give_up:
+                raise
+            # Full jitter: tunggu acak antara 0 dan batas backoff eksponensial.
+            time.sleep(random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt)))
+
+def sheets_call(kind, func, *args, coalesce_key=None, **kwargs):
+    """Runs a gspread call within the request budget, retrying with backoff: reads on 429/5xx,
+    writes only on 429 (a 5xx write may already be applied; callers decide how to recover).
+
+    Reads with the same coalesce_key that overlap in time share one API request
+    (single-flight); the followers get the leader's result or exception.
+    """
+    if kind != 'read' or coalesce_key is None:
+        return _call_with_backoff(kind, func, args, kwargs)
+    client = _sheets_client_state()
+    with client['lock']:
+        flight = client['inflight'].get(coalesce_key)
+        leader = flight is None
+        if leader:
+            flight = {'done': threading.Event(), 'result': None, 'error': None}
+            client['inflight'][coalesce_key] = flight
+        else:
+            client['metrics']['coalesced'] += 1
+    if not leader:
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['result']
     try:
-        creds = st.secrets["connections"]["gsheets"]
-        gc = gspread.service_account_from_dict(creds)
-        sh = gc.open_by_key(st.secrets["connections"]["gsheets"]["spreadsheet"].split('/')[-2])
-        return sh
+        flight['result'] = _call_with_backoff(kind, func, args, kwargs)
+        return flight['result']
     except Exception as e:
-        st.error(f"Gagal terhubung ke Google Sheets. Pastikan file secrets.toml sudah benar dan API Google Sheets/Drive telah diaktifkan: {e}")
-        st.stop()
-    return None
+        flight['error'] = e
+        raise
+    finally:
+        with client['lock']:
+            client['inflight'].pop(coalesce_key, None)
+        flight['done'].set()
+
+def get_sheets_metrics():
+    """Copy of the Sheets client counters (calls, retries, 429s, budget waits, coalesced reads)."""
+    client = _sheets_client_state()
+    with client['lock']:
+        return dict(client['metrics'])
+
+def create_sheets_client(creds, session=None):
+    """gspread client for the service account. `session` (a requests.Session) replaces its HTTP
+    transport, e.g. to run the client against a local fake server that injects 429s and latency."""
+    import gspread
+    if session is not None:
+        return gspread.Client(auth=None, session=session)
+    return gspread.service_account_from_dict(creds)
+
+# Koneksi baru dibuat saat data pertama kali dibutuhkan, lalu dipakai bersama oleh semua sesi.
+@st.cache_resource(show_spinner=False)
+def _open_spreadsheet():
+    creds = st.secrets["connections"]["gsheets"]
+    gc = create_sheets_client(creds)
+    return sheets_call('read', gc.open_by_key, creds["spreadsheet"].split('/')[-2])
 
-sh = get_gsheet_connection()
+def get_gsheet_connection():
+    """The spreadsheet, or None while Google Sheets cannot be reached; the app then runs offline on its local copies."""
+    try:
+        return _open_spreadsheet()
+    except Exception as e:
+        if not _is_network_error(e):
+            st.error(f"Gagal terhubung ke Google Sheets. Pastikan file secrets.toml sudah benar dan API Google Sheets/Drive telah diaktifkan: {e}")
+            st.stop()
+            return None
+        mark_offline(e)
+        return None
 
 # --- UTILITY FUNCTIONS ---
+def get_data_version(sheet_name):
+    """Counter that changes every time this app writes to the worksheet."""
+    return get_app_state()['data_versions'].get(sheet_name, 0)
+
+def bump_data_version(sheet_name):
+    state = get_app_state()
+    with state['lock']:
+        state['data_versions'][sheet_name] = state['data_versions'].get(sheet_name, 0) + 1
+
 def get_worksheet(sheet_name):
-    try:
-        return sh.worksheet(sheet_name)
-    except WorksheetNotFound:
-        return None
+    from gspread.exceptions import WorksheetNotFound
+    handles = get_app_state()['worksheets']
+    worksheet = handles.get(sheet_name)
+    if worksheet is None:
+        sh = get_gsheet_connection()
+        if sh is None:
+            return None
+        try:
+            worksheet = sheets_call('read', sh.worksheet, sheet_name, coalesce_key=('worksheet', sheet_name))
+        except WorksheetNotFound:
+            return None
+        handles[sheet_name] = worksheet
+    return worksheet
+
+# --- SCHEMA REGISTRY ---
+# Lokasi untuk baris stok lama yang belum punya kolom lokasi.
+LOKASI_DEFAULT = 'Gudang Utama'
+
+# Semua worksheet beserta header-nya. Urutan kolom harus sama dengan urutan data yang ditulis.
+SHEET_SCHEMA = {
+    "users": ['username', 'password_hash', 'role'],
+    "master_barang": ['kode_bahan', 'nama_supplier', 'nama_bahan', 'warna', 'rak', 'harga', 'min_stok'],
+    "barang_masuk": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan', 'lokasi'],
+    "barang_keluar": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan', 'lokasi', 'invoice_number'],
+    "invoices": ['invoice_number', 'tanggal_waktu', 'customer_name', 'customer_id'],
+    "invoice_items": ['invoice_number', 'kode_bahan', 'nama_bahan', 'qty', 'harga', 'total', 'warna', 'versi_harga'],
+    "employees": ['nama_karyawan', 'bagian', 'gaji_pokok', 'employee_id'],
+    "payroll": ['tanggal_waktu', 'gaji_bulan', 'employee_id', 'gaji_pokok', 'lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon', 'gaji_akhir', 'keterangan'],
+    "stock_snapshot": ['tanggal_snapshot', 'kode_bahan', 'warna', 'stok', 'lokasi', 'yard'],
+    "barang_masuk_arsip": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan', 'lokasi'],
+    "barang_keluar_arsip": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan', 'lokasi', 'invoice_number'],
+    "app_meta": ['kunci', 'nilai'],
+    "lokasi": ['nama_lokasi', 'keterangan'],
+    "transfer_stok": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'dari_lokasi', 'ke_lokasi', 'keterangan', 'yard'],
+    "customers": ['customer_id', 'nama_pelanggan', 'kontak'],
+    "harga_barang": ['versi', 'kode_bahan', 'warna', 'harga', 'berlaku_mulai', 'keterangan'],
+    "payments": ['tanggal_waktu', 'invoice_number', 'jumlah', 'metode', 'keterangan'],
+    "stock_events": ['seq', 'tanggal_waktu', 'jenis', 'sumber', 'ref', 'kode_bahan', 'warna', 'lokasi', 'stok', 'yard', 'keterangan']
+}
+
+# Baris awal yang wajib ada. Keberadaannya dicek berdasarkan nilai kolom pertama.
+SEED_ROWS = {
+    "users": [
+        ['owner', 'owner123', 'owner'],
+        ['adm kasir', 'adm123', 'adm kasir'],
+        ['adm gudang', 'adm123', 'adm gudang'],
+    ],
+    "lokasi": [
+        [LOKASI_DEFAULT, 'Lokasi bawaan'],
+    ],
+}
+
+BACKUP_WORKSHEETS = [name for name in SHEET_SCHEMA if name != 'users']
+
+def plan_schema_migration(remote_headers, remote_keys):
+    """Diffs the remote state against SHEET_SCHEMA/SEED_ROWS.
+
+    remote_headers maps existing worksheet titles to their first row and remote_keys
+    maps seeded worksheets to the set of first-column values already present. Returns
+    (operations, warnings); operations are backend-neutral tuples of
+    ('add_sheet' | 'set_header' | 'append_rows', sheet_name, payload).
+    """
+    operations = []
+    warnings = []
+    for ws_name, headers in SHEET_SCHEMA.items():
+        if ws_name not in remote_headers:
+            operations.append(('add_sheet', ws_name, headers))
+        else:
+            current = [str(h).strip() for h in remote_headers[ws_name]]
+            if current != headers:
+                # Hanya header kosong atau header lama yang kekurangan kolom di akhir yang diperbaiki.
+                if current == headers[:len(current)]:
+                    operations.append(('set_header', ws_name, headers))
+                else:
+                    warnings.append(f"Header worksheet '{ws_name}' tidak sesuai skema: {current}")
+
+        existing_keys = remote_keys.get(ws_name, set())
+        missing_rows = [row for row in SEED_ROWS.get(ws_name, []) if row[0] not in existing_keys]
+        if missing_rows:
+            operations.append(('append_rows', ws_name, missing_rows))
+    return operations, warnings
+
+def _to_cell(value):
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': '' if value is None else str(value)}}
+
+def _to_row_data(values):
+    return {'values': [_to_cell(v) for v in values]}
+
+def read_remote_schema_state(sh):
+    """Reads every header row and seed key column with one metadata and one values call."""
+    worksheets = sheets_call('read', sh.worksheets)
+    sheet_ids = {ws.title: ws.id for ws in worksheets}
+    handles = get_app_state()['worksheets']
+    for ws in worksheets:
+        handles[ws.title] = ws
+
+    header_sheets = [name for name in SHEET_SCHEMA if name in sheet_ids]
+    seed_sheets = [name for name in SEED_ROWS if name in sheet_ids]
+    ranges = [f"'{name}'!1:1" for name in header_sheets] + [f"'{name}'!A2:A" for name in seed_sheets]
+
+    remote_headers = {name: [] for name in sheet_ids}
+    remote_keys = {}
+    if ranges:
+        value_ranges = sheets_call('read', sh.values_batch_get, ranges).get('valueRanges', [])
+        for name, value_range in zip(header_sheets, value_ranges[:len(header_sheets)]):
+            values = value_range.get('values', [])
+            remote_headers[name] = values[0] if values else []
+        for name, value_range in zip(seed_sheets, value_ranges[len(header_sheets):]):
+            remote_keys[name] = {row[0] for row in value_range.get('values', []) if row}
+    return sheet_ids, remote_headers, remote_keys
+
+def apply_schema_migration_gsheets(sh, sheet_ids, operations):
+    """Applies every sheet creation, header fix and seed row in a single batchUpdate."""
+    if not operations:
+        return
+    sheet_ids = dict(sheet_ids)
+    next_id = max(sheet_ids.values(), default=0) + 1
+    requests = []
+    for op, ws_name, payload in operations:
+        if op == 'add_sheet':
+            sheet_ids[ws_name] = next_id
+            next_id += 1
+            requests.append({'addSheet': {'properties': {
+                'sheetId': sheet_ids[ws_name],
+                'title': ws_name,
+                'gridProperties': {'rowCount': 1000, 'columnCount': max(20, len(payload))},
+            }}})
+            requests.append({'updateCells': {
+                'start': {'sheetId': sheet_ids[ws_name], 'rowIndex': 0, 'columnIndex': 0},
+                'rows': [_to_row_data(payload)],
+                'fields': 'userEnteredValue',
+            }})
+        elif op == 'set_header':
+            requests.append({'updateCells': {
+                'start': {'sheetId': sheet_ids[ws_name], 'rowIndex': 0, 'columnIndex': 0},
+                'rows': [_to_row_data(payload)],
+                'fields': 'userEnteredValue',
+            }})
+        elif op == 'append_rows':
+            requests.append({'appendCells': {
+                'sheetId': sheet_ids[ws_name],
+                'rows': [_to_row_data(row) for row in payload],
+                'fields': 'userEnteredValue',
+            }})
+    sheets_call('write', sh.batch_update, {'requests': requests})
 
 def check_and_create_worksheets():
-    """Checks for required worksheets and creates them with headers if they don't exist."""
-    required_worksheets = {
-        "users": ['username', 'password_hash', 'role'],
-        "master_barang": ['kode_bahan', 'nama_supplier', 'nama_bahan', 'warna', 'rak', 'harga'],
-        "barang_masuk": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'],
-        "barang_keluar": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'],
-        "invoices": ['invoice_number', 'tanggal_waktu', 'customer_name'],
-        "invoice_items": ['invoice_number', 'kode_bahan', 'nama_bahan', 'qty', 'harga', 'total'],
-        "employees": ['nama_karyawan', 'bagian', 'gaji_pokok'],
-        "payroll": ['tanggal_waktu', 'gaji_bulan', 'employee_id', 'gaji_pokok', 'lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon', 'gaji_akhir', 'keterangan']
-    }
+    """Creates missing worksheets, fixes headers and adds seed rows in one batched call."""
+    sh = get_gsheet_connection()
+    sheet_ids, remote_headers, remote_keys = read_remote_schema_state(sh)
+    operations, warnings = plan_schema_migration(remote_headers, remote_keys)
+    operations = hash_seed_passwords(operations)
+    for message in warnings:
+        st.warning(message)
+    if not operations:
+        return
 
-    existing_worksheets = [ws.title for ws in sh.worksheets()]
-    
-    for ws_name, headers in required_worksheets.items():
-        if ws_name not in existing_worksheets:
-            st.warning(f"Worksheet '{ws_name}' tidak ditemukan. Membuat sekarang...")
-            new_ws = sh.add_worksheet(title=ws_name, rows="1000", cols="20")
-            new_ws.append_row(headers)
+    apply_schema_migration_gsheets(sh, sheet_ids, operations)
+    st.cache_data.clear()
+    for ws_name in {ws_name for _, ws_name, _ in operations}:
+        bump_data_version(ws_name)
+    for op, ws_name, payload in operations:
+        if op == 'add_sheet':
             st.success(f"Worksheet '{ws_name}' berhasil dibuat dengan header.")
-
-# PERBAIKAN: MENAMBAHKAN CACHING UNTUK MENGURANGI PANGGILAN API
-@st.cache_data(ttl=600)  # Cache data selama 10 menit
-def get_data_from_gsheets(sheet_name):
+        elif op == 'set_header':
+            st.info(f"Header worksheet '{ws_name}' diperbarui.")
+        elif op == 'append_rows':
+            st.success(f"{len(payload)} baris awal ditambahkan ke worksheet '{ws_name}'.")
+
+def ensure_worksheets():
+    """Runs the worksheet check once per process instead of once per session."""
+    state = get_app_state()
+    if state['schema_checked']:
+        return
+    with state['schema_lock']:
+        if not state['schema_checked']:
+            # Offline: dicoba lagi pada pemanggilan berikutnya setelah koneksi kembali.
+            if get_offline_status() is not None or get_gsheet_connection() is None:
+                return
+            if not state.get('worksheets_created'):
+                check_and_create_worksheets()
+                state['worksheets_created'] = True
+            # Backfill menulis kolom per nomor baris, jadi baris jurnal untuk worksheet tersebut harus terkirim dulu.
+            if any(get_journal_rows(name) for name in ('users', 'invoices', 'employees')):
+                wake_journal_sync()
+                return
+            backfill_employee_ids()
+            backfill_customer_ids()
+            backfill_price_history()
+            ensure_receivables_start()
+            migrate_plaintext_passwords()
+            bootstrap_stock_events()
+            state['schema_checked'] = True
+
+def _fetch_sheet_records(sheet_name):
     worksheet = get_worksheet(sheet_name)
     if worksheet:
-        data = worksheet.get_all_records()
+        data = sheets_call('read', worksheet.get_all_records, coalesce_key=('records', sheet_name, get_data_version(sheet_name)))
         df = pd.DataFrame(data)
         # Drop rows that are all empty, which can happen with get_all_records
         df = df.replace('', pd.NA).dropna(how='all')
         return df
-    return pd.DataFrame()
+    return None
 
-def append_row_to_gsheet(sheet_name, data_list):
-    worksheet = get_worksheet(sheet_name)
-    if worksheet:
-        worksheet.append_row(data_list)
-        st.cache_data.clear() # PERBAIKAN: Hapus cache setelah menulis
+# PERBAIKAN: MENAMBAHKAN CACHING UNTUK MENGURANGI PANGGILAN API
+@st.cache_data(ttl=600)  # Cache data selama 10 menit
+def _load_sheet(sheet_name, version):
+    snapshot = serve_snapshot(sheet_name, version)
+    if snapshot is not None:
+        return with_journal_rows(sheet_name, snapshot, replica=True)
+    started = datetime.now()
+    generation = get_journal_generation(sheet_name)
+    try:
+        df = _fetch_sheet_records(sheet_name)
+    except Exception as e:
+        if not _is_network_error(e):
+            raise
+        df = None
+    if df is None:
+        return read_local_replica(sheet_name) if get_offline_status() is not None else pd.DataFrame()
+    if save_snapshot(sheet_name, df, synced_at=started):
+        mark_snapshot_current(sheet_name, version)
+    discard_if_synced_since(sheet_name, generation)
+    return with_journal_rows(sheet_name, df)
+
+def get_data_from_gsheets(sheet_name):
+    start_snapshot_reconcile(sheet_name)
+    return _load_sheet(sheet_name, get_data_version(sheet_name))
+
+# --- LOCAL SNAPSHOTS ---
+# Salinan setiap worksheet disimpan sebagai file Arrow agar restart tidak perlu menunggu Google Sheets.
+# 'users' tidak pernah disalin ke disk (hash atau bahkan password awal), sama seperti pada backup.
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.snapshots')
+SNAPSHOT_MAX_AGE = 600  # detik, sama dengan TTL cache data
+SNAPSHOT_WORKSHEETS = [name for name in SHEET_SCHEMA if name != 'users']
+
+def _snapshot_paths(sheet_name):
+    base = os.path.join(SNAPSHOT_DIR, sheet_name)
+    return base + '.arrow', base + '.json'
+
+def _to_typed_frame(df):
+    """Gives every object column a single Arrow type: Int64, float64 or string."""
+    typed = df.copy()
+    for col in typed.columns:
+        if typed[col].dtype != object:
+            continue
+        values = typed[col].dropna()
+        if len(values) and values.map(lambda v: isinstance(v, int) and not isinstance(v, bool)).all():
+            typed[col] = typed[col].astype('Int64')
+        elif len(values) and values.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)).all():
+            typed[col] = typed[col].astype('float64')
+        else:
+            typed[col] = typed[col].astype('string')
+    return typed
+
+def save_snapshot(sheet_name, df, synced_at=None):
+    """Writes df and its sync watermark (when the read started) to disk. Returns False when pyarrow is unavailable,
+    the worksheet is not in SNAPSHOT_WORKSHEETS, or the write fails."""
+    data_path, meta_path = _snapshot_paths(sheet_name)
+    if sheet_name not in SNAPSHOT_WORKSHEETS:
+        # Salinan yang tertinggal dari versi sebelumnya ikut dihapus.
+        for path in (data_path, meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return False
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError:
+        return False
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        table = pa.Table.from_pandas(_to_typed_frame(df), preserve_index=True)
+        with pa.OSFile(data_path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'synced_at': (synced_at or datetime.now()).isoformat(timespec='seconds'), 'rows': len(df)}, f)
+        os.replace(meta_path + '.tmp', meta_path)
         return True
-    return False
+    except Exception:
+        return False
 
-def update_row_in_gsheet(sheet_name, row_index, data_list):
+def load_snapshot(sheet_name):
+    """Loads the snapshot through a memory map, or returns None when there is none."""
+    if sheet_name not in SNAPSHOT_WORKSHEETS:
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError:
+        return None
+    data_path, _ = _snapshot_paths(sheet_name)
+    if not os.path.exists(data_path):
+        return None
+    try:
+        with pa.memory_map(data_path, 'r') as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    except Exception:
+        return None
+
+def get_snapshot_watermark(sheet_name):
+    _, meta_path = _snapshot_paths(sheet_name)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def mark_snapshot_current(sheet_name, version):
+    get_app_state()['snapshot_current'][sheet_name] = (version, time.time())
+
+def _reconcile_snapshot(sheet_name):
+    started = datetime.now()
+    try:
+        df = _fetch_sheet_records(sheet_name)
+    except Exception:
+        return
+    if df is not None and save_snapshot(sheet_name, df, synced_at=started):
+        state = get_app_state()
+        with state['lock']:
+            bump_data_version(sheet_name)
+            mark_snapshot_current(sheet_name, get_data_version(sheet_name))
+
+def start_snapshot_reconcile(sheet_name):
+    """On the first read of a worksheet in this process, lets its on-disk snapshot be served right away
+    and reconciles it with Google Sheets in a background thread.
+
+    Called from the uncached read wrappers, never from a cached loader, so the thread is started
+    exactly once whether or not the read is a cache hit.
+    """
+    state = get_app_state()
+    if sheet_name in state['snapshot_reconcile_started']:
+        return
+    with state['lock']:
+        if sheet_name in state['snapshot_reconcile_started']:
+            return
+        state['snapshot_reconcile_started'].add(sheet_name)
+        has_snapshot = sheet_name in SNAPSHOT_WORKSHEETS and os.path.exists(_snapshot_paths(sheet_name)[0])
+        if has_snapshot:
+            mark_snapshot_current(sheet_name, get_data_version(sheet_name))
+    if has_snapshot:
+        threading.Thread(target=_reconcile_snapshot, args=(sheet_name,), daemon=True).start()
+
+def serve_snapshot(sheet_name, version):
+    """Returns the on-disk snapshot while it is known to match this data version, else None.
+
+    Side-effect free, so it is safe inside the cached loaders; see start_snapshot_reconcile.
+    """
+    current = get_app_state()['snapshot_current'].get(sheet_name)
+    if current and current[0] == version and time.time() - current[1] < SNAPSHOT_MAX_AGE:
+        return load_snapshot(sheet_name)
+    return None
+
+def _column_letter(col_number):
+    letters = ''
+    while col_number:
+        col_number, remainder = divmod(col_number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _typed_cells(values):
+    """Types raw (UNFORMATTED_VALUE) cells the way get_all_records types full reads: numeric-looking
+    text becomes a number. Without this a code '001' is '001' in a projected read but 1 in a full read."""
+    from gspread.utils import numericise_all
+    return numericise_all(values)
+
+@st.cache_data(ttl=600)
+def _load_sheet_columns(sheet_name, columns, version):
+    snapshot = serve_snapshot(sheet_name, version)
+    if snapshot is not None:
+        return with_journal_rows(sheet_name, snapshot, replica=True).reindex(columns=list(columns))
+    schema = SHEET_SCHEMA.get(sheet_name, [])
+    if any(col not in schema for col in columns):
+        return get_data_from_gsheets(sheet_name).reindex(columns=list(columns))
+    generation = get_journal_generation(sheet_name)
+    try:
+        worksheet = get_worksheet(sheet_name)
+        # Baris header ikut dibaca dalam panggilan yang sama untuk memastikan posisi kolom sesuai skema.
+        letters = [_column_letter(schema.index(col) + 1) for col in columns]
+        value_ranges = sheets_call(
+            'read', worksheet.batch_get,
+            ['1:1'] + [f"{letter}2:{letter}" for letter in letters],
+            coalesce_key=('columns', sheet_name, tuple(columns), version),
+            major_dimension='COLUMNS',
+            value_render_option='UNFORMATTED_VALUE',
+            date_time_render_option='FORMATTED_STRING'
+        ) if worksheet else None
+    except Exception as e:
+        if not _is_network_error(e):
+            raise
+        value_ranges = None
+    if value_ranges is None:
+        if get_offline_status() is not None:
+            return read_local_replica(sheet_name).reindex(columns=list(columns))
+        return pd.DataFrame(columns=list(columns))
+    header = [col[0] if col else '' for col in value_ranges[0]]
+    if header[:len(schema)] != schema:
+        return get_data_from_gsheets(sheet_name).reindex(columns=list(columns))
+
+    arrays = [_typed_cells(value_range[0]) if value_range else [] for value_range in value_ranges[1:]]
+    n_rows = max((len(values) for values in arrays), default=0)
+    df = pd.DataFrame({col: values + [''] * (n_rows - len(values)) for col, values in zip(columns, arrays)})
+    discard_if_synced_since(sheet_name, generation)
+    return with_journal_rows(sheet_name, df.replace('', pd.NA).dropna(how='all'))
+
+def get_columns_from_gsheets(sheet_name, columns):
+    """Projected read: fetches only the given columns as column arrays, without per-row dicts."""
+    start_snapshot_reconcile(sheet_name)
+    return _load_sheet_columns(sheet_name, tuple(columns), get_data_version(sheet_name))
+
+# --- WRITE JOURNAL ---
+# Baris baru tidak langsung dikirim ke Google Sheets: dicatat dulu di jurnal lokal (JSONL, di-fsync)
+# lalu dikirim oleh thread sinkronisasi. Checkout & input tetap jalan saat internet putus, dan
+# pembacaan data langsung melihat baris yang belum terkirim.
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.journal')
+JOURNAL_PATH = os.path.join(JOURNAL_DIR, 'journal.jsonl')
+JOURNAL_SYNC_INTERVAL = OFFLINE_RETRY_SECONDS
+# Checkout menulis beberapa worksheet berturut-turut; jeda singkat setelah dibangunkan memastikan semua
+# barisnya sudah di jurnal sebelum penggantian kunci yang bentrok diputuskan.
+JOURNAL_SETTLE_SECONDS = 2
+# Kunci yang dibuat lokal dan bisa bentrok dengan baris yang ditulis di tempat lain selama offline,
+# beserta kolom di worksheet lain yang merujuknya. Kunci yang bentrok diganti nomor berikutnya.
+JOURNAL_KEY_COLUMNS = {
+    'customers': ('customer_id', [('invoices', 'customer_id')]),
+    'harga_barang': ('versi', [('invoice_items', 'versi_harga')]),
+    'invoices': ('invoice_number', [('invoice_items', 'invoice_number'), ('barang_keluar', 'invoice_number'),
+                                    ('payments', 'invoice_number'), ('stock_events', 'ref')]),
+    'stock_events': ('seq', []),
+}
+# Worksheet yang kuncinya dirujuk dikirim lebih dulu, agar nomor pengganti sudah dipakai oleh baris yang merujuknya.
+JOURNAL_SYNC_ORDER = ['customers', 'harga_barang', 'invoices']
+
+def _json_value(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def _load_journal():
+    """Folds journal.jsonl into entries {id: entry}; a torn last line from a crash is skipped."""
+    entries, attempts = {}, {}
+    try:
+        with open(JOURNAL_PATH) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['t'] == 'add':
+                    entries[record['id']] = {'id': record['id'], 'sheet': record['sheet'], 'rows': record['rows'],
+                                             'created_at': record['created_at'], 'synced_at': None}
+                elif record['t'] == 'rows' and record['id'] in entries:
+                    entries[record['id']]['rows'] = record['rows']
+                elif record['t'] == 'try':
+                    attempts[record['sheet']] = {'ids': record['ids'], 'before': record['before']}
+                elif record['t'] == 'done':
+                    for entry_id in record['ids']:
+                        if entry_id in entries:
+                            entries[entry_id]['synced_at'] = record['at']
+                    attempts.pop(record['sheet'], None)
+    except FileNotFoundError:
+        pass
+    return {'lock': threading.Lock(), 'sync_lock': threading.Lock(), 'wake': threading.Event(), 'thread': None,
+            'entries': entries, 'attempts': attempts, 'generation': {}, 'errors': {}, 'conflicts': [],
+            'last_sync': None, 'replica_warmed': False}
+
+def _journal():
+    state = get_app_state()
+    with state['lock']:
+        if 'journal' not in state:
+            state['journal'] = _load_journal()
+        return state['journal']
+
+def _write_journal(records, mode='a'):
+    """Writes records to the journal file and fsyncs, so a queued write survives a crash or power cut."""
+    if not records and mode == 'a':
+        return
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    path = JOURNAL_PATH if mode == 'a' else JOURNAL_PATH + '.tmp'
+    with open(path, mode) as f:
+        for record in records:
+            f.write(json.dumps(record, default=_json_value) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    if mode != 'a':
+        os.replace(path, JOURNAL_PATH)
+
+def queue_rows(sheet_name, rows):
+    """Records rows for the worksheet in the journal. Returns the entry id, the idempotency key of the batch."""
+    import uuid
+    journal = _journal()
+    entry = {'id': uuid.uuid4().hex, 'sheet': sheet_name, 'rows': json.loads(json.dumps(rows, default=_json_value)),
+             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'synced_at': None}
+    with journal['lock']:
+        _write_journal([{'t': 'add', 'id': entry['id'], 'sheet': sheet_name, 'rows': entry['rows'],
+                         'created_at': entry['created_at']}])
+        journal['entries'][entry['id']] = entry
+    wake_journal_sync()
+    return entry['id']
+
+def get_journal_rows(sheet_name, synced_since=None):
+    """Journaled rows not yet in Google Sheets; with synced_since also those synced at or after that time."""
+    journal = _journal()
+    with journal['lock']:
+        return [row for entry in journal['entries'].values() if entry['sheet'] == sheet_name
+                and (entry['synced_at'] is None or (synced_since is not None and entry['synced_at'] >= synced_since))
+                for row in entry['rows']]
+
+def get_journal_status():
+    """Pending row counts per worksheet, sync errors, replaced keys, last sync round and whether the sync thread runs."""
+    journal = _journal()
+    with journal['lock']:
+        pending = {}
+        for entry in journal['entries'].values():
+            if entry['synced_at'] is None:
+                pending[entry['sheet']] = pending.get(entry['sheet'], 0) + len(entry['rows'])
+        return {'pending': pending, 'errors': dict(journal['errors']), 'conflicts': list(journal['conflicts']),
+                'last_sync': journal['last_sync'], 'running': journal['thread'] is not None}
+
+def get_journal_generation(sheet_name):
+    return _journal()['generation'].get(sheet_name, 0)
+
+def discard_if_synced_since(sheet_name, generation):
+    """A read that overlapped a sync may hold a synced row twice or not at all; bumping the
+    version keeps that result out of later reads."""
+    if get_journal_generation(sheet_name) != generation:
+        bump_data_version(sheet_name)
+
+def with_journal_rows(sheet_name, df, replica=False):
+    """df followed by the journaled rows it does not contain yet, numbered on from its last row.
+
+    For a remote read those are the unsynced rows; a local replica additionally lacks the rows
+    synced after its snapshot was taken.
+    """
+    synced_since = None
+    if replica:
+        watermark = get_snapshot_watermark(sheet_name)
+        synced_since = watermark['synced_at'] if watermark else ''
+    rows = get_journal_rows(sheet_name, synced_since)
+    if not rows:
+        return df
+    schema = SHEET_SCHEMA[sheet_name]
+    pending = pd.DataFrame([list(row[:len(schema)]) + [''] * (len(schema) - len(row)) for row in rows], columns=schema)
+    start = int(df.index.max()) + 1 if len(df) else 0
+    pending.index = pd.RangeIndex(start, start + len(pending))
+    pending = pending.replace('', pd.NA).reindex(columns=df.columns if len(df.columns) else schema)
+    return pd.concat([df, pending]) if len(df) else pending
+
+def read_local_replica(sheet_name):
+    """Offline read: the last snapshot of the worksheet plus the journaled rows it does not contain."""
+    snapshot = load_snapshot(sheet_name)
+    return with_journal_rows(sheet_name, snapshot if snapshot is not None else pd.DataFrame(), replica=True)
+
+def _carry_snapshot_current(sheet_name, old_version):
+    """A journaled append leaves Google Sheets unchanged, so a snapshot that matched the old
+    version still matches; the next read is then served from disk instead of the network."""
+    state = get_app_state()
+    current = state['snapshot_current'].get(sheet_name)
+    if current and current[0] == old_version:
+        state['snapshot_current'][sheet_name] = (get_data_version(sheet_name), current[1])
+
+def _cell_text(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value)
+
+def _row_text(row):
+    cells = [_cell_text(value) for value in row]
+    while cells and cells[-1] == '':
+        cells.pop()
+    return cells
+
+def _mark_synced(sheet_name, ids):
+    journal = _journal()
+    synced_at = datetime.now().isoformat(timespec='seconds')
+    with journal['lock']:
+        _write_journal([{'t': 'done', 'sheet': sheet_name, 'ids': ids, 'at': synced_at}])
+        for entry_id in ids:
+            if entry_id in journal['entries']:
+                journal['entries'][entry_id]['synced_at'] = synced_at
+        journal['attempts'].pop(sheet_name, None)
+        journal['generation'][sheet_name] = journal['generation'].get(sheet_name, 0) + 1
+
+def _confirm_attempt(worksheet, sheet_name, attempt):
+    """An append whose reply never arrived may still have landed: compare the rows where it would be."""
+    journal = _journal()
+    with journal['lock']:
+        rows = [row for entry_id in attempt['ids'] if entry_id in journal['entries']
+                for row in journal['entries'][entry_id]['rows']]
+    if rows:
+        first = attempt['before'] + 2
+        landed = sheets_call('read', worksheet.get,
+                             f"A{first}:{_column_letter(len(SHEET_SCHEMA[sheet_name]))}{first + len(rows) - 1}",
+                             value_render_option='UNFORMATTED_VALUE', date_time_render_option='FORMATTED_STRING')
+        if [_row_text(row) for row in landed] == [_row_text(row) for row in rows]:
+            _mark_synced(sheet_name, attempt['ids'])
+            return
+    with journal['lock']:
+        journal['attempts'].pop(sheet_name, None)
+
+def _next_free_key(key, taken):
+    """Next number after the taken ones, or the next INV-YYMMDD-NNN of the same day."""
+    if key.isdigit():
+        return max(int(k) for k in taken if k.isdigit()) + 1
+    prefix = key.rsplit('-', 1)[0]
+    numbers = [int(k.rsplit('-', 1)[1]) for k in taken if k.rsplit('-', 1)[0] == prefix and k.rsplit('-', 1)[-1].isdigit()]
+    return f"{prefix}-{max(numbers, default=0) + 1:03d}"
+
+def _resolve_key_conflicts(worksheet, sheet_name, pending):
+    """Renumbers pending rows whose key was taken in Google Sheets meanwhile, in every row referring to it."""
+    column, references = JOURNAL_KEY_COLUMNS[sheet_name]
+    position = SHEET_SCHEMA[sheet_name].index(column)
+    remote = {_cell_text(v) for v in sheets_call('read', worksheet.col_values, position + 1)[1:]}
+    taken, remap = set(remote), {}
+    for entry in pending:
+        for row in entry['rows']:
+            key = _cell_text(row[position])
+            if key in remote and key not in remap:
+                remap[key] = _next_free_key(key, taken)
+                taken.add(_cell_text(remap[key]))
+            taken.add(key)
+    if not remap:
+        return
+    targets = [(sheet_name, column)] + references
+    journal = _journal()
+    changed, records = set(), []
+    with journal['lock']:
+        for entry in journal['entries'].values():
+            positions = [SHEET_SCHEMA[entry['sheet']].index(col) for target, col in targets if target == entry['sheet']]
+            if entry['synced_at'] is not None or not positions:
+                continue
+            rows = [list(row) for row in entry['rows']]
+            for row in rows:
+                for p in positions:
+                    if p < len(row) and _cell_text(row[p]) in remap:
+                        row[p] = remap[_cell_text(row[p])]
+            if rows != entry['rows']:
+                entry['rows'] = rows
+                records.append({'t': 'rows', 'id': entry['id'], 'rows': rows})
+                changed.add(entry['sheet'])
+        _write_journal(records)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        journal['conflicts'].extend({'waktu': now, 'worksheet': sheet_name, 'kolom': column, 'lama': old, 'baru': str(new)}
+                                    for old, new in remap.items())
+    for changed_sheet in changed:
+        bump_data_version(changed_sheet)
+
+def _sync_sheet(sheet_name):
+    """Sends the pending rows of one worksheet in a single append, after settling an unconfirmed one."""
+    journal = _journal()
     worksheet = get_worksheet(sheet_name)
+    if worksheet is None:
+        raise ValueError(f"Worksheet '{sheet_name}' tidak ditemukan.")
+    attempt = journal['attempts'].get(sheet_name)
+    if attempt:
+        _confirm_attempt(worksheet, sheet_name, attempt)
+    with journal['lock']:
+        pending = [entry for entry in journal['entries'].values() if entry['sheet'] == sheet_name and entry['synced_at'] is None]
+    if not pending:
+        return
+    if sheet_name in JOURNAL_KEY_COLUMNS:
+        _resolve_key_conflicts(worksheet, sheet_name, pending)
+    ids = [entry['id'] for entry in pending]
+    # Posisi baris terakhir dicatat sebelum mengirim, agar kiriman yang tidak terkonfirmasi bisa dicek ulang.
+    before = max(len(sheets_call('read', worksheet.col_values, 1)) - 1, 0)
+    with journal['lock']:
+        _write_journal([{'t': 'try', 'sheet': sheet_name, 'ids': ids, 'before': before}])
+        journal['attempts'][sheet_name] = {'ids': ids, 'before': before}
+    sheets_call('write', worksheet.append_rows, [row for entry in pending for row in entry['rows']])
+    _mark_synced(sheet_name, ids)
+
+def _compact_journal():
+    """Drops entries synced before their worksheet's snapshot was taken: every reader has them."""
+    journal = _journal()
+    with journal['lock']:
+        keep = []
+        for entry in journal['entries'].values():
+            watermark = get_snapshot_watermark(entry['sheet']) if entry['synced_at'] else None
+            if not (watermark and watermark['synced_at'] > entry['synced_at']):
+                keep.append(entry)
+        if len(keep) == len(journal['entries']):
+            return
+        records = []
+        for entry in keep:
+            records.append({'t': 'add', 'id': entry['id'], 'sheet': entry['sheet'], 'rows': entry['rows'],
+                            'created_at': entry['created_at']})
+            if entry['synced_at']:
+                records.append({'t': 'done', 'sheet': entry['sheet'], 'ids': [entry['id']], 'at': entry['synced_at']})
+        records += [{'t': 'try', 'sheet': sheet_name, **attempt} for sheet_name, attempt in journal['attempts'].items()]
+        _write_journal(records, mode='w')
+        journal['entries'] = {entry['id']: entry for entry in keep}
+
+def sync_journal():
+    """Sends pending journal rows to Google Sheets. Returns True when nothing is left pending.
+
+    Stops at the first network failure; any other failure is recorded for that worksheet and
+    the remaining worksheets still sync.
+    """
+    journal = _journal()
+    with journal['sync_lock']:
+        with journal['lock']:
+            sheets = list(dict.fromkeys(e['sheet'] for e in journal['entries'].values() if e['synced_at'] is None))
+        sheets.sort(key=lambda name: JOURNAL_SYNC_ORDER.index(name) if name in JOURNAL_SYNC_ORDER else len(JOURNAL_SYNC_ORDER))
+        for sheet_name in sheets:
+            try:
+                _sync_sheet(sheet_name)
+                journal['errors'].pop(sheet_name, None)
+            except Exception as e:
+                if _is_network_error(e):
+                    return False
+                journal['errors'][sheet_name] = str(e)
+        journal['last_sync'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _compact_journal()
+        return not get_journal_status()['pending']
+
+def warm_local_replica():
+    """Takes a snapshot of every worksheet that has none, so a later outage can still serve it."""
+    journal = _journal()
+    if journal['replica_warmed']:
+        return
+    for sheet_name in SNAPSHOT_WORKSHEETS:
+        if os.path.exists(_snapshot_paths(sheet_name)[0]):
+            continue
+        started = datetime.now()
+        df = _fetch_sheet_records(sheet_name)
+        if df is not None:
+            save_snapshot(sheet_name, df, synced_at=started)
+    journal['replica_warmed'] = True
+
+def _journal_sync_loop():
+    journal = _journal()
+    _sheets_probe.active = True
+    while _journal() is journal:  # berhenti bila state proses dibuat ulang
+        journal['wake'].wait(JOURNAL_SYNC_INTERVAL)
+        time.sleep(JOURNAL_SETTLE_SECONDS)
+        journal['wake'].clear()
+        try:
+            if get_offline_status() is not None:
+                sheets_call('read', _open_spreadsheet().fetch_sheet_metadata)
+            sync_journal()
+            warm_local_replica()
+        except Exception:
+            continue
+
+def wake_journal_sync():
+    """Starts the sync thread on first use and lets it run a round now."""
+    journal = _journal()
+    with journal['lock']:
+        if journal['thread'] is None:
+            journal['thread'] = threading.Thread(target=_journal_sync_loop, daemon=True)
+            journal['thread'].start()
+    journal['wake'].set()
+
+def _positional_worksheet(sheet_name):
+    """Worksheet for an edit or delete by row number, or None while that is unsafe: offline, or
+    rows for the worksheet still in the journal (their final row numbers are not known yet).
+
+    The page does not wait for the sync; it wakes the sync thread and asks the user to retry."""
+    if get_offline_status() is not None:
+        return None
+    if get_journal_rows(sheet_name):
+        wake_journal_sync()
+        st.warning(f"Data '{sheet_name}' masih disinkronkan ke Google Sheets. Coba lagi sebentar lagi.")
+        return None
+    return get_worksheet(sheet_name)
+
+def append_row_to_gsheet(sheet_name, data_list):
+    return append_rows_to_gsheet(sheet_name, [data_list])
+
+def update_row_in_gsheet(sheet_name, row_index, data_list):
+    worksheet = _positional_worksheet(sheet_name)
     if worksheet:
-        worksheet.update(f"A{row_index+2}", [data_list])
+        sheets_call('write', worksheet.update, f"A{row_index+2}", [data_list])
         st.cache_data.clear() # PERBAIKAN: Hapus cache setelah menulis
+        bump_data_version(sheet_name)
+        sync_row_index(sheet_name, updated={row_index: data_list})
         return True
     return False
 
 def delete_row_from_gsheet(sheet_name, row_index):
-    worksheet = get_worksheet(sheet_name)
+    worksheet = _positional_worksheet(sheet_name)
     if worksheet:
-        worksheet.delete_rows(row_index+2)
+        sheets_call('write', worksheet.delete_rows, row_index+2)
         st.cache_data.clear() # PERBAIKAN: Hapus cache setelah menulis
+        bump_data_version(sheet_name)
+        sync_row_index(sheet_name, deleted=[row_index])
         return True
     return False
 
-def create_excel_backup():
-    """Menggabungkan semua data dari berbagai worksheet ke dalam satu file Excel."""
+def append_rows_to_gsheet(sheet_name, rows):
+    """Appends many rows. They are journaled locally and sent in one call by the sync thread,
+    so this never waits on the network."""
+    if rows:
+        state = get_app_state()
+        queue_rows(sheet_name, rows)
+        with state['lock']:
+            old_version = get_data_version(sheet_name)
+            bump_data_version(sheet_name)
+            _carry_snapshot_current(sheet_name, old_version)
+        sync_row_index(sheet_name, appended=rows)
+    return True
+
+def delete_rows_from_gsheet(sheet_name, row_indices):
+    """Deletes many rows (same 0-based indexes as delete_row_from_gsheet) in one batchUpdate."""
+    worksheet = _positional_worksheet(sheet_name)
+    if not worksheet:
+        return False
+    sheet_rows = sorted({int(i) + 1 for i in row_indices}, reverse=True)
+    if not sheet_rows:
+        return True
+    # Gabungkan baris yang berurutan menjadi satu rentang; dihapus dari bawah agar indeks tidak bergeser.
+    ranges = []
+    for row in sheet_rows:
+        if ranges and ranges[-1][0] == row + 1:
+            ranges[-1][0] = row
+        else:
+            ranges.append([row, row + 1])
+    requests = [{'deleteDimension': {'range': {
+        'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': start, 'endIndex': end
+    }}} for start, end in ranges]
+    sheets_call('write', get_gsheet_connection().batch_update, {'requests': requests})
+    st.cache_data.clear()
+    bump_data_version(sheet_name)
+    sync_row_index(sheet_name, deleted=[row - 1 for row in sheet_rows])
+    return True
+
+def to_sheet_rows(df, columns):
+    """Converts df to JSON-serialisable row lists in the given column order (NA becomes '')."""
+    frame = df.reindex(columns=columns)
+    frame = frame.astype(object).where(frame.notna(), '')
+    return [[v.item() if hasattr(v, 'item') else v for v in row] for row in frame.itertuples(index=False)]
+
+def get_app_meta(key, default=None):
+    df = get_data_from_gsheets('app_meta')
+    if df.empty:
+        return default
+    matches = df.loc[df['kunci'] == key, 'nilai']
+    return matches.iloc[-1] if not matches.empty else default
+
+def set_app_meta(key, value):
+    df = get_data_from_gsheets('app_meta')
+    row_index = df.index[df['kunci'] == key].tolist() if not df.empty else []
+    if row_index:
+        return update_row_in_gsheet('app_meta', row_index[-1], [key, value])
+    return append_row_to_gsheet('app_meta', [key, value])
+
+def create_excel_backup(progress=None):
+    """Menggabungkan semua data dari berbagai worksheet ke dalam satu file Excel.
+
+    progress(fraction, message) dipanggil per worksheet; bisa dari job latar belakang.
+    """
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for i, sheet_name in enumerate(BACKUP_WORKSHEETS):
+            if progress:
+                progress(i / len(BACKUP_WORKSHEETS), f"Mengambil data dari worksheet '{sheet_name}'...")
+            df = get_data_from_gsheets(sheet_name)
+            if not df.empty:
+                # Ganti semua nilai None/NaN dengan string kosong agar tidak ada masalah saat menulis ke Excel
+                df = df.fillna('')
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+            else:
+                # Jika DataFrame kosong, buat yang kosong dengan header
+                empty_df = pd.DataFrame(columns=SHEET_SCHEMA[sheet_name])
+                empty_df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return output.getvalue()
+
+# --- BACKGROUND JOBS ---
+# Ekspor berat (backup, PDF) dijalankan di worker pool agar rerun halaman tidak terblokir.
+# Tabel job ada di memori proses; hasilnya disimpan di disk lokal sampai kedaluwarsa.
+JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.jobs')
+JOB_WORKERS = 2
+JOB_RESULT_TTL = 3600
+JOB_ACTIVE_STATUSES = ('antri', 'berjalan')
+
+@st.cache_resource(show_spinner=False)
+def _job_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='bka-job')
+
+def _job_table():
+    state = get_app_state()
+    with state['lock']:
+        return state.setdefault('jobs', {})
+
+def _job_result_path(job_id):
+    return os.path.join(JOB_DIR, f"{job_id}.bin")
+
+def _update_job(job_id, **fields):
+    state = get_app_state()
+    with state['lock']:
+        job = _job_table().get(job_id)
+        if job:
+            job.update(fields)
+
+def _run_job(job_id, func, args):
+    job = _job_table().get(job_id)
+    if job is None or job['cancel'].is_set():
+        _update_job(job_id, status='dibatalkan', finished_at=time.time())
+        return
+    _update_job(job_id, status='berjalan', started_at=time.time())
+
+    def report(fraction, message=''):
+        # Titik pembatalan: job berhenti di laporan progres berikutnya.
+        if job['cancel'].is_set():
+            raise InterruptedError
+        _update_job(job_id, progress=min(max(float(fraction), 0.0), 1.0), message=message)
+
     try:
-        # Nama worksheet dan header yang relevan
-        worksheets_to_backup = {
-            "master_barang": ['kode_bahan', 'nama_supplier', 'nama_bahan', 'warna', 'rak', 'harga'],
-            "barang_masuk": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'],
-            "barang_keluar": ['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'],
-            "invoices": ['invoice_number', 'tanggal_waktu', 'customer_name'],
-            "invoice_items": ['invoice_number', 'kode_bahan', 'nama_bahan', 'qty', 'harga', 'total'],
-            "employees": ['nama_karyawan', 'bagian', 'gaji_pokok'],
-            "payroll": ['tanggal_waktu', 'gaji_bulan', 'employee_id', 'gaji_pokok', 'lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon', 'gaji_akhir', 'keterangan']
-        }
-        
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name in worksheets_to_backup:
-                st.write(f"Mengambil data dari worksheet '{sheet_name}'...")
-                df = get_data_from_gsheets(sheet_name)
-                if not df.empty:
-                    # Ganti semua nilai None/NaN dengan string kosong agar tidak ada masalah saat menulis ke Excel
-                    df.fillna('', inplace=True)
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                else:
-                    # Jika DataFrame kosong, buat yang kosong dengan header
-                    empty_df = pd.DataFrame(columns=worksheets_to_backup[sheet_name])
-                    empty_df.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        processed_data = output.getvalue()
-        return processed_data
+        result = func(*args, progress=report)
+        if isinstance(result, io.BytesIO):
+            result = result.getvalue()
+        os.makedirs(JOB_DIR, exist_ok=True)
+        tmp_path = _job_result_path(job_id) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(bytes(result))
+        os.replace(tmp_path, _job_result_path(job_id))
+        _update_job(job_id, status='selesai', progress=1.0, message='', finished_at=time.time())
+    except InterruptedError:
+        _update_job(job_id, status='dibatalkan', finished_at=time.time())
     except Exception as e:
-        st.error(f"Gagal membuat backup Excel: {e}")
+        _update_job(job_id, status='gagal', error=str(e), finished_at=time.time())
+
+def cleanup_jobs():
+    """Drops finished jobs (and their result files) older than JOB_RESULT_TTL."""
+    state = get_app_state()
+    cutoff = time.time() - JOB_RESULT_TTL
+    with state['lock']:
+        jobs = _job_table()
+        expired = [job_id for job_id, job in jobs.items()
+                   if job['status'] not in JOB_ACTIVE_STATUSES and (job.get('finished_at') or 0) < cutoff]
+        for job_id in expired:
+            del jobs[job_id]
+    for job_id in expired:
+        try:
+            os.remove(_job_result_path(job_id))
+        except OSError:
+            pass
+
+def submit_job(kind, label, func, *args, owner=None, file_name='hasil.bin', mime='application/octet-stream'):
+    """Queues func(*args, progress=...) on the worker pool and returns the job id.
+
+    func must return bytes (or a BytesIO); progress(fraction, message) reports status
+    and raises InterruptedError once the job has been cancelled.
+    """
+    import uuid
+    cleanup_jobs()
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id, 'kind': kind, 'label': label, 'owner': owner,
+        'status': 'antri', 'progress': 0.0, 'message': '', 'error': None,
+        'submitted_at': time.time(), 'started_at': None, 'finished_at': None,
+        'file_name': file_name, 'mime': mime, 'cancel': threading.Event(), 'future': None,
+    }
+    state = get_app_state()
+    with state['lock']:
+        _job_table()[job_id] = job
+    job['future'] = _job_executor().submit(_run_job, job_id, func, args)
+    return job_id
+
+def cancel_job(job_id):
+    """Cancels a queued job immediately; a running job stops at its next progress report."""
+    job = _job_table().get(job_id)
+    if job is None or job['status'] not in JOB_ACTIVE_STATUSES:
+        return False
+    job['cancel'].set()
+    if job['future'] is not None and job['future'].cancel():
+        _update_job(job_id, status='dibatalkan', finished_at=time.time())
+    return True
+
+def get_jobs(owner=None, kinds=None):
+    """Snapshot of the job table (newest first), filtered by owner and job kind."""
+    state = get_app_state()
+    with state['lock']:
+        jobs = [dict(job) for job in _job_table().values()
+                if (owner is None or job['owner'] == owner) and (kinds is None or job['kind'] in kinds)]
+    return sorted(jobs, key=lambda job: job['submitted_at'], reverse=True)
+
+def read_job_result(job_id):
+    try:
+        with open(_job_result_path(job_id), 'rb') as f:
+            return f.read()
+    except OSError:
         return None
 
+# --- ROW INDEXES ---
+# Peta kunci unik → nomor baris untuk pengecekan duplikat dan pencarian baris O(1).
+# Setelah aplikasi menulis, peta diperbarui di tempat. Perubahan langsung di spreadsheet tidak terlihat
+# dari versi data, jadi peta (dan indeks lain di state proses) dibangun ulang setelah STATE_INDEX_TTL,
+# dan baris tujuan penulisan per posisi dicek ulang di Google Sheets (find_row_for_write).
+STATE_INDEX_TTL = 600  # detik, sama dengan TTL cache data
+ROW_INDEX_KEYS = {
+    'master_barang': ['kode_bahan', 'warna'],
+    'employees': ['nama_karyawan'],
+    'customers': ['customer_id'],
+}
+
+def _row_key(values):
+    return tuple(str(v) for v in values)
+
+def index_expired(index, sheet_names):
+    """True when a process-state index is older than STATE_INDEX_TTL. Its source versions are bumped,
+    so the rebuild reads Google Sheets again instead of the data cache."""
+    if time.monotonic() - index['built_at'] < STATE_INDEX_TTL:
+        return False
+    for sheet_name in sheet_names:
+        bump_data_version(sheet_name)
+    return True
+
+def _build_row_index(sheet_name):
+    columns = ROW_INDEX_KEYS[sheet_name]
+    version, built_at = get_data_version(sheet_name), time.monotonic()
+    df = get_columns_from_gsheets(sheet_name, columns)
+    rows, keys_by_row = {}, {}
+    if not df.empty:
+        for row_index, key in zip(df.index.tolist(), df[columns].astype(str).itertuples(index=False, name=None)):
+            rows.setdefault(key, row_index)
+            keys_by_row[row_index] = key
+    return {'version': version, 'built_at': built_at, 'rows': rows, 'keys_by_row': keys_by_row,
+            'next_row': max(keys_by_row, default=-1) + 1}
+
+def get_row_index(sheet_name):
+    state = get_app_state()
+    with state['lock']:
+        index = state.setdefault('row_indexes', {}).get(sheet_name)
+    if index is not None and not index_expired(index, [sheet_name]) and index['version'] == get_data_version(sheet_name):
+        return index
+    index = _build_row_index(sheet_name)
+    with state['lock']:
+        state['row_indexes'][sheet_name] = index
+    return index
+
+def find_row(sheet_name, *key):
+    """0-based row of the first record with this key (same numbering as update_row_in_gsheet), or None."""
+    return get_row_index(sheet_name)['rows'].get(_row_key(key))
+
+def _row_holds_key(sheet_name, row_index, key):
+    worksheet = get_worksheet(sheet_name)
+    if worksheet is None:
+        return False
+    values = _typed_cells(sheets_call('read', worksheet.row_values, row_index + 2, value_render_option='UNFORMATTED_VALUE'))
+    positions = [SHEET_SCHEMA[sheet_name].index(col) for col in ROW_INDEX_KEYS[sheet_name]]
+    return _row_key(_cell_text(values[p]) if p < len(values) else '' for p in positions) == _row_key(key)
+
+def find_row_for_write(sheet_name, *key):
+    """find_row for an edit or delete by row number: confirms in Google Sheets that the key is
+    still on that row, and rereads the sheet once when it was changed outside the app."""
+    for _ in range(2):
+        row_index = find_row(sheet_name, *key)
+        # Offline atau jurnal belum kosong: penulisan per posisi ditolak oleh writer-nya.
+        if row_index is None or get_offline_status() is not None or get_journal_rows(sheet_name):
+            return row_index
+        if _row_holds_key(sheet_name, row_index, key):
+            return row_index
+        bump_data_version(sheet_name)
+    return None
+
+def sync_row_index(sheet_name, appended=(), updated=None, deleted=()):
+    """Applies one write (already reflected in the data version) to the sheet's row index.
+
+    appended/updated hold full sheet rows; deleted holds 0-based row numbers. If the index
+    was not current before this write it is dropped and rebuilt on the next lookup.
+    """
+    if sheet_name not in ROW_INDEX_KEYS:
+        return
+    state = get_app_state()
+    with state['lock']:
+        indexes = state.setdefault('row_indexes', {})
+        index = indexes.get(sheet_name)
+        if index is None:
+            return
+        if index['version'] != get_data_version(sheet_name) - 1:
+            del indexes[sheet_name]
+            return
+        positions = [SHEET_SCHEMA[sheet_name].index(col) for col in ROW_INDEX_KEYS[sheet_name]]
+        keys_by_row = index['keys_by_row']
+        for row_index, row in (updated or {}).items():
+            keys_by_row[row_index] = _row_key(row[pos] for pos in positions)
+        for row in appended:
+            keys_by_row[index['next_row']] = _row_key(row[pos] for pos in positions)
+            index['next_row'] += 1
+        if deleted:
+            # Baris di bawah baris yang dihapus bergeser naik.
+            removed = sorted(set(deleted))
+            removed_set = set(removed)
+            keys_by_row = {row_index - bisect.bisect_left(removed, row_index): key
+                           for row_index, key in keys_by_row.items() if row_index not in removed_set}
+            index['next_row'] -= len(removed)
+        if updated or deleted:
+            index['rows'] = {}
+            for row_index in sorted(keys_by_row):
+                index['rows'].setdefault(keys_by_row[row_index], row_index)
+        else:
+            for row_index in range(index['next_row'] - len(appended), index['next_row']):
+                index['rows'].setdefault(keys_by_row[row_index], row_index)
+        index['keys_by_row'] = keys_by_row
+        index['version'] = get_data_version(sheet_name)
+
+# --- PAGINATION ---
+def query_page(df, search=None, search_columns=None, sort_by=None, ascending=True, page=1, page_size=50):
+    """Filters, sorts and slices df on the server. Returns (page_df, total_matching_rows)."""
+    if search and search_columns:
+        mask = pd.Series(False, index=df.index)
+        for col in search_columns:
+            if col in df.columns:
+                mask |= df[col].astype(str).str.contains(search, case=False, na=False, regex=False)
+        df = df[mask]
+    if sort_by and sort_by in df.columns:
+        df = df.sort_values(by=sort_by, ascending=ascending, kind='mergesort')
+    total_rows = len(df)
+    total_pages = max(1, -(-total_rows // page_size))
+    page = min(max(1, int(page)), total_pages)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], total_rows
+
+@st.cache_data(ttl=600)
+def _load_sheet_window(sheet_name, start, page_size, version):
+    """(rows start..start+page_size as a frame, total data rows) read as A1 ranges, or None to fall back."""
+    schema = SHEET_SCHEMA.get(sheet_name)
+    if not schema:
+        return None
+    first, last = start + 2, start + page_size + 1
+    try:
+        worksheet = get_worksheet(sheet_name)
+        # Header, kolom A (untuk jumlah baris) dan jendela halaman dalam satu panggilan.
+        value_ranges = sheets_call(
+            'read', worksheet.batch_get,
+            ['1:1', 'A2:A', f"A{first}:{_column_letter(len(schema))}{last}"],
+            coalesce_key=('window', sheet_name, start, page_size, version),
+            value_render_option='UNFORMATTED_VALUE',
+            date_time_render_option='FORMATTED_STRING'
+        ) if worksheet else None
+    except Exception as e:
+        if not _is_network_error(e):
+            raise
+        return None
+    if value_ranges is None or (value_ranges[0][0] if value_ranges[0] else [])[:len(schema)] != schema:
+        return None
+    rows = [_typed_cells(row) + [''] * (len(schema) - len(row)) for row in value_ranges[2]]
+    df = pd.DataFrame(rows, columns=schema, index=range(start, start + len(rows)))
+    return df.replace('', pd.NA).dropna(how='all'), len(value_ranges[1])
+
+def get_sheet_page(sheet_name, search=None, search_columns=None, sort_by=None, ascending=True, page=1, page_size=50):
+    """Page-window read of a worksheet; takes the same arguments as query_page.
+
+    Without search or sort only the header and the requested A1 row range are read. Searching or
+    sorting needs every row, so it goes through the cached full read, as do offline reads and
+    worksheets with rows still in the journal.
+    """
+    if (search and search_columns) or sort_by or get_offline_status() is not None or get_journal_rows(sheet_name):
+        return query_page(get_data_from_gsheets(sheet_name), search, search_columns, sort_by, ascending, page, page_size)
+    version = get_data_version(sheet_name)
+    page = max(1, int(page))
+    window = _load_sheet_window(sheet_name, (page - 1) * page_size, page_size, version)
+    if window is not None and window[0].empty and window[1] and page > 1:
+        # Halaman melewati akhir data: tampilkan halaman terakhir, seperti query_page.
+        page = -(-window[1] // page_size)
+        window = _load_sheet_window(sheet_name, (page - 1) * page_size, page_size, version)
+    if window is None:
+        return query_page(get_data_from_gsheets(sheet_name), page=page, page_size=page_size)
+    return window
+
+# --- LOOKUP MAPS ---
+# Dibangun sekali per versi data (vectorized), lalu dipakai bersama oleh semua sesi untuk pencarian O(1).
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_master_lookup(version):
+    df = get_master_barang()
+    if df.empty:
+        return {'records': {}, 'labels': {}, 'colors_by_kode': {}}
+    keys = list(zip(df['kode_bahan'], df['warna']))
+    labels = df['kode_bahan'].astype(str) + ' - ' + df['nama_bahan'].astype(str) + ' (' + df['warna'].astype(str) + ')'
+    return {
+        'records': dict(zip(keys, df.to_dict('records'))),
+        'labels': dict(zip(keys, labels.tolist())),
+        'colors_by_kode': df.groupby('kode_bahan', sort=False)['warna'].agg(list).to_dict(),
+    }
+
+def get_master_lookup():
+    """(kode_bahan, warna) → master_barang record, plus picker labels and colors per kode."""
+    return _build_master_lookup(get_data_version('master_barang'))
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_employee_lookup(version):
+    df = get_employees()
+    if df.empty:
+        return {'records': {}, 'labels': {}}
+    ids = df['employee_id'].astype(int).tolist()
+    labels = df['employee_id'].astype(str) + ' - ' + df['nama_karyawan'].astype(str) + ' (' + df['bagian'].astype(str) + ')'
+    return {
+        'records': dict(zip(ids, df.to_dict('records'))),
+        'labels': dict(zip(ids, labels.tolist())),
+    }
+
+def get_employee_lookup():
+    """employee id → employees record, plus picker labels."""
+    return _build_employee_lookup(get_data_version('employees'))
+
 # --- AUTHENTICATION FUNCTIONS ---
+# Cost factor bcrypt; bisa dinaikkan lewat environment. Hash lama di-rehash otomatis saat login berhasil.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+AUTH_WORKERS = 4
+LOGIN_WINDOW_SECONDS = 300
+LOGIN_MAX_FAILURES_PER_USER = 5
+LOGIN_MAX_FAILURES_PER_CLIENT = 50
+
 def get_user_data():
     return get_data_from_gsheets('users')
 
+def is_password_hash(value):
+    return isinstance(value, str) and value.startswith(('$2a$', '$2b$', '$2y$'))
+
+def hash_password(password, rounds=None):
+    import bcrypt
+    return bcrypt.hashpw(str(password).encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS)).decode('utf-8')
+
+def _hash_rounds(password_hash):
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def hash_seed_passwords(operations):
+    """Replaces the plaintext seed passwords in a migration plan with bcrypt hashes."""
+    col = SHEET_SCHEMA['users'].index('password_hash')
+    hashed = []
+    for op, ws_name, payload in operations:
+        if op == 'append_rows' and ws_name == 'users':
+            payload = [row[:col] + [hash_password(row[col])] + row[col + 1:] for row in payload]
+        hashed.append((op, ws_name, payload))
+    return hashed
+
+def migrate_plaintext_passwords():
+    """Hashes every users row whose password is still plaintext, in a single range update."""
+    df = get_user_data()
+    if df.empty:
+        return
+    stored = df['password_hash'].astype(str)
+    plaintext = ~stored.map(is_password_hash)
+    if not plaintext.any():
+        return
+    hashed = stored.copy()
+    hashed[plaintext] = list(_auth_executor().map(hash_password, stored[plaintext]))
+    worksheet = get_worksheet('users')
+    letter = _column_letter(SHEET_SCHEMA['users'].index('password_hash') + 1)
+    last_index = int(df.index.max())
+    values = [[hashed[i]] if i in hashed.index else [''] for i in range(last_index + 1)]
+    sheets_call('write', worksheet.update, f"{letter}2:{letter}{last_index + 2}", values)
+    st.cache_data.clear()
+    bump_data_version('users')
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_user_index(version):
+    df = get_user_data()
+    if df.empty:
+        return {}
+    return {str(username): (str(password_hash), role)
+            for username, password_hash, role in zip(df['username'], df['password_hash'], df['role'])}
+
+def get_user_index():
+    """username → (password_hash, role), rebuilt only when the users sheet changes."""
+    return _build_user_index(get_data_version('users'))
+
+@st.cache_resource(show_spinner=False)
+def _auth_executor():
+    # Pool kecil: bcrypt melepas GIL, dan jumlah hash paralel dibatasi agar CPU tidak habis.
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='bka-auth')
+
+@st.cache_resource(show_spinner=False)
+def _dummy_password_hash():
+    return hash_password('dummy-password')
+
+def _verify_password(password, password_hash):
+    import bcrypt
+    import hmac
+    if not is_password_hash(password_hash):
+        return hmac.compare_digest(str(password).encode('utf-8'), password_hash.encode('utf-8'))
+    return bcrypt.checkpw(str(password).encode('utf-8'), password_hash.encode('utf-8'))
+
+def _login_failures():
+    state = get_app_state()
+    with state['lock']:
+        return state.setdefault('login_failures', {})
+
+def _login_client():
+    """Client address of the current session, or None when Streamlit does not expose it."""
+    try:
+        return getattr(st.context, 'ip_address', None)
+    except Exception:
+        return None
+
+def _login_keys(username, client):
+    # Batas per pengguna dan per alamat klien; tanpa batas global agar satu penyerang tidak mengunci semua orang.
+    return [('user', username)] + ([('client', client)] if client else [])
+
+def _prune_login_failures(failures, cutoff):
+    """Drops attempts older than the window and forgets keys with none left. Caller holds state['lock']."""
+    for key in list(failures):
+        attempts = failures[key]
+        while attempts and attempts[0] < cutoff:
+            attempts.popleft()
+        if not attempts:
+            del failures[key]
+
+def login_retry_after(username, client=None):
+    """Seconds until username may try again from client; 0 when login attempts are allowed."""
+    state = get_app_state()
+    cutoff = time.time() - LOGIN_WINDOW_SECONDS
+    limits = {'user': LOGIN_MAX_FAILURES_PER_USER, 'client': LOGIN_MAX_FAILURES_PER_CLIENT}
+    with state['lock']:
+        failures = _login_failures()
+        wait = 0
+        for key in _login_keys(username, client):
+            attempts = failures.get(key)
+            if not attempts:
+                continue
+            while attempts and attempts[0] < cutoff:
+                attempts.popleft()
+            limit = limits[key[0]]
+            if len(attempts) >= limit:
+                wait = max(wait, attempts[-limit] - cutoff)
+        return int(wait) + 1 if wait > 0 else 0
+
+def _record_login_failure(username, client=None):
+    state = get_app_state()
+    now = time.time()
+    with state['lock']:
+        failures = _login_failures()
+        # Pembersihan penuh paling sering sekali per jendela, agar username acak tidak menumpuk di memori.
+        if now - state.get('login_failures_pruned', 0) >= LOGIN_WINDOW_SECONDS:
+            _prune_login_failures(failures, now - LOGIN_WINDOW_SECONDS)
+            state['login_failures_pruned'] = now
+        for key in _login_keys(username, client):
+            failures.setdefault(key, deque()).append(now)
+
 # PERBAIKAN: Mengembalikan role saat login berhasil
-def check_login(username, password):
-    users_df = get_user_data()
-    user = users_df[users_df['username'] == username]
-    if not user.empty:
-        stored_password = user.iloc[0]['password_hash'] # Menggunakan password_hash sebagai password plain text untuk demo
-        role = user.iloc[0]['role']
-        if password == stored_password:
-            return True, role
-    return False, None
-
-def check_and_create_owner():
-    users_df = get_data_from_gsheets('users')
-    if users_df.empty or 'owner' not in users_df['username'].tolist():
-        st.warning("Pengguna 'owner' tidak ditemukan. Membuat sekarang...")
-        if append_row_to_gsheet('users', ['owner', 'owner123', 'owner']):
-            st.success("Pengguna 'owner' berhasil dibuat.")
-        # Tambahkan pengguna 'adm kasir' dan 'adm gudang' jika belum ada
-        if 'adm kasir' not in users_df['username'].tolist():
-            append_row_to_gsheet('users', ['adm kasir', 'adm123', 'adm kasir'])
-        if 'adm gudang' not in users_df['username'].tolist():
-            append_row_to_gsheet('users', ['adm gudang', 'adm123', 'adm gudang'])
+def check_login(username, password, client=None):
+    """Verifies the password on the auth pool; callers check login_retry_after first."""
+    if login_retry_after(username, client) > 0:
+        return False, None
+    user = get_user_index().get(username)
+    # Username tidak dikenal tetap diverifikasi terhadap hash dummy agar waktunya sama.
+    password_hash = user[0] if user else _dummy_password_hash()
+    valid = _auth_executor().submit(_verify_password, password, password_hash).result()
+    if not (user and valid):
+        _record_login_failure(username, client)
+        return False, None
+    if _hash_rounds(password_hash) != BCRYPT_ROUNDS:
+        rehash_user_password(username, password)
+    with get_app_state()['lock']:
+        _login_failures().pop(('user', username), None)
+    return True, user[1]
+
+def rehash_user_password(username, password):
+    df = get_user_data()
+    row_index = df.index[df['username'].astype(str) == username].tolist()
+    if not row_index:
+        return False
+    row = df.loc[row_index[0]]
+    return update_row_in_gsheet('users', row_index[0], [username, hash_password(password), row['role']])
 
 # --- CRUD Functions - Inventory ---
-def add_master_item(kode, supplier, nama, warna, rak, harga):
-    df_master = get_data_from_gsheets('master_barang')
-    if not df_master.empty and ((df_master['kode_bahan'] == kode) & (df_master['warna'] == warna)).any():
+def add_master_item(kode, supplier, nama, warna, rak, harga, min_stok=0):
+    if find_row('master_barang', kode, warna) is not None:
         return False
-    return append_row_to_gsheet('master_barang', [kode, supplier, nama, warna, rak, harga])
+    if not append_row_to_gsheet('master_barang', [kode, supplier, nama, warna, rak, harga, int(min_stok)]):
+        return False
+    return record_prices([(kode, warna, harga, PRICE_HISTORY_START)], 'harga awal') is not None
 
 def get_master_barang():
     df = get_data_from_gsheets('master_barang')
     if not df.empty:
         df['harga'] = pd.to_numeric(df['harga'], errors='coerce').fillna(0)
+        if 'min_stok' in df.columns:
+            df['min_stok'] = pd.to_numeric(df['min_stok'], errors='coerce').fillna(0).astype(int)
+        else:
+            df['min_stok'] = 0
     return df
 
-def update_master_item(old_kode, old_warna, new_kode, new_warna, supplier, nama, rak, harga):
-    df_master = get_master_barang() # Use the function that returns a clean df
-    row_index = df_master.index[(df_master['kode_bahan'] == old_kode) & (df_master['warna'] == old_warna)].tolist()
-    if not row_index:
+def update_master_item(old_kode, old_warna, new_kode, new_warna, supplier, nama, rak, harga, min_stok=0, berlaku_mulai=None):
+    """Updates a master item. A changed price becomes a new price version effective from berlaku_mulai (default now)."""
+    row_index = find_row_for_write('master_barang', old_kode, old_warna)
+    if row_index is None:
         return False
     
-    row_index = row_index[0]
-    
     # Check for duplicate key combination
     if (new_kode != old_kode or new_warna != old_warna):
-        if ((df_master['kode_bahan'] == new_kode) & (df_master['warna'] == new_warna)).any():
+        if find_row('master_barang', new_kode, new_warna) is not None:
             return False
 
-    return update_row_in_gsheet('master_barang', row_index, [new_kode, supplier, nama, new_warna, rak, harga])
+    now = datetime.now()
+    current_price, current_version = get_price_at(new_kode, new_warna, now)
+    new_price, harga_now = None, current_price
+    if current_price is None:
+        # Kode/warna baru belum punya riwayat: harga ini berlaku sejak awal.
+        new_price, harga_now = (PRICE_HISTORY_START, 'harga awal'), harga
+    elif float(harga) != current_price or berlaku_mulai is not None:
+        effective = pd.Timestamp(berlaku_mulai or now)
+        new_price = (effective, 'perubahan harga')
+        # Harga yang dijadwalkan ke depan, atau yang sudah digantikan versi lebih baru, belum mengubah harga di master.
+        if effective <= now and get_price_at(new_kode, new_warna, effective)[1] == current_version:
+            harga_now = harga
+    # Versi harga baru dicatat setelah baris master berhasil diubah, agar keduanya tidak berselisih
+    # bila perubahan ditolak (mis. baris master_barang masih di jurnal).
+    if not update_row_in_gsheet('master_barang', row_index, [new_kode, supplier, nama, new_warna, rak, harga_now, int(min_stok)]):
+        return False
+    if new_price is not None:
+        return record_prices([(new_kode, new_warna, harga, new_price[0])], new_price[1]) is not None
+    return True
 
 def delete_master_item(kode, warna):
-    df_master = get_data_from_gsheets('master_barang')
-    row_index = df_master.index[(df_master['kode_bahan'] == kode) & (df_master['warna'] == warna)].tolist()
-    if not row_index:
+    row_index = find_row_for_write('master_barang', kode, warna)
+    if row_index is None:
         return False
-    return delete_row_from_gsheet('master_barang', row_index[0])
+    return delete_row_from_gsheet('master_barang', row_index)
+
+def add_barang_masuk(tanggal_waktu, kode_bahan, warna, stok, yard, keterangan, lokasi=LOKASI_DEFAULT):
+    if not append_row_to_gsheet('barang_masuk', [tanggal_waktu, kode_bahan, warna, stok, yard, keterangan, lokasi]):
+        return False
+    record_stock_movement('barang_masuk', kode_bahan, warna, stok)
+    return append_stock_events([stock_event('masuk', 'barang_masuk', tanggal_waktu, kode_bahan, warna, lokasi, stok, yard, keterangan)])
+
+# --- BULK IMPORT ---
+# Impor CSV/XLSX: file dibaca per potongan; tiap potongan divalidasi (vectorized) lalu baris validnya ditulis
+# dengan append_rows, sehingga file besar tidak pernah dimuat utuh.
+IMPORT_CHUNK_ROWS = 500
+IMPORT_SPECS = {
+    'master_barang': {
+        'required': ['kode_bahan', 'warna', 'nama_bahan'],
+        'defaults': {'nama_supplier': '', 'rak': '', 'harga': 0, 'min_stok': 0},
+    },
+    'barang_masuk': {
+        'required': ['kode_bahan', 'warna', 'stok'],
+        'defaults': {'tanggal_waktu': '', 'yard': 0, 'keterangan': '', 'lokasi': LOKASI_DEFAULT},
+    },
+}
+
+def read_import_file(uploaded_file, sheet_name):
+    """Yields an uploaded CSV/XLSX as text frames of at most IMPORT_CHUNK_ROWS rows, keeping only the
+    columns of the target sheet. Row labels run on across chunks, so they match the file.
+
+    Excel files cannot be streamed and come as a single frame.
+    """
+    wanted = set(SHEET_SCHEMA[sheet_name])
+    usecols = lambda col: str(col).strip().lower() in wanted
+    uploaded_file.seek(0)
+    if uploaded_file.name.lower().endswith('.csv'):
+        chunks = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, usecols=usecols, chunksize=IMPORT_CHUNK_ROWS)
+    else:
+        chunks = [pd.read_excel(uploaded_file, dtype=str, keep_default_na=False, usecols=usecols)]
+    for chunk in chunks:
+        chunk.columns = [str(col).strip().lower() for col in chunk.columns]
+        yield chunk
+
+def validate_import_file(uploaded_file, sheet_name, validate):
+    """Yields validate(chunk, seen) → (accepted, errors) per chunk of the file, one chunk in memory at a time.
+
+    seen collects the keys of earlier chunks so duplicates across chunks are still reported.
+    """
+    seen = set()
+    for chunk in read_import_file(uploaded_file, sheet_name):
+        yield validate(chunk, seen)
+
+def _normalize_import(df, sheet_name):
+    spec = IMPORT_SPECS[sheet_name]
+    df = df.copy()
+    for col, default in spec['defaults'].items():
+        if col not in df.columns:
+            df[col] = default
+    for col in spec['required']:
+        if col not in df.columns:
+            df[col] = ''
+    text_columns = [col for col in df.columns if df[col].dtype == object]
+    df[text_columns] = df[text_columns].apply(lambda col: col.astype(str).str.strip())
+    # Sama dengan form input: kode huruf besar, warna huruf kecil.
+    df['kode_bahan'] = df['kode_bahan'].str.upper()
+    df['warna'] = df['warna'].str.lower()
+    return df
+
+def _master_key_index():
+    keys = list(get_row_index('master_barang')['rows'])
+    if not keys:
+        return pd.MultiIndex.from_arrays([[], []], names=STOCK_KEYS)
+    return pd.MultiIndex.from_tuples(keys, names=STOCK_KEYS)
+
+def _import_errors(df, checks):
+    """checks: list of (boolean mask, message). Returns (row-level error frame, mask of valid rows)."""
+    errors = [pd.DataFrame({'baris': df.index[mask] + 2, 'error': message}) for mask, message in checks if mask.any()]
+    invalid = pd.Series(False, index=df.index)
+    for mask, _ in checks:
+        invalid |= mask
+    if errors:
+        error_df = pd.concat(errors, ignore_index=True).sort_values('baris', kind='mergesort', ignore_index=True)
+    else:
+        error_df = pd.DataFrame(columns=['baris', 'error'])
+    return error_df, ~invalid
+
+def validate_master_import(df, seen=None):
+    """Returns (accepted rows in sheet column order, row-level errors). Row numbers match the file.
+
+    seen: keys from earlier chunks of the same file; this chunk's keys are added to it.
+    """
+    df = _normalize_import(df, 'master_barang')
+    keys = pd.MultiIndex.from_frame(df[STOCK_KEYS])
+    repeated = keys.duplicated(keep='first') | (keys.isin(list(seen)) if seen else False)
+    if seen is not None:
+        seen.update(keys)
+    harga = pd.to_numeric(df['harga'].replace('', '0'), errors='coerce')
+    min_stok = pd.to_numeric(df['min_stok'].replace('', '0'), errors='coerce')
+    errors, valid = _import_errors(df, [
+        ((df[IMPORT_SPECS['master_barang']['required']] == '').any(axis=1), 'Kode barang, warna dan nama item wajib diisi'),
+        (harga.isna() | (harga < 0), 'Harga harus angka ≥ 0'),
+        (min_stok.isna() | (min_stok < 0) | (min_stok % 1 != 0), 'Stok minimum harus bilangan bulat ≥ 0'),
+        (pd.Series(repeated, index=df.index), 'Kombinasi kode barang dan warna muncul lebih dari sekali di file'),
+        (pd.Series(keys.isin(_master_key_index()), index=df.index), 'Kombinasi kode barang dan warna sudah ada di master'),
+    ])
+    accepted = df[valid].assign(harga=harga[valid].astype(float), min_stok=min_stok[valid].astype(int))
+    return accepted[SHEET_SCHEMA['master_barang']], errors
+
+def validate_barang_masuk_import(df, seen=None):
+    """Returns (accepted rows in sheet column order, row-level errors). Row numbers match the file.
+
+    seen is accepted for the same call shape as validate_master_import; movement rows may repeat.
+    """
+    df = _normalize_import(df, 'barang_masuk')
+    keys = pd.MultiIndex.from_frame(df[STOCK_KEYS])
+    stok = pd.to_numeric(df['stok'], errors='coerce')
+    yard = pd.to_numeric(df['yard'].replace('', '0'), errors='coerce')
+    tanggal = pd.to_datetime(df['tanggal_waktu'].replace('', datetime.now().strftime('%Y-%m-%d %H:%M:%S')), errors='coerce', format='mixed')
+    boundary = get_archive_boundary()
+    df['lokasi'] = _fill_lokasi(df['lokasi'])
+    errors, valid = _import_errors(df, [
+        ((df[IMPORT_SPECS['barang_masuk']['required']] == '').any(axis=1), 'Kode barang, warna dan stok wajib diisi'),
+        (stok.isna() | (stok < 1) | (stok % 1 != 0), 'Stok harus bilangan bulat ≥ 1'),
+        (yard.isna() | (yard < 0), 'Yard harus angka ≥ 0'),
+        (tanggal.isna(), 'Tanggal & waktu tidak dikenali'),
+        (tanggal <= boundary if boundary is not None else pd.Series(False, index=df.index), 'Tanggal sudah masuk periode arsip stok'),
+        (pd.Series(~keys.isin(_master_key_index()), index=df.index), 'Kode barang dan warna tidak ada di master'),
+        (~df['lokasi'].isin(get_locations()), 'Lokasi tidak terdaftar'),
+    ])
+    accepted = df[valid].assign(
+        tanggal_waktu=tanggal[valid].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        stok=stok[valid].astype(int),
+        yard=yard[valid].astype(float),
+    )
+    return accepted[SHEET_SCHEMA['barang_masuk']], errors
+
+def summarize_import(uploaded_file, sheet_name, validate, preview_rows=200):
+    """Validation report for an upload, reading it chunk by chunk.
+
+    Returns {'accepted': valid row count, 'errors': row-level errors, 'preview': the first valid rows,
+    'earliest': earliest tanggal_waktu among valid rows or None}.
+    """
+    accepted_rows, errors, preview, earliest = 0, [], [], None
+    for accepted, chunk_errors in validate_import_file(uploaded_file, sheet_name, validate):
+        accepted_rows += len(accepted)
+        if not chunk_errors.empty:
+            errors.append(chunk_errors)
+        if accepted_rows - len(accepted) < preview_rows:
+            preview.append(accepted.head(preview_rows - (accepted_rows - len(accepted))))
+        if 'tanggal_waktu' in accepted.columns and not accepted.empty:
+            chunk_earliest = accepted['tanggal_waktu'].min()
+            earliest = chunk_earliest if earliest is None else min(earliest, chunk_earliest)
+    return {
+        'accepted': accepted_rows,
+        'errors': pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=['baris', 'error']),
+        'preview': pd.concat(preview) if preview else pd.DataFrame(columns=SHEET_SCHEMA[sheet_name]),
+        'earliest': earliest,
+    }
 
-def add_barang_masuk(tanggal_waktu, kode_bahan, warna, stok, yard, keterangan):
-    return append_row_to_gsheet('barang_masuk', [tanggal_waktu, kode_bahan, warna, stok, yard, keterangan])
+def import_rows(sheet_name, chunks, total, earliest=None, progress=None):
+    """Appends each chunk of accepted rows as it arrives. Returns the number of rows written.
+
+    earliest is the earliest tanggal_waktu of the whole import (see summarize_import); it is checked
+    before anything is written.
+    """
+    written = 0
+    # Barang masuk bertanggal mundur membuat checkpoint setelahnya basi.
+    if sheet_name == 'barang_masuk' and earliest is not None and not check_movement_edit(earliest):
+        return written
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if not append_rows_to_gsheet(sheet_name, to_sheet_rows(chunk, SHEET_SCHEMA[sheet_name])):
+            break
+        if sheet_name == 'master_barang':
+            record_prices(list(zip(chunk['kode_bahan'], chunk['warna'], chunk['harga'], [PRICE_HISTORY_START] * len(chunk))), 'harga awal')
+        if sheet_name == 'barang_masuk':
+            deltas = chunk.groupby(STOCK_KEYS)['stok'].sum()
+            record_stock_movements(sheet_name, {(str(k), str(w)): int(q) for (k, w), q in deltas.items()})
+            append_stock_events([
+                stock_event('masuk', 'barang_masuk', row.tanggal_waktu, row.kode_bahan, row.warna, row.lokasi, row.stok, row.yard, 'impor massal')
+                for row in chunk.itertuples(index=False)
+            ])
+        written += len(chunk)
+        if progress:
+            progress(min(1.0, written / max(total, 1)), f"{written} dari {total} baris tersimpan")
+    return written
 
 def get_barang_masuk():
     df = get_data_from_gsheets('barang_masuk')
     if df.empty:
         # Perbaikan: Buat DataFrame kosong dengan kolom yang dibutuhkan
-        return pd.DataFrame(columns=['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'])
+        return pd.DataFrame(columns=SHEET_SCHEMA['barang_masuk'])
 
     df['stok'] = pd.to_numeric(df['stok'], errors='coerce').fillna(0).astype(int)
     df['yard'] = pd.to_numeric(df['yard'], errors='coerce').fillna(0.0)
+    df['lokasi'] = _fill_lokasi(df['lokasi']) if 'lokasi' in df.columns else LOKASI_DEFAULT
     return df
 
-def update_barang_masuk(row_index, tanggal_waktu, kode_bahan, warna, stok, yard, keterangan):
-    return update_row_in_gsheet('barang_masuk', row_index, [tanggal_waktu, kode_bahan, warna, stok, yard, keterangan])
+def update_barang_masuk(row_index, tanggal_waktu, kode_bahan, warna, stok, yard, keterangan, lokasi=LOKASI_DEFAULT):
+    old = get_barang_masuk().loc[row_index]
+    if not check_movement_edit(old['tanggal_waktu'], tanggal_waktu):
+        return False
+    if not update_row_in_gsheet('barang_masuk', row_index, [tanggal_waktu, kode_bahan, warna, stok, yard, keterangan, lokasi]):
+        return False
+    # Koreksi dicatat sebagai pembalikan baris lama + baris baru, sehingga jejaknya tetap ada di log.
+    return append_stock_events([
+        stock_event('koreksi', 'barang_masuk', old['tanggal_waktu'], old['kode_bahan'], old['warna'], old['lokasi'], -old['stok'], -old['yard'], 'sebelum koreksi'),
+        stock_event('koreksi', 'barang_masuk', tanggal_waktu, kode_bahan, warna, lokasi, stok, yard, 'sesudah koreksi'),
+    ])
 
 def delete_barang_masuk(row_index):
-    return delete_row_from_gsheet('barang_masuk', row_index)
+    old = get_barang_masuk().loc[row_index]
+    if not check_movement_edit(old['tanggal_waktu']):
+        return False
+    if not delete_row_from_gsheet('barang_masuk', row_index):
+        return False
+    return append_stock_events([
+        stock_event('hapus', 'barang_masuk', old['tanggal_waktu'], old['kode_bahan'], old['warna'], old['lokasi'], -old['stok'], -old['yard'], old['keterangan']),
+    ])
+
+def _get_movement_columns(sheet_name, columns):
+    df = get_columns_from_gsheets(sheet_name, columns)
+    if 'stok' in df.columns:
+        df['stok'] = pd.to_numeric(df['stok'], errors='coerce').fillna(0).astype(int)
+    if 'yard' in df.columns:
+        df['yard'] = pd.to_numeric(df['yard'], errors='coerce').fillna(0.0)
+    return df
 
-def get_stock_balance(kode_bahan, warna):
-    df_in = get_barang_masuk()
-    df_out = get_barang_keluar()
-    
-    # Perbaikan: Periksa apakah DataFrame memiliki kolom sebelum melakukan filter
-    if not df_in.empty:
-        in_stock = df_in[(df_in['kode_bahan'] == kode_bahan) & (df_in['warna'] == warna)]['stok'].sum()
+# --- Stock Checkpoints ---
+# Saldo penutup per item disimpan berkala di worksheet stock_snapshot, sehingga saldo cukup dihitung
+# dari checkpoint terakhir ditambah pergerakan sesudahnya. Pergerakan sampai checkpoint boleh diarsipkan.
+STOCK_CHECKPOINT_PERIOD = 'monthly'  # 'monthly' atau 'daily'
+ARCHIVE_BOUNDARY_KEY = 'arsip_pergerakan_sampai'
+STOCK_KEYS = ['kode_bahan', 'warna']
+LOCATION_KEYS = STOCK_KEYS + ['lokasi']
+# Dua ukuran stok yang selalu dijumlahkan bersama: jumlah (unit/roll) dan panjang (yard).
+STOCK_MEASURES = ['stok', 'yard']
+
+def _fill_lokasi(series):
+    return series.fillna('').astype(str).str.strip().replace('', LOKASI_DEFAULT)
+
+def get_transfer_legs(columns=('tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'lokasi')):
+    """Each transfer as two movements: minus at dari_lokasi, plus at ke_lokasi."""
+    base_columns = [col for col in columns if col != 'lokasi']
+    df = _get_movement_columns('transfer_stok', base_columns + ['dari_lokasi', 'ke_lokasi'])
+    out_leg = df[base_columns].assign(lokasi=df['dari_lokasi'])
+    for col in STOCK_MEASURES:
+        if col in out_leg.columns:
+            out_leg[col] = -out_leg[col]
+    legs = [out_leg, df[base_columns].assign(lokasi=df['ke_lokasi'])]
+    return pd.concat(legs, ignore_index=True)[list(columns)]
+
+def get_stock_movements(columns=('tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'lokasi'), include_archive=False):
+    """Signed movements (masuk positif, keluar negatif) with tanggal_waktu parsed to datetime.
+
+    With 'stok' and 'lokasi' requested, transfers between locations are included as a
+    pair of movements; they net to zero per item.
+    """
+    sources = [('barang_masuk', 1), ('barang_keluar', -1)]
+    if include_archive:
+        sources += [('barang_masuk_arsip', 1), ('barang_keluar_arsip', -1)]
+    frames = []
+    for sheet_name, sign in sources:
+        df = _get_movement_columns(sheet_name, columns)
+        for col in STOCK_MEASURES:
+            if col in df.columns:
+                df[col] = df[col] * sign
+        frames.append(df)
+    if 'stok' in columns and 'lokasi' in columns:
+        frames.append(get_transfer_legs(columns))
+    movements = pd.concat(frames, ignore_index=True)
+    movements['tanggal_waktu'] = pd.to_datetime(movements['tanggal_waktu'], errors='coerce')
+    for col in STOCK_KEYS:
+        movements[col] = movements[col].astype(str)
+    if 'lokasi' in movements.columns:
+        movements['lokasi'] = _fill_lokasi(movements['lokasi'])
+    return movements
+
+def get_stock_checkpoints(include_legacy=False, include_empty=False):
+    """Checkpoint rows with parsed dates.
+
+    Checkpoints written before yards were tracked have no yard values; they are left out
+    (unless include_legacy) so balances fall back to the movements, and the next
+    checkpoint for that date replaces them. An empty checkpoint is stored as one row
+    without kode_bahan that only records its date; it is left out unless include_empty,
+    so it never shows up as an item. Callers that only need checkpoint dates pass it.
+    """
+    df = get_data_from_gsheets('stock_snapshot')
+    if df.empty:
+        return pd.DataFrame(columns=SHEET_SCHEMA['stock_snapshot'])
+    empty = df['kode_bahan'].isna() | (df['kode_bahan'].astype(str).str.strip() == '')
+    df['tanggal_snapshot'] = pd.to_datetime(df['tanggal_snapshot'], errors='coerce')
+    df['stok'] = pd.to_numeric(df['stok'], errors='coerce').fillna(0).astype(int)
+    yard = pd.to_numeric(df['yard'], errors='coerce') if 'yard' in df.columns else pd.Series(float('nan'), index=df.index)
+    legacy = yard.isna().groupby(df['tanggal_snapshot'], dropna=False).transform('all')
+    df['yard'] = yard.fillna(0.0)
+    for col in STOCK_KEYS:
+        df[col] = df[col].astype(str)
+    df['lokasi'] = _fill_lokasi(df['lokasi']) if 'lokasi' in df.columns else LOKASI_DEFAULT
+    if not include_legacy:
+        df = df[~legacy]
+    if not include_empty:
+        df = df[~empty]
+    return df.dropna(subset=['tanggal_snapshot'])
+
+def get_archive_boundary():
+    value = get_app_meta(ARCHIVE_BOUNDARY_KEY)
+    return pd.to_datetime(value, errors='coerce') if value else None
+
+def compute_stock_balances(as_of=None, keys=STOCK_KEYS):
+    """Unit balances (stok) as of a datetime; see compute_stock_ledger."""
+    return compute_stock_ledger(as_of, keys)['stok']
+
+def compute_stock_ledger(as_of=None, keys=STOCK_KEYS):
+    """Balances as of a datetime (None = now): latest checkpoint plus the movements after it.
+
+    Returns a frame indexed by keys with columns stok and yard, both summed in the same
+    groupby. keys=LOCATION_KEYS gives every location of every item in one aggregation.
+    Rows whose tanggal_waktu cannot be parsed are never part of a checkpoint, so they
+    count towards the current balance but not towards point-in-time balances.
+    """
+    checkpoints = get_stock_checkpoints()
+    if as_of is not None:
+        checkpoints = checkpoints[checkpoints['tanggal_snapshot'] <= as_of]
+    base_date = checkpoints['tanggal_snapshot'].max() if not checkpoints.empty else None
+
+    boundary = get_archive_boundary()
+    include_archive = boundary is not None and (base_date is None or base_date < boundary)
+    movements = get_stock_movements(include_archive=include_archive)
+
+    dates = movements['tanggal_waktu']
+    selected = pd.Series(True, index=movements.index)
+    if base_date is not None:
+        selected &= dates.isna() | (dates > base_date)
+    if as_of is not None:
+        selected &= dates.notna() & (dates <= as_of)
+    delta = movements[selected].groupby(keys)[STOCK_MEASURES].sum()
+
+    if base_date is not None:
+        base = checkpoints[checkpoints['tanggal_snapshot'] == base_date].groupby(keys)[STOCK_MEASURES].sum()
+        delta = base.add(delta, fill_value=0)
+    return delta.astype({'stok': int, 'yard': float})
+
+def create_stock_checkpoint(as_of):
+    """Records the closing balance of every item as of `as_of` in stock_snapshot (one append)."""
+    as_of = pd.Timestamp(as_of)
+    if (get_stock_checkpoints(include_empty=True)['tanggal_snapshot'] == as_of).any():
+        return False
+    legacy = get_stock_checkpoints(include_legacy=True)
+    same_date = legacy[legacy['tanggal_snapshot'] == as_of]
+    ledger = compute_stock_ledger(as_of, keys=LOCATION_KEYS)
+    ledger = ledger[(ledger['stok'] != 0) | (ledger['yard'] != 0)]
+    label = as_of.strftime('%Y-%m-%d %H:%M:%S')
+    rows = [[label, kode, warna, int(stok), lokasi, float(yard)]
+            for (kode, warna, lokasi), stok, yard in zip(ledger.index, ledger['stok'], ledger['yard'])]
+    if not rows:
+        # Tetap catat checkpoint kosong agar tanggalnya tercatat sebagai batas.
+        rows = [[label, '', '', 0, '', 0.0]]
+    if not append_rows_to_gsheet('stock_snapshot', rows):
+        return False
+    # Checkpoint lama (tanpa yard) di tanggal yang sama diganti oleh yang baru.
+    return delete_rows_from_gsheet('stock_snapshot', same_date.index.tolist()) if not same_date.empty else True
+
+def last_period_end(now=None):
+    now = now or datetime.now()
+    if STOCK_CHECKPOINT_PERIOD == 'daily':
+        period_start = datetime(now.year, now.month, now.day)
     else:
-        in_stock = 0
-    
-    if not df_out.empty:
-        out_stock = df_out[(df_out['kode_bahan'] == kode_bahan) & (df_out['warna'] == warna)]['stok'].sum()
+        period_start = datetime(now.year, now.month, 1)
+    return period_start - timedelta(seconds=1)
+
+def maybe_create_stock_checkpoint():
+    """Creates the checkpoint for the last closed period, checked at most once per process per day."""
+    state = get_app_state()
+    today = datetime.now().date()
+    if state.get('checkpoint_checked_on') == today:
+        return
+    state['checkpoint_checked_on'] = today
+    period_end = last_period_end()
+    checkpoints = get_stock_checkpoints(include_empty=True)
+    if checkpoints.empty or checkpoints['tanggal_snapshot'].max() < period_end:
+        movements = get_stock_movements(columns=('tanggal_waktu', 'kode_bahan', 'warna', 'stok'))
+        if not movements.empty and (movements['tanggal_waktu'] <= period_end).any():
+            create_stock_checkpoint(period_end)
+
+def check_movement_edit(*tanggal_values):
+    """Guards positional edits of movement rows against checkpoints.
+
+    Returns False when an edit would touch history that is already archived. Otherwise
+    drops the checkpoints the edit makes stale and returns True.
+    """
+    dates = pd.to_datetime(pd.Series(tanggal_values), errors='coerce').dropna()
+    if dates.empty:
+        return True
+    earliest = dates.min()
+    boundary = get_archive_boundary()
+    if boundary is not None and earliest <= boundary:
+        return False
+    df = get_data_from_gsheets('stock_snapshot')
+    if df.empty:
+        return True
+    snapshot_dates = pd.to_datetime(df['tanggal_snapshot'], errors='coerce')
+    stale = df.index[snapshot_dates >= earliest].tolist()
+    return delete_rows_from_gsheet('stock_snapshot', stale) if stale else True
+
+def _archived_rows(archive_name, columns):
+    """Counts of the rows already in an archive worksheet, keyed by their values as strings."""
+    archive = get_data_from_gsheets(archive_name)
+    if archive.empty:
+        return Counter()
+    return Counter(tuple(str(v) for v in row) for row in to_sheet_rows(archive, columns))
+
+def archive_stock_movements():
+    """Moves movement rows up to the latest checkpoint into the *_arsip worksheets.
+
+    Returns rows moved, or None when nothing may be archived now (offline, or the main worksheet could
+    not be cleaned up). The boundary is only advanced once both worksheets are done; a retry skips rows
+    that already reached the archive."""
+    if get_offline_status() is not None:
+        return None
+    checkpoints = get_stock_checkpoints(include_empty=True)
+    if checkpoints.empty:
+        return 0
+    boundary = checkpoints['tanggal_snapshot'].max()
+    moved = 0
+    for sheet_name in ['barang_masuk', 'barang_keluar']:
+        df = get_data_from_gsheets(sheet_name)
+        if df.empty:
+            continue
+        dates = pd.to_datetime(df['tanggal_waktu'], errors='coerce')
+        old_rows = df[dates.notna() & (dates <= boundary)]
+        if old_rows.empty:
+            continue
+        # Baris dihapus per nomor baris, jadi worksheet harus online dan tanpa baris jurnal sebelum apa pun disalin.
+        if _positional_worksheet(sheet_name) is None:
+            return None
+        columns = SHEET_SCHEMA[sheet_name]
+        archived = _archived_rows(f'{sheet_name}_arsip', columns)
+        rows = []
+        for row in to_sheet_rows(old_rows, columns):
+            key = tuple(str(v) for v in row)
+            if archived[key] > 0:
+                archived[key] -= 1
+            else:
+                rows.append(row)
+        # Salin ke arsip dulu, baru hapus dari worksheet utama.
+        append_rows_to_gsheet(f'{sheet_name}_arsip', rows)
+        if not delete_rows_from_gsheet(sheet_name, old_rows.index.tolist()):
+            return None
+        moved += len(old_rows)
+    set_app_meta(ARCHIVE_BOUNDARY_KEY, boundary.strftime('%Y-%m-%d %H:%M:%S'))
+    return moved
+
+# --- Price History ---
+# Riwayat harga per (kode_bahan, warna) dengan tanggal berlaku; tiap perubahan harga menjadi versi baru.
+# master_barang.harga tetap berisi harga yang berlaku saat ini. Harga awal sebuah item berlaku sejak
+# PRICE_HISTORY_START, sehingga pergerakan sebelum riwayat dicatat tetap punya harga.
+PRICE_HISTORY_START = '2000-01-01 00:00:00'
+
+def get_price_history():
+    """Price versions sorted by berlaku_mulai (then versi), with parsed dates and numeric prices."""
+    df = get_data_from_gsheets('harga_barang')
+    if df.empty:
+        return pd.DataFrame(columns=SHEET_SCHEMA['harga_barang'])
+    df['versi'] = pd.to_numeric(df['versi'], errors='coerce')
+    df['harga'] = pd.to_numeric(df['harga'], errors='coerce').fillna(0)
+    df['berlaku_mulai'] = pd.to_datetime(df['berlaku_mulai'], errors='coerce')
+    df = df.dropna(subset=['versi', 'berlaku_mulai']).astype({'versi': int})
+    for col in STOCK_KEYS:
+        df[col] = df[col].astype(str)
+    return df.sort_values(['berlaku_mulai', 'versi'], kind='mergesort').reset_index(drop=True)
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_price_index(version):
+    history = get_price_history()
+    # Per item: tanggal berlaku terurut beserta harga & versinya, untuk bisect.
+    intervals = {key: (group['berlaku_mulai'].tolist(), group['harga'].tolist(), group['versi'].tolist())
+                 for key, group in history.groupby(STOCK_KEYS, sort=False)}
+    return {
+        'history': history,
+        'intervals': intervals,
+        'by_version': dict(zip(history['versi'], history['harga'])),
+        'next_version': int(history['versi'].max()) + 1 if not history.empty else 1,
+    }
+
+def get_price_index():
+    """(kode_bahan, warna) → sorted (berlaku_mulai, harga, versi) lists, plus versi → harga."""
+    return _build_price_index(get_data_version('harga_barang'))
+
+def get_price_at(kode_bahan, warna, when=None):
+    """(harga, versi) in effect for one item at `when` (default now); (None, None) if it has no price yet."""
+    dates, prices, versions = get_price_index()['intervals'].get((str(kode_bahan), str(warna)), ([], [], []))
+    position = bisect.bisect_right(dates, pd.Timestamp(when or datetime.now())) - 1
+    if position < 0:
+        return None, None
+    return prices[position], versions[position]
+
+def attach_prices_at(df, date_column):
+    """Adds harga and versi_harga in effect at each row's date_column, for all rows in one merge_asof.
+
+    Existing harga/versi_harga columns are replaced. Rows for items without price history get NaN.
+    """
+    history = get_price_index()['history']
+    left = df.drop(columns=['harga', 'versi_harga'], errors='ignore').assign(_row=range(len(df)))
+    left[date_column] = pd.to_datetime(left[date_column], errors='coerce').astype('datetime64[ns]')
+    for col in STOCK_KEYS:
+        left[col] = left[col].astype(str)
+    right = history[['berlaku_mulai'] + STOCK_KEYS + ['harga', 'versi']].rename(columns={'versi': 'versi_harga'})
+    right['berlaku_mulai'] = right['berlaku_mulai'].astype('datetime64[ns]')
+    for col in STOCK_KEYS:
+        right[col] = right[col].astype(str)
+    dated = left[left[date_column].notna()].sort_values(date_column, kind='mergesort')
+    merged = pd.merge_asof(dated, right, left_on=date_column, right_on='berlaku_mulai', by=STOCK_KEYS, direction='backward')
+    merged = pd.concat([merged, left[left[date_column].isna()]], ignore_index=True).sort_values('_row')
+    merged.index = df.index
+    return merged.drop(columns=['_row', 'berlaku_mulai'])
+
+def record_prices(rows, keterangan=''):
+    """Appends price versions for (kode_bahan, warna, harga, berlaku_mulai) tuples in one call. Returns the first versi."""
+    first = get_price_index()['next_version']
+    values = [[first + i, kode, warna, float(harga), pd.Timestamp(berlaku_mulai).strftime('%Y-%m-%d %H:%M:%S'), keterangan]
+              for i, (kode, warna, harga, berlaku_mulai) in enumerate(rows)]
+    return first if append_rows_to_gsheet('harga_barang', values) else None
+
+def backfill_price_history():
+    """Gives every master item without price history an initial version with its current price."""
+    master = get_master_barang()
+    if master.empty:
+        return
+    intervals = get_price_index()['intervals']
+    missing = master[[(str(k), str(w)) not in intervals for k, w in zip(master['kode_bahan'], master['warna'])]]
+    if not missing.empty:
+        record_prices([(k, w, h, PRICE_HISTORY_START) for k, w, h in zip(missing['kode_bahan'], missing['warna'], missing['harga'])], 'harga awal')
+
+def get_item_price_history(kode_bahan, warna):
+    history = get_price_index()['history']
+    return history[(history['kode_bahan'] == str(kode_bahan)) & (history['warna'] == str(warna))]
+
+# --- Stock Valuation ---
+def compute_stock_balances_at(dates):
+    """Balances of every item at each of `dates` (datetimes) in one pass over the sorted movements.
+
+    Returns a long frame [tanggal, kode_bahan, warna, stok]. All dates share the latest
+    checkpoint at or before the earliest date; per-item running totals of the movements
+    after it are matched to each date with merge_asof.
+    """
+    dates = sorted({pd.Timestamp(d) for d in dates})
+    if not dates:
+        return pd.DataFrame(columns=['tanggal'] + STOCK_KEYS + ['stok'])
+    first_date, last_date = dates[0], dates[-1]
+
+    checkpoints = get_stock_checkpoints()
+    checkpoints = checkpoints[checkpoints['tanggal_snapshot'] <= first_date]
+    base_date = checkpoints['tanggal_snapshot'].max() if not checkpoints.empty else None
+    if base_date is not None:
+        base = checkpoints[checkpoints['tanggal_snapshot'] == base_date].groupby(STOCK_KEYS)['stok'].sum()
+    else:
+        base = pd.Series(dtype='int64', index=pd.MultiIndex.from_tuples([], names=STOCK_KEYS))
+
+    boundary = get_archive_boundary()
+    include_archive = boundary is not None and (base_date is None or base_date < boundary)
+    movements = get_stock_movements(include_archive=include_archive)
+    movements = movements[movements['tanggal_waktu'].notna() & (movements['tanggal_waktu'] <= last_date)]
+    if base_date is not None:
+        movements = movements[movements['tanggal_waktu'] > base_date]
+    movements = movements.sort_values('tanggal_waktu', kind='mergesort')
+    movements['saldo_gerak'] = movements.groupby(STOCK_KEYS)['stok'].cumsum()
+
+    items = base.index.union(pd.MultiIndex.from_frame(movements[STOCK_KEYS].drop_duplicates()))
+    if len(items) == 0:
+        return pd.DataFrame(columns=['tanggal'] + STOCK_KEYS + ['stok'])
+    grid = pd.MultiIndex.from_product([dates, range(len(items))], names=['tanggal', 'item']).to_frame(index=False)
+    grid[STOCK_KEYS] = items.to_frame(index=False).iloc[grid['item']].to_numpy()
+    grid = grid.drop(columns='item').sort_values('tanggal', kind='mergesort')
+    grid['tanggal'] = grid['tanggal'].astype('datetime64[ns]')
+    movements['tanggal_waktu'] = movements['tanggal_waktu'].astype('datetime64[ns]')
+
+    result = pd.merge_asof(
+        grid, movements[['tanggal_waktu'] + STOCK_KEYS + ['saldo_gerak']].rename(columns={'tanggal_waktu': 'tanggal'}),
+        on='tanggal', by=STOCK_KEYS, direction='backward'
+    )
+    base_values = base.reindex(pd.MultiIndex.from_frame(result[STOCK_KEYS]), fill_value=0).to_numpy()
+    result['stok'] = (base_values + result['saldo_gerak'].fillna(0)).astype(int)
+    return result[['tanggal'] + STOCK_KEYS + ['stok']].reset_index(drop=True)
+
+def get_item_prices():
+    """Harga per (kode_bahan, warna) beserta rak dan supplier dari master_barang."""
+    master = get_master_barang()
+    if master.empty:
+        return pd.DataFrame(columns=STOCK_KEYS + ['nama_bahan', 'nama_supplier', 'rak', 'harga'])
+    master = master.copy()
+    for col in STOCK_KEYS:
+        master[col] = master[col].astype(str)
+    return master[STOCK_KEYS + ['nama_bahan', 'nama_supplier', 'rak', 'harga']].drop_duplicates(subset=STOCK_KEYS)
+
+def compute_stock_valuation(dates, group_by='rak'):
+    """Stock value per group at several dates. Returns (report, detail).
+
+    report has one row per group value and one column per date; detail is the long
+    frame with stok, harga and nilai for every item and date. Each date is valued at the
+    prices in effect on that date.
+    """
+    balances = compute_stock_balances_at(dates)
+    detail = balances.merge(get_item_prices().rename(columns={'harga': 'harga_master'}), on=STOCK_KEYS, how='left')
+    # Harga yang berlaku pada tiap tanggal; item tanpa riwayat harga memakai harga master.
+    detail = attach_prices_at(detail, 'tanggal')
+    detail['harga'] = detail['harga'].fillna(pd.to_numeric(detail['harga_master'], errors='coerce')).fillna(0)
+    detail['nilai'] = detail['stok'] * detail['harga']
+    if group_by == 'item':
+        detail['grup'] = detail['kode_bahan'] + ' (' + detail['warna'] + ')'
     else:
-        out_stock = 0
+        detail['grup'] = detail[group_by].fillna('(tanpa data master)').astype(str)
+    report = detail.pivot_table(index='grup', columns='tanggal', values='nilai', aggfunc='sum', fill_value=0)
+    report.columns = [col.strftime('%Y-%m-%d') for col in report.columns]
+    report.loc['TOTAL'] = report.sum()
+    return report, detail
+
+def compute_sales_report(start_date, end_date):
+    """Sales per item between two dates: qty, omzet and their value at the list price in effect.
+
+    The list price comes from the price version recorded at checkout; older invoice lines
+    without a version but with warna use the price in effect at the invoice date.
+    """
+    invoices = get_columns_from_gsheets('invoices', ['invoice_number', 'tanggal_waktu'])
+    items = get_data_from_gsheets('invoice_items').reindex(columns=SHEET_SCHEMA['invoice_items'])
+    columns = ['kode_bahan', 'nama_bahan', 'qty', 'omzet', 'harga_rata_rata', 'nilai_harga_daftar', 'selisih']
+    if invoices.empty or items.empty:
+        return pd.DataFrame(columns=columns)
+    dates = pd.to_datetime(invoices['tanggal_waktu'], errors='coerce')
+    invoices = invoices[(dates.dt.date >= start_date) & (dates.dt.date <= end_date)].astype(str)
+    sales = items.astype({'invoice_number': str}).merge(invoices, on='invoice_number')
+    if sales.empty:
+        return pd.DataFrame(columns=columns)
+    for col in ['qty', 'total']:
+        sales[col] = pd.to_numeric(sales[col], errors='coerce').fillna(0)
+    harga_daftar = pd.to_numeric(sales['versi_harga'], errors='coerce').map(get_price_index()['by_version'])
+    by_date = harga_daftar.isna() & sales['warna'].notna() & (sales['warna'].astype(str).str.strip() != '')
+    if by_date.any():
+        harga_daftar[by_date] = attach_prices_at(sales[by_date], 'tanggal_waktu')['harga']
+    sales['nilai_harga_daftar'] = sales['qty'] * harga_daftar
+    report = sales.groupby(['kode_bahan', 'nama_bahan'], as_index=False).agg(
+        qty=('qty', 'sum'), omzet=('total', 'sum'), nilai_harga_daftar=('nilai_harga_daftar', lambda values: values.sum(min_count=1)))
+    report['harga_rata_rata'] = (report['omzet'] / report['qty'].where(report['qty'] != 0)).round(2)
+    report['selisih'] = report['omzet'] - report['nilai_harga_daftar']
+    return report[columns].sort_values('omzet', ascending=False, kind='mergesort')
+
+def valuation_dates(start_date, end_date, frequency):
+    """Tanggal laporan (akhir hari) antara start_date dan end_date; tanggal akhir selalu ikut."""
+    days = pd.date_range(start_date, end_date, freq='D')
+    if frequency == 'Harian':
+        selected = days
+    elif frequency == 'Akhir Minggu':
+        selected = days[days.dayofweek == 6]
+    else:
+        selected = days[days.is_month_end]
+    selected = selected.union(pd.DatetimeIndex([pd.Timestamp(end_date)]))
+    return [day + pd.Timedelta(hours=23, minutes=59, seconds=59) for day in selected]
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_stock_balances(versions):
+    by_location = compute_stock_ledger(keys=LOCATION_KEYS)
+    return {'by_location': by_location, 'total': by_location.groupby(level=STOCK_KEYS).sum()}
+
+def _stock_balance_versions():
+    return tuple(get_data_version(name) for name in ['barang_masuk', 'barang_keluar', 'transfer_stok', 'stock_snapshot', 'app_meta'])
+
+def get_stock_balances():
+    """Stok saat ini untuk semua (kode_bahan, warna) dalam satu agregasi."""
+    return _build_stock_balances(_stock_balance_versions())['total']['stok']
+
+def get_yard_balances():
+    """Sisa yard per (kode_bahan, warna); dihitung dalam agregasi yang sama dengan stok."""
+    return _build_stock_balances(_stock_balance_versions())['total']['yard']
+
+def get_location_ledger():
+    """stok and yard per (kode_bahan, warna, lokasi)."""
+    return _build_stock_balances(_stock_balance_versions())['by_location']
+
+def get_location_balances():
+    """Stok saat ini per (kode_bahan, warna, lokasi); dihitung bersama saldo total."""
+    return get_location_ledger()['stok']
+
+# --- Reorder Alerts ---
+# Indeks item di bawah stok minimum. Dibangun sekali per versi data, lalu diperbarui per pergerakan stok.
+REORDER_SOURCES = ['master_barang', 'barang_masuk', 'barang_keluar', 'stock_snapshot', 'app_meta']
+
+def _reorder_versions():
+    return tuple(get_data_version(name) for name in REORDER_SOURCES)
+
+def _push_reorder_entry(engine, key):
+    # Entri lama di heap tidak dihapus; entri yang nilainya sudah berubah dilewati saat dibaca.
+    deficit = engine['thresholds'][key] - engine['balances'].get(key, 0)
+    if deficit > 0:
+        heapq.heappush(engine['heap'], (-deficit, key))
+
+def _build_reorder_engine():
+    engine = {'versions': _reorder_versions(), 'built_at': time.monotonic(), 'balances': {}, 'thresholds': {}, 'heap': []}
+    master = get_master_barang()
+    if master.empty:
+        return engine
+    with_threshold = master[master['min_stok'] > 0]
+    keys = list(zip(with_threshold['kode_bahan'].astype(str), with_threshold['warna'].astype(str)))
+    engine['thresholds'] = dict(zip(keys, with_threshold['min_stok'].tolist()))
+    balances = get_stock_balances()
+    engine['balances'] = dict(zip(keys, balances.reindex(pd.MultiIndex.from_tuples(keys, names=STOCK_KEYS), fill_value=0).tolist())) if keys else {}
+    for key in keys:
+        _push_reorder_entry(engine, key)
+    return engine
+
+def get_reorder_engine():
+    state = get_app_state()
+    engine = state.get('reorder')
+    if engine is not None and not index_expired(engine, REORDER_SOURCES) and engine['versions'] == _reorder_versions():
+        return engine
+    # Dibangun di luar lock (membaca sheet), lalu dipasang di bawah lock seperti get_row_index.
+    engine = _build_reorder_engine()
+    with state['lock']:
+        state['reorder'] = engine
+    return engine
+
+def record_stock_movement(sheet_name, kode_bahan, warna, delta):
+    """Applies one movement that was just appended to `sheet_name` to the reorder index."""
+    record_stock_movements(sheet_name, {(str(kode_bahan), str(warna)): delta})
+
+def record_stock_movements(sheet_name, deltas):
+    """Applies the net deltas of one write to `sheet_name` ((kode, warna) → qty) to the reorder index.
+
+    If the index was in sync before this write it is updated in place; otherwise it is
+    left alone and rebuilt on the next read.
+    """
+    state = get_app_state()
+    with state['lock']:
+        engine = state.get('reorder')
+        if engine is None:
+            return
+        current = _reorder_versions()
+        expected = tuple(v - 1 if name == sheet_name else v for name, v in zip(REORDER_SOURCES, current))
+        if engine['versions'] != expected:
+            return
+        engine['versions'] = current
+        for key, delta in deltas.items():
+            if key in engine['thresholds']:
+                engine['balances'][key] = engine['balances'].get(key, 0) + int(delta)
+                _push_reorder_entry(engine, key)
+        # Buang entri basi agar heap tidak terus membesar.
+        if len(engine['heap']) > 4 * len(engine['thresholds']) + 16:
+            engine['heap'] = []
+            for threshold_key in engine['thresholds']:
+                _push_reorder_entry(engine, threshold_key)
+
+def get_reorder_alerts(limit=None):
+    """Items below their min_stok, most urgent first, as a list of (key, stok, min_stok, kekurangan)."""
+    engine = get_reorder_engine()
+    with get_app_state()['lock']:
+        heap = list(engine['heap'])
+        alerts = []
+        seen = set()
+        while heap and (limit is None or len(alerts) < limit):
+            neg_deficit, key = heapq.heappop(heap)
+            if key in seen:
+                continue
+            current = engine['thresholds'][key] - engine['balances'].get(key, 0)
+            if current != -neg_deficit:
+                continue
+            seen.add(key)
+            alerts.append((key, engine['balances'].get(key, 0), engine['thresholds'][key], current))
+        return alerts
+
+def get_reorder_export():
+    """Reorder list grouped by supplier, built only from the items that are below threshold."""
+    records = get_master_lookup()['records']
+    by_key = {(str(k), str(w)): rec for (k, w), rec in records.items()}
+    rows = []
+    for key, stok, min_stok, kekurangan in get_reorder_alerts():
+        record = by_key.get(key, {})
+        rows.append({
+            'nama_supplier': record.get('nama_supplier', ''),
+            'kode_bahan': key[0],
+            'warna': key[1],
+            'nama_bahan': record.get('nama_bahan', ''),
+            'rak': record.get('rak', ''),
+            'stok': stok,
+            'min_stok': min_stok,
+            'jumlah_order': kekurangan,
+        })
+    df = pd.DataFrame(rows, columns=['nama_supplier', 'kode_bahan', 'warna', 'nama_bahan', 'rak', 'stok', 'min_stok', 'jumlah_order'])
+    return df.sort_values(['nama_supplier', 'jumlah_order'], ascending=[True, False], kind='mergesort')
+
+def get_stock_balance(kode_bahan, warna):
+    return get_stock_balances().get((str(kode_bahan), str(warna)), 0)
 
-    return in_stock - out_stock
+def get_item_location_stock(kode_bahan, warna):
+    """lokasi → stok of one item (locations with a non-zero balance only)."""
+    return {lokasi: int(row['stok']) for lokasi, row in get_item_location_ledger(kode_bahan, warna).items() if row['stok'] != 0}
+
+def get_item_location_ledger(kode_bahan, warna):
+    """lokasi → {'stok', 'yard'} of one item, for every location it has been stored in."""
+    ledger = get_location_ledger()
+    try:
+        item = ledger.loc[(str(kode_bahan), str(warna))]
+    except KeyError:
+        return {}
+    return item.to_dict('index')
+
+def get_yard_balance(kode_bahan, warna):
+    return float(get_yard_balances().get((str(kode_bahan), str(warna)), 0.0))
+
+def get_location_stock_table():
+    """Items × locations pivot of the current balances, with a Total column."""
+    by_location = get_location_balances()
+    if by_location.empty:
+        return pd.DataFrame(columns=STOCK_KEYS + ['Total', 'Total Yard'])
+    table = by_location.unstack('lokasi', fill_value=0)
+    table['Total'] = table.sum(axis=1)
+    table['Total Yard'] = get_yard_balances().reindex(table.index, fill_value=0.0).round(2)
+    table.columns.name = None
+    return table.reset_index()
+
+# --- Locations & Transfers ---
+def get_locations():
+    df = get_columns_from_gsheets('lokasi', ['nama_lokasi'])
+    names = df['nama_lokasi'].dropna().astype(str).str.strip().tolist() if not df.empty else []
+    names = [name for name in names if name]
+    return names if LOKASI_DEFAULT in names else [LOKASI_DEFAULT] + names
+
+def add_location(nama_lokasi, keterangan=''):
+    nama_lokasi = str(nama_lokasi).strip()
+    if not nama_lokasi or nama_lokasi in get_locations():
+        return False
+    return append_row_to_gsheet('lokasi', [nama_lokasi, keterangan])
+
+def add_stock_transfer(kode_bahan, warna, stok, dari_lokasi, ke_lokasi, keterangan='', yard=None):
+    """Moves stock between two locations of the same item. Returns (success, message).
+
+    yard=None moves the source's yards in proportion to the units moved.
+    """
+    if dari_lokasi == ke_lokasi:
+        return False, "Lokasi asal dan tujuan harus berbeda."
+    source = get_item_location_ledger(kode_bahan, warna).get(dari_lokasi, {'stok': 0, 'yard': 0.0})
+    if stok <= 0 or stok > source['stok']:
+        return False, f"Stok di {dari_lokasi} tidak mencukupi. Stok saat ini: {int(source['stok'])}"
+    if yard is None:
+        yard = round(source['yard'] * stok / source['stok'], 2) if source['yard'] > 0 else 0.0
+    if yard > source['yard'] + 1e-9:
+        return False, f"Yard di {dari_lokasi} tidak mencukupi. Sisa yard: {source['yard']:,.2f}"
+    tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if not append_row_to_gsheet('transfer_stok', [tanggal_waktu, kode_bahan, warna, int(stok), dari_lokasi, ke_lokasi, keterangan, float(yard)]):
+        return False, "Gagal mencatat transfer."
+    append_stock_events([
+        stock_event('transfer', 'transfer_stok', tanggal_waktu, kode_bahan, warna, dari_lokasi, -stok, -yard, keterangan),
+        stock_event('transfer', 'transfer_stok', tanggal_waktu, kode_bahan, warna, ke_lokasi, stok, yard, keterangan),
+    ])
+    return True, f"{int(stok)} ({yard:,.2f} yard) dipindahkan dari {dari_lokasi} ke {ke_lokasi}."
+
+def attach_stock_balance(df, column='Stok Saat Ini', yard_column=None):
+    """Adds the current balance of each (kode_bahan, warna) row of df as a new column.
+
+    With yard_column, the remaining yards are added too, from the same cached ledger.
+    """
+    keys = pd.MultiIndex.from_arrays([df['kode_bahan'].astype(str), df['warna'].astype(str)])
+    df[column] = get_stock_balances().reindex(keys, fill_value=0).to_numpy()
+    if yard_column:
+        df[yard_column] = get_yard_balances().reindex(keys, fill_value=0.0).round(2).to_numpy()
+    return df
 
 def get_in_out_records(start_date, end_date):
     df_in = get_barang_masuk()
     df_out = get_barang_keluar()
-    
-    if df_in.empty and df_out.empty:
-        return pd.DataFrame()
+    boundary = get_archive_boundary()
+    if boundary is not None and start_date <= boundary.date():
+        # Rentang tanggal menyentuh data yang sudah diarsipkan
+        df_in = pd.concat([_get_movement_columns('barang_masuk_arsip', SHEET_SCHEMA['barang_masuk_arsip']), df_in], ignore_index=True)
+        df_out = pd.concat([_get_movement_columns('barang_keluar_arsip', SHEET_SCHEMA['barang_keluar_arsip']), df_out], ignore_index=True)
 
     if not df_in.empty:
         df_in['tanggal_waktu'] = pd.to_datetime(df_in['tanggal_waktu'])
         df_in = df_in[(df_in['tanggal_waktu'].dt.date >= start_date) & (df_in['tanggal_waktu'].dt.date <= end_date)]
-        df_in = df_in.assign(qty=df_in['stok'], type='Masuk', keterangan=df_in['keterangan'])
+        df_in = df_in.assign(qty=df_in['stok'], type='Masuk', lokasi=_fill_lokasi(df_in['lokasi']))
     
     if not df_out.empty:
         df_out['tanggal_waktu'] = pd.to_datetime(df_out['tanggal_waktu'])
         df_out = df_out[(df_out['tanggal_waktu'].dt.date >= start_date) & (df_out['tanggal_waktu'].dt.date <= end_date)]
-        df_out = df_out.assign(qty=df_out['stok'], type='Keluar', keterangan=df_out['keterangan'])
+        df_out = df_out.assign(qty=df_out['stok'], type='Keluar', lokasi=_fill_lokasi(df_out['lokasi']))
     
-    df = pd.concat([df_in[['tanggal_waktu', 'kode_bahan', 'warna', 'qty', 'type', 'keterangan']], 
-                    df_out[['tanggal_waktu', 'kode_bahan', 'warna', 'qty', 'type', 'keterangan']]], ignore_index=True)
+    df_transfer = _get_movement_columns('transfer_stok', SHEET_SCHEMA['transfer_stok'])
+    if not df_transfer.empty:
+        df_transfer['tanggal_waktu'] = pd.to_datetime(df_transfer['tanggal_waktu'])
+        df_transfer = df_transfer[(df_transfer['tanggal_waktu'].dt.date >= start_date) & (df_transfer['tanggal_waktu'].dt.date <= end_date)]
+        df_transfer = df_transfer.assign(qty=df_transfer['stok'], type='Transfer',
+                                         lokasi=df_transfer['dari_lokasi'].astype(str) + ' → ' + df_transfer['ke_lokasi'].astype(str))
+
+    columns = ['tanggal_waktu', 'kode_bahan', 'warna', 'qty', 'type', 'lokasi', 'keterangan']
+    df = pd.concat([df_in.reindex(columns=columns), df_out.reindex(columns=columns), df_transfer.reindex(columns=columns)], ignore_index=True)
     
     df = df.sort_values(by='tanggal_waktu')
     return df
 
+# --- Stock Event Log ---
+# Setiap perubahan stok juga dicatat sebagai event bernomor urut (seq) di worksheet stock_events.
+# Log hanya ditambah, tidak pernah diubah, sehingga edit/hapus barang masuk tetap meninggalkan jejak
+# dan saldo bisa dibangun ulang dari log lalu dibandingkan dengan saldo dari worksheet pergerakan.
+STOCK_EVENT_COLUMNS = ['seq', 'jenis', 'kode_bahan', 'warna', 'lokasi', 'stok', 'yard']
+YARD_TOLERANCE = 1e-6
+
+def stock_event(jenis, sumber, ref, kode_bahan, warna, lokasi, stok, yard=0.0, keterangan=''):
+    """One event (signed stok/yard deltas) without seq and tanggal_waktu; see append_stock_events."""
+    return [jenis, sumber, str(ref), str(kode_bahan), str(warna), lokasi or LOKASI_DEFAULT, int(stok), float(yard), keterangan or '']
+
+def _event_lock():
+    state = get_app_state()
+    with state['lock']:
+        return state.setdefault('event_lock', threading.Lock())
+
+def _next_event_seq():
+    """Next free seq. Remembered after each append, so only the first append of a process reads the sheet."""
+    cached = get_app_state().get('event_seq')
+    if cached and cached['version'] == get_data_version('stock_events'):
+        return cached['next']
+    seqs = pd.to_numeric(get_columns_from_gsheets('stock_events', ['seq'])['seq'], errors='coerce')
+    return int(seqs.max()) + 1 if seqs.notna().any() else 1
+
+def append_stock_events(events):
+    """Numbers `events` with consecutive seq values and appends them in one call."""
+    if not events:
+        return True
+    # Nomor urut dialokasikan dan ditulis di bawah satu lock agar dua sesi tidak memakai seq yang sama.
+    with _event_lock():
+        first = _next_event_seq()
+        tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [[first + i, tanggal_waktu] + event for i, event in enumerate(events)]
+        if not append_rows_to_gsheet('stock_events', rows):
+            return False
+        get_app_state()['event_seq'] = {'version': get_data_version('stock_events'), 'next': first + len(rows)}
+        return True
+
+def bootstrap_stock_events():
+    """Seeds an empty log with one saldo_awal event per (item, lokasi) from the current ledger."""
+    if not get_columns_from_gsheets('stock_events', ['seq']).empty:
+        return
+    ledger = compute_stock_ledger(keys=LOCATION_KEYS)
+    ledger = ledger[(ledger['stok'] != 0) | (ledger['yard'].abs() > YARD_TOLERANCE)]
+    append_stock_events([
+        stock_event('saldo_awal', 'stok', '', kode, warna, lokasi, stok, yard)
+        for (kode, warna, lokasi), stok, yard in zip(ledger.index, ledger['stok'], ledger['yard'])
+    ])
+
+def get_stock_events(columns=STOCK_EVENT_COLUMNS):
+    """Event rows sorted by seq, with numeric seq/stok/yard."""
+    df = get_columns_from_gsheets('stock_events', columns)
+    df['seq'] = pd.to_numeric(df['seq'], errors='coerce')
+    df = df.dropna(subset=['seq']).astype({'seq': int})
+    for col in STOCK_MEASURES:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    for col in STOCK_KEYS:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    if 'lokasi' in df.columns:
+        df['lokasi'] = _fill_lokasi(df['lokasi'])
+    return df.sort_values('seq', kind='mergesort').reset_index(drop=True)
+
+def replay_stock_events(upto_seq=None, keys=LOCATION_KEYS):
+    """Balances rebuilt from the event log alone, optionally only up to and including seq upto_seq.
+
+    The log is sorted by seq, so the cut-off is a binary search followed by one groupby.
+    """
+    events = get_stock_events()
+    if upto_seq is not None:
+        events = events.iloc[:events['seq'].searchsorted(upto_seq, side='right')]
+    return events.groupby(keys)[STOCK_MEASURES].sum().astype({'stok': int, 'yard': float})
+
+def _sequence_problems(seqs):
+    """Duplicate and missing seq numbers, as a frame [seq, masalah]."""
+    duplicates = seqs[seqs.duplicated()].unique()
+    missing = sorted(set(range(1, int(seqs.max()) + 1)) - set(seqs)) if not seqs.empty else []
+    return pd.DataFrame(
+        [(seq, 'duplikat') for seq in duplicates] + [(seq, 'hilang') for seq in missing],
+        columns=['seq', 'masalah'],
+    )
+
+def _match_invoice_numbers(keluar, invoices):
+    """Fills blank invoice_number of barang_keluar rows by their timestamp.
+
+    Rows written before barang_keluar had an invoice_number share the exact tanggal_waktu of their
+    invoice; a timestamp used by more than one invoice stays unmatched.
+    """
+    unique_times = invoices.drop_duplicates('tanggal_waktu', keep=False).set_index('tanggal_waktu')['invoice_number']
+    blank = keluar['invoice_number'].fillna('').astype(str).str.strip() == ''
+    keluar.loc[blank, 'invoice_number'] = keluar.loc[blank, 'tanggal_waktu'].astype(str).map(unique_times)
+    return keluar
+
+def check_stock_consistency():
+    """Cross-checks invoices, invoice_items, barang_keluar and the event log in one set-based pass.
+
+    Returns a dict of report name → DataFrame of the offending rows (empty frame = consistent):
+    - invoice_tanpa_item: invoice headers without any item (a checkout that stopped half way)
+    - item_tanpa_invoice: invoice_items whose invoice header does not exist
+    - selisih_barang_keluar: per (invoice, kode_bahan), qty on the invoice vs qty in barang_keluar
+    - selisih_saldo: per (item, lokasi), balance replayed from the log vs balance from the movement sheets
+    - seq_bermasalah: duplicate or missing seq numbers in the log
+    """
+    invoices = get_data_from_gsheets('invoices').reindex(columns=SHEET_SCHEMA['invoices']).astype(str)
+    items = get_data_from_gsheets('invoice_items').reindex(columns=SHEET_SCHEMA['invoice_items'])
+    items = items.astype({'invoice_number': str, 'kode_bahan': str}).assign(qty=pd.to_numeric(items['qty'], errors='coerce').fillna(0))
+    keluar_columns = ['tanggal_waktu', 'kode_bahan', 'stok', 'invoice_number']
+    keluar = pd.concat([_get_movement_columns(name, keluar_columns) for name in ['barang_keluar_arsip', 'barang_keluar']], ignore_index=True)
+    keluar = _match_invoice_numbers(keluar.astype({'tanggal_waktu': str, 'kode_bahan': str}), invoices)
+    keluar['invoice_number'] = keluar['invoice_number'].fillna('(tanpa invoice)')
+
+    report = {
+        'invoice_tanpa_item': invoices[~invoices['invoice_number'].isin(items['invoice_number'])],
+        'item_tanpa_invoice': items[~items['invoice_number'].isin(invoices['invoice_number'])],
+    }
+
+    invoice_qty = items.groupby(['invoice_number', 'kode_bahan'])['qty'].sum().rename('qty_invoice')
+    keluar_qty = keluar.groupby(['invoice_number', 'kode_bahan'])['stok'].sum().rename('qty_keluar')
+    qty = pd.concat([invoice_qty, keluar_qty], axis=1).fillna(0)
+    qty['selisih'] = qty['qty_invoice'] - qty['qty_keluar']
+    report['selisih_barang_keluar'] = qty[qty['selisih'] != 0].reset_index()
+
+    balances = pd.concat([replay_stock_events().add_suffix('_log'), compute_stock_ledger(keys=LOCATION_KEYS).add_suffix('_sheet')], axis=1).fillna(0)
+    drift = balances.assign(selisih_stok=balances['stok_log'] - balances['stok_sheet'], selisih_yard=balances['yard_log'] - balances['yard_sheet'])
+    report['selisih_saldo'] = drift[(drift['selisih_stok'] != 0) | (drift['selisih_yard'].abs() > YARD_TOLERANCE)].reset_index()
+
+    report['seq_bermasalah'] = _sequence_problems(get_stock_events(['seq'])['seq'])
+    return report
+
 # --- Invoice Functions ---
 def get_invoices():
     return get_data_from_gsheets('invoices')
@@ -311,13 +2752,15 @@ def get_barang_keluar():
     df = get_data_from_gsheets('barang_keluar')
     if df.empty:
         # Perbaikan: Buat DataFrame kosong dengan kolom yang dibutuhkan
-        return pd.DataFrame(columns=['tanggal_waktu', 'kode_bahan', 'warna', 'stok', 'yard', 'keterangan'])
+        return pd.DataFrame(columns=SHEET_SCHEMA['barang_keluar'])
 
     df['stok'] = pd.to_numeric(df['stok'], errors='coerce').fillna(0).astype(int)
     df['yard'] = pd.to_numeric(df['yard'], errors='coerce').fillna(0.0)
+    df['lokasi'] = _fill_lokasi(df['lokasi']) if 'lokasi' in df.columns else LOKASI_DEFAULT
     return df
     
-def generate_invoice_pdf(invoice_data, invoice_items):
+def generate_invoice_pdf(invoice_data, invoice_items, progress=None):
+    from fpdf import FPDF
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     pdf.add_page()
     pdf.set_font("Arial", 'B', 16)
@@ -382,55 +2825,478 @@ def generate_invoice_number():
     new_invoice_number = f"{prefix}{new_seq:03d}"
     return new_invoice_number
 
-def add_barang_keluar_and_invoice(invoice_number, customer_name, items):
+def add_barang_keluar_and_invoice(invoice_number, customer_name, items, customer_id=None, dibayar=None, metode='Tunai'):
+    """Saves a sale. dibayar is the amount paid at checkout; None means paid in full."""
     tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # Check stock before starting transactions
+    # Check units and yards before starting transactions, per pick location (the same item may appear twice)
+    requested = {}
     for item in items:
-        current_stock = get_stock_balance(item['kode_bahan'], item['warna'])
-        if item['qty'] > current_stock:
-            return False, f"Stok untuk item {item['nama_bahan']} ({item['warna']}) tidak mencukupi. Stok saat ini: {current_stock}"
+        key = (str(item['kode_bahan']), str(item['warna']), item.get('lokasi') or LOKASI_DEFAULT)
+        qty, yard = requested.get(key, (0, 0.0))
+        requested[key] = (qty + item['qty'], yard + float(item['yard']))
+    ledger = get_location_ledger()
+    for item in items:
+        key = (str(item['kode_bahan']), str(item['warna']), item.get('lokasi') or LOKASI_DEFAULT)
+        current_stock = int(ledger['stok'].get(key, 0))
+        current_yard = float(ledger['yard'].get(key, 0.0))
+        if requested[key][0] > current_stock:
+            return False, f"Stok untuk item {item['nama_bahan']} ({item['warna']}) di {key[2]} tidak mencukupi. Stok saat ini: {current_stock}"
+        if requested[key][1] > current_yard + 1e-9:
+            return False, f"Yard untuk item {item['nama_bahan']} ({item['warna']}) di {key[2]} tidak mencukupi. Sisa yard: {current_yard:,.2f}"
 
     # Insert into invoices table
-    if not append_row_to_gsheet('invoices', [invoice_number, tanggal_waktu, customer_name]):
+    if not append_row_to_gsheet('invoices', [invoice_number, tanggal_waktu, customer_name, customer_id if customer_id is not None else '']):
         return False, "Gagal membuat invoice."
     
-    # Insert items and outgoing goods
+    # Insert items and outgoing goods, one batch each so a failure leaves as little half-written as possible
+    if not append_rows_to_gsheet('invoice_items', [[invoice_number, item['kode_bahan'], item['nama_bahan'], item['qty'], item['harga'], item['total'],
+                                                     item['warna'], item.get('versi_harga') or ''] for item in items]):
+        return False, "Gagal menambahkan item ke invoice."
+    invoice_total = sum(item['total'] for item in items)
+    if customer_id is not None:
+        record_customer_sale(customer_id, invoice_number, tanggal_waktu, invoice_total)
+    record_receivable(invoice_number, customer_id, tanggal_waktu, invoice_total)
+    if not append_rows_to_gsheet('barang_keluar', [[tanggal_waktu, item['kode_bahan'], item['warna'], item['qty'], item['yard'], item['keterangan'], item.get('lokasi') or LOKASI_DEFAULT, invoice_number] for item in items]):
+        return False, "Gagal mencatat barang keluar."
+    deltas = {}
     for item in items:
-        if not append_row_to_gsheet('invoice_items', [invoice_number, item['kode_bahan'], item['nama_bahan'], item['qty'], item['harga'], item['total']]):
-            return False, "Gagal menambahkan item ke invoice."
-        if not append_row_to_gsheet('barang_keluar', [tanggal_waktu, item['kode_bahan'], item['warna'], item['qty'], item['yard'], item['keterangan']]):
-            return False, "Gagal mencatat barang keluar."
+        key = (str(item['kode_bahan']), str(item['warna']))
+        deltas[key] = deltas.get(key, 0) - item['qty']
+    record_stock_movements('barang_keluar', deltas)
+    append_stock_events([
+        stock_event('keluar', 'barang_keluar', invoice_number, item['kode_bahan'], item['warna'], item.get('lokasi'), -item['qty'], -float(item['yard']), item['keterangan'])
+        for item in items
+    ])
+    dibayar = invoice_total if dibayar is None else min(float(dibayar), invoice_total)
+    if dibayar > 0:
+        success, message = post_payment(invoice_number, dibayar, metode, 'dibayar saat transaksi', tanggal_waktu)
+        if not success:
+            return False, f"Invoice dibuat, tetapi pembayaran gagal dicatat: {message}"
     
     return True, "Transaksi berhasil dicatat dan invoice dibuat."
 
+# --- Customers ---
+# Master pelanggan dengan id tetap. Invoice menyimpan customer_id; nama pelanggan di invoice tetap
+# disimpan apa adanya untuk tampilan dan PDF.
+CUSTOMER_LEDGER_SOURCES = ['invoices', 'invoice_items']
+
+def _customer_key(name):
+    """Name normalised for matching: surrounding/double spaces removed, case-insensitive."""
+    return ' '.join(str(name).split()).casefold()
+
+def get_customers():
+    df = get_data_from_gsheets('customers')
+    if df.empty:
+        return pd.DataFrame(columns=SHEET_SCHEMA['customers'])
+    df['customer_id'] = pd.to_numeric(df['customer_id'], errors='coerce')
+    df = df.dropna(subset=['customer_id']).astype({'customer_id': int})
+    df[['nama_pelanggan', 'kontak']] = df[['nama_pelanggan', 'kontak']].fillna('').astype(str)
+    return df
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_customer_lookup(version):
+    df = get_customers()
+    ids = df['customer_id'].tolist()
+    keys = df['nama_pelanggan'].map(_customer_key).tolist()
+    labels = df['customer_id'].astype(str) + ' - ' + df['nama_pelanggan'] + df['kontak'].map(lambda kontak: f" ({kontak})" if kontak else '')
+    # Setiap nama diindeks utuh dan per kata, diurutkan agar pencarian awalan cukup dengan bisect.
+    tokens = sorted({(token, customer_id) for key, customer_id in zip(keys, ids) for token in [key] + key.split()})
+    return {
+        'records': dict(zip(ids, df.to_dict('records'))),
+        'labels': dict(zip(ids, labels.tolist())),
+        'by_name': dict(reversed(list(zip(keys, ids)))),
+        'tokens': tokens,
+    }
+
+def get_customer_lookup():
+    """customer_id → customers record, picker labels, normalised name → id and the autocomplete tokens."""
+    return _build_customer_lookup(get_data_version('customers'))
+
+def search_customers(text, limit=20):
+    """Ids of customers whose name, or a word in it, starts with `text`."""
+    lookup = get_customer_lookup()
+    key = _customer_key(text)
+    if not key:
+        return list(lookup['records'])[:limit]
+    tokens = lookup['tokens']
+    found = []
+    position = bisect.bisect_left(tokens, (key,))
+    while position < len(tokens) and tokens[position][0].startswith(key) and len(found) < limit:
+        customer_id = tokens[position][1]
+        if customer_id not in found:
+            found.append(customer_id)
+        position += 1
+    return found
+
+def add_customer(nama, kontak=''):
+    """Returns the customer_id for `nama`, creating the customer if no customer has that name yet."""
+    nama = ' '.join(str(nama).split())
+    if not nama:
+        return None
+    lookup = get_customer_lookup()
+    existing = lookup['by_name'].get(_customer_key(nama))
+    if existing is not None:
+        return existing
+    customer_id = max(lookup['records'], default=0) + 1
+    if not append_row_to_gsheet('customers', [customer_id, nama, kontak]):
+        return None
+    return customer_id
+
+def update_customer(customer_id, nama, kontak):
+    row_index = find_row_for_write('customers', customer_id)
+    if row_index is None or get_customer_lookup()['by_name'].get(_customer_key(nama), customer_id) != customer_id:
+        return False
+    return update_row_in_gsheet('customers', row_index, [customer_id, ' '.join(str(nama).split()), kontak])
+
+def backfill_customer_ids():
+    """Links invoices without a customer_id to the customer with the same name, creating missing customers."""
+    invoices = get_data_from_gsheets('invoices')
+    if invoices.empty:
+        return
+    ids = pd.to_numeric(invoices['customer_id'], errors='coerce') if 'customer_id' in invoices.columns else pd.Series(float('nan'), index=invoices.index)
+    keys = invoices['customer_name'].fillna('').map(_customer_key)
+    missing = ids.isna() & (keys != '')
+    if not missing.any():
+        return
+    lookup = get_customer_lookup()
+    by_name = dict(lookup['by_name'])
+    new_customers = keys[missing & ~keys.isin(by_name)].drop_duplicates()
+    next_id = max(lookup['records'], default=0) + 1
+    rows = []
+    for offset, (idx, key) in enumerate(new_customers.items()):
+        by_name[key] = next_id + offset
+        rows.append([next_id + offset, ' '.join(str(invoices.at[idx, 'customer_name']).split()), ''])
+    append_rows_to_gsheet('customers', rows)
+    filled = ids.where(~missing, keys.map(by_name))
+    worksheet = get_worksheet('invoices')
+    letter = _column_letter(SHEET_SCHEMA['invoices'].index('customer_id') + 1)
+    last_index = int(invoices.index.max())
+    values = [[int(filled[i])] if i in filled.index and pd.notna(filled[i]) else [''] for i in range(last_index + 1)]
+    sheets_call('write', worksheet.update, f"{letter}2:{letter}{last_index + 2}", values)
+    st.cache_data.clear()
+    bump_data_version('invoices')
+
+def _customer_ledger_versions():
+    return tuple(get_data_version(name) for name in CUSTOMER_LEDGER_SOURCES)
+
+def _build_customer_ledger():
+    """Per-customer totals plus each customer's invoices, from one pass over invoices and invoice_items."""
+    ledger = {'versions': _customer_ledger_versions(), 'built_at': time.monotonic(),
+              'customers': {}, 'invoices_by_customer': {}, 'invoices': {}}
+    invoices = get_columns_from_gsheets('invoices', ['invoice_number', 'tanggal_waktu', 'customer_id'])
+    if invoices.empty:
+        return ledger
+    items = get_columns_from_gsheets('invoice_items', ['invoice_number', 'total'])
+    totals = pd.to_numeric(items['total'], errors='coerce').fillna(0).groupby(items['invoice_number'].astype(str)).sum()
+    invoices = invoices.assign(
+        invoice_number=invoices['invoice_number'].astype(str),
+        tanggal_waktu=invoices['tanggal_waktu'].astype(str),
+        customer_id=pd.to_numeric(invoices['customer_id'], errors='coerce'),
+    )
+    invoices['total'] = invoices['invoice_number'].map(totals).fillna(0.0)
+    invoices = invoices.dropna(subset=['customer_id']).astype({'customer_id': int}).sort_values('tanggal_waktu', kind='mergesort')
+    ledger['invoices'] = {number: {'tanggal_waktu': tanggal, 'total': float(total)}
+                          for number, tanggal, total in zip(invoices['invoice_number'], invoices['tanggal_waktu'], invoices['total'])}
+    grouped = invoices.groupby('customer_id')
+    ledger['invoices_by_customer'] = grouped['invoice_number'].agg(list).to_dict()
+    summary = grouped.agg(total_belanja=('total', 'sum'), jumlah_invoice=('invoice_number', 'size'), pembelian_terakhir=('tanggal_waktu', 'max'))
+    ledger['customers'] = {int(customer_id): {'total_belanja': float(row.total_belanja), 'jumlah_invoice': int(row.jumlah_invoice),
+                                              'pembelian_terakhir': row.pembelian_terakhir}
+                           for customer_id, row in zip(summary.index, summary.itertuples(index=False))}
+    return ledger
+
+def get_customer_ledger():
+    state = get_app_state()
+    ledger = state.get('customer_ledger')
+    if ledger is not None and not index_expired(ledger, CUSTOMER_LEDGER_SOURCES) and ledger['versions'] == _customer_ledger_versions():
+        return ledger
+    # Dibangun di luar lock (membaca sheet), lalu dipasang di bawah lock seperti get_row_index.
+    ledger = _build_customer_ledger()
+    with state['lock']:
+        state['customer_ledger'] = ledger
+    return ledger
+
+def record_customer_sale(customer_id, invoice_number, tanggal_waktu, total):
+    """Applies a checkout (one invoices append + one invoice_items append) to the customer ledger.
+
+    Same rule as the reorder index: updated in place only if it was current before the
+    checkout, otherwise rebuilt on the next read.
+    """
+    state = get_app_state()
+    with state['lock']:
+        ledger = state.get('customer_ledger')
+        if ledger is None:
+            return
+        current = _customer_ledger_versions()
+        if ledger['versions'] != tuple(v - 1 for v in current):
+            return
+        ledger['versions'] = current
+        ledger['invoices'][invoice_number] = {'tanggal_waktu': tanggal_waktu, 'total': float(total)}
+        ledger['invoices_by_customer'].setdefault(customer_id, []).append(invoice_number)
+        entry = ledger['customers'].setdefault(customer_id, {'total_belanja': 0.0, 'jumlah_invoice': 0, 'pembelian_terakhir': ''})
+        entry['total_belanja'] += float(total)
+        entry['jumlah_invoice'] += 1
+        entry['pembelian_terakhir'] = max(entry['pembelian_terakhir'], tanggal_waktu)
+
+def get_customer_summary():
+    """Customer master joined with the ledger (total, invoice count, last purchase) and the open receivables."""
+    customers = get_customers()[['customer_id', 'nama_pelanggan', 'kontak']]
+    entries = get_customer_ledger()['customers']
+    summary = pd.DataFrame.from_dict(entries, orient='index', columns=['total_belanja', 'jumlah_invoice', 'pembelian_terakhir'])
+    summary = customers.merge(summary, left_on='customer_id', right_index=True, how='left')
+    summary = summary.fillna({'total_belanja': 0.0, 'jumlah_invoice': 0, 'pembelian_terakhir': '-'}).astype({'jumlah_invoice': int})
+    summary['sisa_tagihan'] = summary['customer_id'].map(get_outstanding_by_customer()).fillna(0.0)
+    return summary
+
+def get_customer_statement(customer_id):
+    """The customer's invoices with a running total, built from that customer's invoices only."""
+    ledger = get_customer_ledger()
+    rows = [{'invoice_number': number, **ledger['invoices'][number], 'sisa': get_invoice_outstanding(number)}
+            for number in ledger['invoices_by_customer'].get(customer_id, [])]
+    statement = pd.DataFrame(rows, columns=['invoice_number', 'tanggal_waktu', 'total', 'sisa'])
+    statement['total_berjalan'] = statement['total'].cumsum()
+    return statement
+
+# --- Receivables ---
+# Piutang per invoice = total item invoice − pembayaran. Invoice sebelum tanggal PIUTANG_MULAI_KEY dibuat
+# sebelum pembayaran dicatat, sehingga dianggap lunas. Indeks invoice terbuka disimpan di state proses
+# dan diperbarui di tempat saat checkout/pembayaran; umur piutang dihitung sekaligus untuk semua invoice.
+PIUTANG_MULAI_KEY = 'piutang_mulai'
+RECEIVABLE_SOURCES = ['invoices', 'invoice_items', 'payments', 'app_meta']
+AGING_BUCKETS = ['0-30 hari', '31-60 hari', '61-90 hari', '>90 hari']
+AGING_BINS = [float('-inf'), 30, 60, 90, float('inf')]
+PAYMENT_METHODS = ['Tunai', 'Transfer', 'Lainnya']
+AMOUNT_TOLERANCE = 0.005
+
+def ensure_receivables_start():
+    """Stores the date payment tracking started, once."""
+    if get_app_meta(PIUTANG_MULAI_KEY) is None:
+        set_app_meta(PIUTANG_MULAI_KEY, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+def _receivable_versions():
+    return tuple(get_data_version(name) for name in RECEIVABLE_SOURCES)
+
+def _build_receivables():
+    """Open invoices (outstanding > 0) from one pass over invoices, invoice_items and payments."""
+    engine = {'versions': _receivable_versions(), 'built_at': time.monotonic(), 'open': {}, 'aging': None}
+    invoices = get_columns_from_gsheets('invoices', ['invoice_number', 'tanggal_waktu', 'customer_id'])
+    if invoices.empty:
+        return engine
+    items = get_columns_from_gsheets('invoice_items', ['invoice_number', 'total'])
+    payments = get_columns_from_gsheets('payments', ['invoice_number', 'jumlah'])
+    totals = pd.to_numeric(items['total'], errors='coerce').fillna(0).groupby(items['invoice_number'].astype(str)).sum()
+    paid = pd.to_numeric(payments['jumlah'], errors='coerce').fillna(0).groupby(payments['invoice_number'].astype(str)).sum()
+    invoices = invoices.assign(invoice_number=invoices['invoice_number'].astype(str), tanggal_waktu=invoices['tanggal_waktu'].astype(str))
+    invoices['total'] = invoices['invoice_number'].map(totals).fillna(0.0)
+    invoices['terbayar'] = invoices['invoice_number'].map(paid).fillna(0.0)
+    start = pd.to_datetime(get_app_meta(PIUTANG_MULAI_KEY), errors='coerce')
+    dates = pd.to_datetime(invoices['tanggal_waktu'], errors='coerce')
+    tracked = dates >= start if pd.notna(start) else pd.Series(True, index=invoices.index)
+    open_invoices = invoices[tracked & (invoices['total'] - invoices['terbayar'] > AMOUNT_TOLERANCE)]
+    customer_ids = pd.to_numeric(open_invoices['customer_id'], errors='coerce')
+    engine['open'] = {
+        number: {'customer_id': int(customer_id) if pd.notna(customer_id) else None, 'tanggal_waktu': tanggal,
+                 'total': float(total), 'terbayar': float(terbayar)}
+        for number, customer_id, tanggal, total, terbayar in zip(
+            open_invoices['invoice_number'], customer_ids, open_invoices['tanggal_waktu'], open_invoices['total'], open_invoices['terbayar'])
+    }
+    return engine
+
+def get_receivables():
+    state = get_app_state()
+    engine = state.get('receivables')
+    if engine is not None and not index_expired(engine, RECEIVABLE_SOURCES) and engine['versions'] == _receivable_versions():
+        return engine
+    # Dibangun di luar lock (membaca sheet), lalu dipasang di bawah lock seperti get_row_index.
+    engine = _build_receivables()
+    with state['lock']:
+        state['receivables'] = engine
+    return engine
+
+def _apply_receivable_write(bumped, apply):
+    """Runs apply(engine) if the open-invoice index was current before the writes to `bumped` sheets."""
+    state = get_app_state()
+    with state['lock']:
+        engine = state.get('receivables')
+        if engine is None:
+            return
+        current = _receivable_versions()
+        expected = tuple(v - 1 if name in bumped else v for name, v in zip(RECEIVABLE_SOURCES, current))
+        if engine['versions'] != expected:
+            return
+        engine['versions'] = current
+        engine['aging'] = None
+        apply(engine)
+
+def record_receivable(invoice_number, customer_id, tanggal_waktu, total):
+    """Adds a checkout (one invoices + one invoice_items append) to the open-invoice index."""
+    def apply(engine):
+        if total > AMOUNT_TOLERANCE:
+            engine['open'][invoice_number] = {'customer_id': customer_id, 'tanggal_waktu': tanggal_waktu, 'total': float(total), 'terbayar': 0.0}
+    _apply_receivable_write({'invoices', 'invoice_items'}, apply)
+
+def get_invoice_outstanding(invoice_number):
+    """Amount still owed on the invoice (0.0 when paid, or when it predates payment tracking)."""
+    entry = get_receivables()['open'].get(str(invoice_number))
+    return round(entry['total'] - entry['terbayar'], 2) if entry else 0.0
+
+def post_payment(invoice_number, jumlah, metode='Tunai', keterangan='', tanggal_waktu=None):
+    """Records a payment against an open invoice. Returns (success, message)."""
+    invoice_number = str(invoice_number)
+    outstanding = get_invoice_outstanding(invoice_number)
+    if outstanding <= 0:
+        return False, f"Invoice {invoice_number} sudah lunas."
+    if jumlah <= 0:
+        return False, "Jumlah pembayaran harus lebih dari 0."
+    if jumlah > outstanding + AMOUNT_TOLERANCE:
+        return False, f"Pembayaran melebihi sisa tagihan invoice {invoice_number} (Rp {outstanding:,.2f})."
+    tanggal_waktu = tanggal_waktu or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if not append_row_to_gsheet('payments', [tanggal_waktu, invoice_number, float(jumlah), metode, keterangan]):
+        return False, "Gagal mencatat pembayaran."
+
+    def apply(engine):
+        entry = engine['open'].get(invoice_number)
+        if entry is None:
+            return
+        entry['terbayar'] += float(jumlah)
+        if entry['total'] - entry['terbayar'] <= AMOUNT_TOLERANCE:
+            del engine['open'][invoice_number]
+    _apply_receivable_write({'payments'}, apply)
+    return True, f"Pembayaran Rp {jumlah:,.2f} untuk {invoice_number} dicatat."
+
+def get_invoice_payments(invoice_number):
+    df = get_data_from_gsheets('payments')
+    if df.empty:
+        return pd.DataFrame(columns=SHEET_SCHEMA['payments'])
+    df['jumlah'] = pd.to_numeric(df['jumlah'], errors='coerce').fillna(0)
+    return df[df['invoice_number'].astype(str) == str(invoice_number)]
+
+def get_open_invoices():
+    """Open invoices as a frame [invoice_number, customer_id, tanggal_waktu, total, terbayar, sisa]."""
+    open_invoices = pd.DataFrame.from_dict(get_receivables()['open'], orient='index',
+                                           columns=['customer_id', 'tanggal_waktu', 'total', 'terbayar'])
+    open_invoices = open_invoices.rename_axis('invoice_number').reset_index()
+    open_invoices['sisa'] = (open_invoices['total'] - open_invoices['terbayar']).round(2)
+    return open_invoices
+
+def compute_receivable_aging(as_of=None):
+    """Aging of every open invoice in one vectorized pass: (per-invoice frame, per-customer bucket table).
+
+    Age is counted in days from the invoice date. The result for today is cached on the
+    open-invoice index until the next write.
+    """
+    engine = get_receivables()
+    as_of = pd.Timestamp(as_of or datetime.now().date())
+    cached = engine.get('aging')
+    if cached is not None and cached[0] == as_of:
+        return cached[1], cached[2]
+    open_invoices = get_open_invoices()
+    age = (as_of - pd.to_datetime(open_invoices['tanggal_waktu'], errors='coerce').dt.normalize()).dt.days
+    open_invoices['umur_hari'] = age.fillna(0).astype(int)
+    open_invoices['kelompok'] = pd.cut(open_invoices['umur_hari'], bins=AGING_BINS, labels=AGING_BUCKETS)
+    names = {customer_id: record['nama_pelanggan'] for customer_id, record in get_customer_lookup()['records'].items()}
+    open_invoices['nama_pelanggan'] = open_invoices['customer_id'].map(names).fillna('(tanpa pelanggan)')
+    by_customer = open_invoices.pivot_table(index='nama_pelanggan', columns='kelompok', values='sisa',
+                                            aggfunc='sum', fill_value=0.0, observed=False)
+    by_customer = by_customer.reindex(columns=AGING_BUCKETS, fill_value=0.0)
+    by_customer.columns = list(AGING_BUCKETS)
+    by_customer['Total'] = by_customer.sum(axis=1)
+    by_customer = by_customer.sort_values('Total', ascending=False)
+    with get_app_state()['lock']:
+        engine['aging'] = (as_of, open_invoices, by_customer)
+    return open_invoices, by_customer
+
+def get_outstanding_by_customer():
+    """customer_id → total outstanding, summed over the open invoices only."""
+    open_invoices = get_open_invoices()
+    return open_invoices.dropna(subset=['customer_id']).groupby('customer_id')['sisa'].sum()
+
 # --- Payroll Functions ---
-def add_employee(nama, bagian, gaji):
+def _fill_employee_ids(df):
+    """Returns employee_id for every row, giving ids to rows that have none.
+
+    A missing id becomes the row's position (1-based), which is the id the app used to
+    derive before ids were stored, unless that id is taken; then the next free id is used.
+    """
+    ids = pd.to_numeric(df['employee_id'], errors='coerce') if 'employee_id' in df.columns else pd.Series(float('nan'), index=df.index)
+    used = set(ids.dropna().astype(int))
+    next_id = max(used, default=0) + 1
+    filled = ids.copy()
+    for position, idx in enumerate(df.index, start=1):
+        if pd.isna(filled[idx]):
+            if position not in used:
+                filled[idx] = position
+            else:
+                filled[idx] = next_id
+                next_id += 1
+            used.add(int(filled[idx]))
+            next_id = max(next_id, max(used) + 1)
+    return filled.astype(int)
+
+def backfill_employee_ids():
+    """Stores an employee_id for every employee row that has none, in a single range update."""
+    df = get_data_from_gsheets('employees')
+    if df.empty:
+        return
+    ids = pd.to_numeric(df['employee_id'], errors='coerce') if 'employee_id' in df.columns else None
+    if ids is not None and ids.notna().all():
+        return
+    filled = _fill_employee_ids(df)
+    worksheet = get_worksheet('employees')
+    letter = _column_letter(SHEET_SCHEMA['employees'].index('employee_id') + 1)
+    last_index = int(df.index.max())
+    values = [[int(filled[i])] if i in filled.index else [''] for i in range(last_index + 1)]
+    sheets_call('write', worksheet.update, f"{letter}2:{letter}{last_index + 2}", values)
+    st.cache_data.clear()
+    bump_data_version('employees')
+
+def next_employee_id():
+    """Ids are never reused, including ids that only remain in payroll history."""
     df_employees = get_employees()
+    used = df_employees['employee_id'].tolist() if not df_employees.empty else []
+    payroll = get_data_from_gsheets('payroll')
+    if not payroll.empty:
+        used += pd.to_numeric(payroll['employee_id'], errors='coerce').dropna().astype(int).tolist()
+    return max(used, default=0) + 1
+
+def add_employee(nama, bagian, gaji):
     # Check if employee already exists to avoid duplicates
-    if not df_employees.empty and (df_employees['nama_karyawan'] == nama).any():
+    if find_row('employees', nama) is not None:
         return False
-    return append_row_to_gsheet('employees', [nama, bagian, gaji])
+    return append_row_to_gsheet('employees', [nama, bagian, gaji, next_employee_id()])
 
 def get_employees():
     df = get_data_from_gsheets('employees')
     if not df.empty:
         df['gaji_pokok'] = pd.to_numeric(df['gaji_pokok'], errors='coerce').fillna(0)
+        df['employee_id'] = _fill_employee_ids(df)
     return df
 
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_employee_index(version):
+    df = get_employees()
+    if df.empty:
+        return pd.DataFrame(columns=['nama_karyawan', 'bagian', 'gaji_per_hari'], index=pd.Index([], name='employee_id', dtype='int64'))
+    index = df.set_index('employee_id')[['nama_karyawan', 'bagian', 'gaji_pokok']]
+    return index.rename(columns={'gaji_pokok': 'gaji_per_hari'})
+
+def get_employee_index():
+    """Employees indexed by their persistent employee_id, rebuilt once per data version."""
+    return _build_employee_index(get_data_version('employees'))
+
 def update_employee(old_name, new_nama, new_bagian, new_gaji):
-    df_employees = get_employees()
-    row_index = df_employees.index[df_employees['nama_karyawan'] == old_name].tolist()
-    if not row_index:
+    row_index = find_row_for_write('employees', old_name)
+    if row_index is None:
         return False
-    return update_row_in_gsheet('employees', row_index[0], [new_nama, new_bagian, new_gaji])
+    employee_id = int(get_employees().loc[row_index, 'employee_id'])
+    return update_row_in_gsheet('employees', row_index, [new_nama, new_bagian, new_gaji, employee_id])
 
 def delete_employee(nama):
-    df_employees = get_employees()
-    row_index = df_employees.index[df_employees['nama_karyawan'] == nama].tolist()
-    if not row_index:
+    row_index = find_row_for_write('employees', nama)
+    if row_index is None:
         return False
-    return delete_row_from_gsheet('employees', row_index[0])
+    return delete_row_from_gsheet('employees', row_index)
 
 def add_payroll_record(employee_id, gaji_bulan, gaji_pokok, lembur, lembur_minggu, uang_makan, pot_absen_finger, ijin_hr, simpanan_wajib, potongan_koperasi, kasbon, gaji_akhir, keterangan):
     tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -453,42 +3319,166 @@ def add_payroll_record(employee_id, gaji_bulan, gaji_pokok, lembur, lembur_mingg
     ]
     return append_row_to_gsheet('payroll', data_list)
     
-def get_payroll_records():
-    df_payroll = get_data_from_gsheets('payroll')
-    df_employees = get_employees()
+# --- Batch Payroll ---
+PAYROLL_AMOUNT_COLUMNS = ['lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon']
+PAYROLL_GRID_COLUMNS = ['employee_id', 'nama_karyawan', 'bagian', 'gaji_per_hari', 'hari_kerja'] + PAYROLL_AMOUNT_COLUMNS + ['keterangan']
+
+def build_payroll_grid(default_hari_kerja=25):
+    """One editable row per employee, pre-filled with the daily wage from the master."""
+    lookup = get_employee_lookup()
+    grid = pd.DataFrame.from_dict(lookup['records'], orient='index')
+    if grid.empty:
+        return pd.DataFrame(columns=PAYROLL_GRID_COLUMNS)
+    # Record employee_id bisa berupa teks/float dari sheet; kunci lookup adalah id integernya.
+    grid = grid.drop(columns='employee_id', errors='ignore').rename_axis('employee_id').reset_index()
+    grid['gaji_per_hari'] = pd.to_numeric(grid['gaji_pokok'], errors='coerce').fillna(0.0)
+    grid['hari_kerja'] = default_hari_kerja
+    for col in PAYROLL_AMOUNT_COLUMNS:
+        grid[col] = 0.0
+    grid['keterangan'] = ''
+    return grid[PAYROLL_GRID_COLUMNS]
+
+def _payroll_key(values, key):
+    # CSV/Excel memberi id sebagai teks atau float (1.0); keduanya disamakan dengan id integer di grid.
+    if key == 'employee_id':
+        return pd.to_numeric(values, errors='coerce').astype('Int64')
+    return values.astype(str).str.strip()
+
+def merge_payroll_upload(grid, uploaded):
+    """Overlays an uploaded attendance/overtime/deduction sheet onto the grid by employee_id or nama_karyawan.
+
+    Returns (merged grid, keys from the file that match no employee).
+    """
+    key = 'employee_id' if 'employee_id' in uploaded.columns else 'nama_karyawan'
+    if key not in uploaded.columns:
+        raise ValueError("File harus memiliki kolom 'employee_id' atau 'nama_karyawan'.")
+    value_columns = [col for col in ['hari_kerja'] + PAYROLL_AMOUNT_COLUMNS + ['keterangan'] if col in uploaded.columns]
+    keys = _payroll_key(uploaded[key], key)
+    # Kunci yang tidak bisa dibaca (mis. id berupa teks) ikut dilaporkan dengan nilai aslinya.
+    unreadable = uploaded.loc[keys.isna() & uploaded[key].notna(), key].astype(str).tolist()
+    uploaded = uploaded.assign(**{key: keys}).dropna(subset=[key])
+    uploaded = uploaded.drop_duplicates(subset=key, keep='last').set_index(key)[value_columns]
+    merged = grid.assign(**{key: _payroll_key(grid[key], key)}).set_index(key)
+    unmatched = uploaded.index[~uploaded.index.isin(merged.index)].tolist() + unreadable
+    merged.update(uploaded)
+    # Kunci asli grid dikembalikan, agar tipe kolomnya tidak berubah karena penyamaan di atas.
+    merged = merged.reset_index(drop=True).assign(**{key: grid[key].to_numpy()})
+    return merged[PAYROLL_GRID_COLUMNS], unmatched
+
+def compute_payroll_batch(grid):
+    """Computes every payslip of the grid with column arithmetic (same formula as the single form)."""
+    df = grid.copy()
+    for col in ['gaji_per_hari', 'hari_kerja'] + PAYROLL_AMOUNT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+    df['keterangan'] = df['keterangan'].fillna('').astype(str)
+    df['gaji_pokok'] = df['gaji_per_hari'] * df['hari_kerja']
+    df['total_pendapatan'] = df['gaji_pokok'] + df['lembur'] + df['lembur_minggu'] + df['uang_makan']
+    df['total_setelah_potongan'] = df['total_pendapatan'] - df['pot_absen_finger'] - df['ijin_hr']
+    df['gaji_akhir'] = df['total_setelah_potongan'] - df['simpanan_wajib'] - df['potongan_koperasi'] - df['kasbon']
+    return df
 
-    if df_payroll.empty or df_employees.empty:
-        return pd.DataFrame()
-    
-    df_employees['id'] = range(1, len(df_employees) + 1)
-    
-    df_payroll = df_payroll.merge(df_employees, left_on='employee_id', right_on='id', how='left')
-    
-    return df_payroll[['tanggal_waktu', 'gaji_bulan', 'nama_karyawan', 'gaji_akhir', 'keterangan']]
+def validate_payroll_batch(df, gaji_bulan):
+    """Returns a frame of row-level errors (empty when the batch can be saved)."""
+    errors = []
+    numeric = df[['hari_kerja'] + PAYROLL_AMOUNT_COLUMNS]
+    negative = (numeric < 0).any(axis=1)
+    errors.append(df.loc[negative, ['employee_id', 'nama_karyawan']].assign(error='Nilai tidak boleh negatif'))
+    errors.append(df.loc[df['gaji_akhir'] < 0, ['employee_id', 'nama_karyawan']].assign(error='Gaji akhir negatif'))
+    duplicated = df['employee_id'].duplicated(keep=False)
+    errors.append(df.loc[duplicated, ['employee_id', 'nama_karyawan']].assign(error='Karyawan muncul lebih dari sekali'))
+    unknown = ~df['employee_id'].isin(list(get_employee_lookup()['records'].keys()))
+    errors.append(df.loc[unknown, ['employee_id', 'nama_karyawan']].assign(error='ID karyawan tidak dikenal'))
+
+    payroll = get_data_from_gsheets('payroll')
+    if not payroll.empty:
+        existing_ids = set(pd.to_numeric(payroll.loc[payroll['gaji_bulan'] == gaji_bulan, 'employee_id'], errors='coerce').dropna().astype(int))
+        already = df['employee_id'].isin(existing_ids)
+        errors.append(df.loc[already, ['employee_id', 'nama_karyawan']].assign(error=f'Gaji {gaji_bulan} sudah pernah dicatat'))
+    return pd.concat(errors, ignore_index=True)
+
+def add_payroll_records_bulk(df, gaji_bulan):
+    """Writes all payroll rows of a computed batch with one append."""
+    tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = df.assign(tanggal_waktu=tanggal_waktu, gaji_bulan=gaji_bulan)
+    rows['employee_id'] = rows['employee_id'].astype(int)
+    for col in ['gaji_pokok', 'gaji_akhir'] + PAYROLL_AMOUNT_COLUMNS:
+        rows[col] = rows[col].astype(float)
+    return append_rows_to_gsheet('payroll', to_sheet_rows(rows, SHEET_SCHEMA['payroll']))
 
-def get_payroll_records_by_month(month_str):
+PAYROLL_NUMERIC_COLUMNS = ['gaji_pokok', 'lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon', 'gaji_akhir']
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_payroll_view(versions):
     df_payroll = get_data_from_gsheets('payroll')
-    df_employees = get_employees()
-    
-    if df_payroll.empty or df_employees.empty:
+    if df_payroll.empty:
         return pd.DataFrame()
-        
-    df_employees['id'] = range(1, len(df_employees) + 1)
-    
-    df_payroll = df_payroll[df_payroll['gaji_bulan'] == month_str]
-    
     # Perbaikan: Pastikan kolom numerik dikonversi sebelum diolah
-    for col in ['gaji_pokok', 'lembur', 'lembur_minggu', 'uang_makan', 'pot_absen_finger', 'ijin_hr', 'simpanan_wajib', 'potongan_koperasi', 'kasbon', 'gaji_akhir']:
+    for col in PAYROLL_NUMERIC_COLUMNS:
         df_payroll[col] = pd.to_numeric(df_payroll[col], errors='coerce').fillna(0)
-    
-    df_payroll = df_payroll.merge(df_employees, left_on='employee_id', right_on='id', how='left')
-    
-    return df_payroll
+    df_payroll['employee_id'] = pd.to_numeric(df_payroll['employee_id'], errors='coerce').astype('Int64')
+    # Join lewat indeks employee_id; karyawan yang sudah dihapus tetap tampil dengan nama kosong.
+    view = df_payroll.join(get_employee_index(), on='employee_id')
+    view['nama_karyawan'] = view['nama_karyawan'].fillna('(karyawan dihapus)')
+    view['bagian'] = view['bagian'].fillna('')
+    return view
+
+def get_payroll_view():
+    """Payroll rows joined with employee names, cached until payroll or employees change."""
+    return _build_payroll_view((get_data_version('payroll'), get_data_version('employees')))
+
+MONTH_NAMES_ID = {
+    1: 'Januari', 2: 'Februari', 3: 'Maret', 4: 'April', 5: 'Mei', 6: 'Juni',
+    7: 'Juli', 8: 'Agustus', 9: 'September', 10: 'Oktober', 11: 'November', 12: 'Desember'
+}
+
+def localize_dates(series, with_day=True):
+    """Formats datetimes as '05 September 2025' (or 'September 2025') with Indonesian month names."""
+    dates = pd.to_datetime(series, errors='coerce')
+    label = dates.dt.month.map(MONTH_NAMES_ID) + ' ' + dates.dt.year.astype('Int64').astype(str)
+    if with_day:
+        label = dates.dt.strftime('%d') + ' ' + label
+    return label.fillna('')
+
+def localize_month_label(gaji_bulan):
+    """'September 2025' (as stored in gaji_bulan) → Indonesian month name."""
+    parsed = pd.to_datetime(pd.Series([gaji_bulan]), format='%B %Y', errors='coerce')
+    return gaji_bulan if parsed.isna().all() else localize_dates(parsed, with_day=False).iloc[0]
+
+@st.cache_resource(ttl=600, max_entries=2, show_spinner=False)
+def _build_payroll_partitions(versions):
+    view = get_payroll_view()
+    if view.empty:
+        return {'months': [], 'partitions': {}}
+    view = view.assign(tanggal_tampil=localize_dates(view['tanggal_waktu']))
+    partitions = {month: part for month, part in view.groupby('gaji_bulan', sort=False)}
+    months = pd.Series(list(partitions.keys()))
+    month_order = pd.to_datetime(months, format='%B %Y', errors='coerce').sort_values(ascending=False, na_position='last')
+    months = months.loc[month_order.index].tolist()
+    return {'months': months, 'partitions': partitions}
+
+def get_payroll_months():
+    """Payroll months, newest first; one entry per gaji_bulan value."""
+    return _build_payroll_partitions((get_data_version('payroll'), get_data_version('employees')))['months']
+
+def get_payroll_records():
+    df_payroll = get_payroll_view()
+    if df_payroll.empty:
+        return pd.DataFrame()
+    return df_payroll[['tanggal_waktu', 'gaji_bulan', 'nama_karyawan', 'gaji_akhir', 'keterangan']].copy()
 
-def generate_payslips_pdf(payslip_df):
+def get_payroll_records_by_month(month_str):
+    partitions = _build_payroll_partitions((get_data_version('payroll'), get_data_version('employees')))['partitions']
+    if month_str not in partitions:
+        return pd.DataFrame()
+    return partitions[month_str].copy()
+
+def generate_payslips_pdf(payslip_df, progress=None):
+    from fpdf import FPDF
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     
-    for idx, row in payslip_df.iterrows():
+    for n, (idx, row) in enumerate(payslip_df.iterrows()):
+        if progress:
+            progress(n / len(payslip_df), f"Slip {n + 1} dari {len(payslip_df)}")
         pdf.add_page()
         pdf.set_font("Arial", 'B', 16)
         
@@ -520,7 +3510,7 @@ def generate_payslips_pdf(payslip_df):
         # Pendapatan
         pdf.cell(60, 5, 'Gaji Pokok', 0, 0)
         pdf.cell(5, 5, ':', 0, 0)
-        pdf.cell(0, 5, f"Rp {row['gaji_pokok_x']:,.2f}", 0, 1, 'R')
+        pdf.cell(0, 5, f"Rp {row['gaji_pokok']:,.2f}", 0, 1, 'R')
         
         pdf.cell(60, 5, 'Lembur', 0, 0)
         pdf.cell(5, 5, ':', 0, 0)
@@ -535,7 +3525,7 @@ def generate_payslips_pdf(payslip_df):
         pdf.cell(0, 5, f"Rp {row['uang_makan']:,.2f}", 0, 1, 'R')
 
         # Total 1
-        total1 = row['gaji_pokok_x'] + row['lembur'] + row['lembur_minggu'] + row['uang_makan']
+        total1 = row['gaji_pokok'] + row['lembur'] + row['lembur_minggu'] + row['uang_makan']
         pdf.set_font("Arial", 'B', 10)
         pdf.cell(60, 5, 'Total Pendapatan (1)', 'T', 0)
         pdf.cell(5, 5, ':', 'T', 0)
@@ -594,6 +3584,207 @@ def generate_payslips_pdf(payslip_df):
 
     return io.BytesIO(pdf.output(dest='S'))
 
+# --- Dashboard Widgets ---
+# Tiap widget dashboard di-cache sendiri dengan kunci versi data worksheet sumbernya: rerun (mis. klik
+# sidebar) tidak menghitung ulang, dan perubahan satu worksheet hanya membangun ulang widget yang
+# memakainya. Memakai cache_resource karena cache_data dikosongkan setiap kali aplikasi menulis.
+LOW_STOCK_CHART_ITEMS = 10
+
+@st.cache_resource(ttl=3600, max_entries=4, show_spinner=False)
+def _build_stock_totals(master_version, price_version, stock_versions, today):
+    master = get_columns_from_gsheets('master_barang', STOCK_KEYS + ['harga'])
+    if master.empty:
+        return None
+    # Harga yang berlaku saat ini (riwayat harga), harga master sebagai cadangan
+    prices = attach_prices_at(master[STOCK_KEYS].assign(tanggal=datetime.now()), 'tanggal')['harga']
+    harga = prices.fillna(pd.to_numeric(master['harga'], errors='coerce')).fillna(0)
+    master = attach_stock_balance(master, yard_column='Sisa Yard')
+    return {
+        'total_value': float((master['Stok Saat Ini'] * harga).sum()),
+        'total_items': int(master['Stok Saat Ini'].sum()),
+        'total_yard': float(master['Sisa Yard'].sum()),
+    }
+
+def get_stock_totals():
+    """Total value, units and yards in stock, or None without master items.
+
+    Recomputed only when master_barang, the price history or the stock movements change,
+    and once a day so scheduled prices take effect.
+    """
+    return _build_stock_totals(get_data_version('master_barang'), get_data_version('harga_barang'),
+                               _stock_balance_versions(), datetime.now().date())
+
+@st.cache_resource(ttl=3600, max_entries=4, show_spinner=False)
+def _build_low_stock_figure(master_version, stock_versions):
+    master = get_columns_from_gsheets('master_barang', ['kode_bahan', 'nama_bahan', 'warna'])
+    if master.empty:
+        return None
+    import plotly.express as px
+    master = attach_stock_balance(master)
+    low_stock_df = master.sort_values(by='Stok Saat Ini', ascending=True, kind='mergesort').head(LOW_STOCK_CHART_ITEMS)
+    low_stock_df['label'] = low_stock_df['nama_bahan'].astype(str) + ' (' + low_stock_df['warna'].astype(str) + ')'
+    fig = px.bar(low_stock_df,
+                 x='label',
+                 y='Stok Saat Ini',
+                 title=f'{LOW_STOCK_CHART_ITEMS} Item dengan Stok Terendah',
+                 labels={'label': 'Nama Item', 'Stok Saat Ini': 'Jumlah Stok'},
+                 color='Stok Saat Ini',
+                 color_continuous_scale=px.colors.sequential.Sunset
+                 )
+    return fig.to_json()
+
+def get_low_stock_figure():
+    """The low-stock bar chart as Plotly JSON (None without master items); prices do not affect it."""
+    return _build_low_stock_figure(get_data_version('master_barang'), _stock_balance_versions())
+
+# --- UI HELPERS ---
+JOB_POLL_SECONDS = 2
+
+def show_job_panel(kinds, key):
+    """Status, progress, cancel and download controls for this user's background jobs.
+
+    Polls via a fragment only while a job is still queued or running, so the rest of
+    the page is not rerun.
+    """
+    owner = st.session_state.get('username')
+    has_active = any(job['status'] in JOB_ACTIVE_STATUSES for job in get_jobs(owner, kinds))
+
+    @st.fragment(run_every=JOB_POLL_SECONDS if has_active else None)
+    def _panel():
+        jobs = get_jobs(owner, kinds)
+        if has_active and not any(job['status'] in JOB_ACTIVE_STATUSES for job in jobs):
+            st.rerun()  # semua job selesai: hentikan polling
+        for job in jobs:
+            submitted = datetime.fromtimestamp(job['submitted_at']).strftime('%H:%M:%S')
+            col_info, col_action = st.columns([0.75, 0.25])
+            with col_info:
+                st.write(f"**{job['label']}** · {submitted} · {job['status']}")
+                if job['status'] in JOB_ACTIVE_STATUSES:
+                    st.progress(job['progress'], text=job['message'] or None)
+                elif job['status'] == 'gagal':
+                    st.error(f"Gagal: {job['error']}")
+            with col_action:
+                if job['status'] in JOB_ACTIVE_STATUSES:
+                    if st.button("Batalkan", key=f"{key}_cancel_{job['id']}"):
+                        cancel_job(job['id'])
+                        st.rerun(scope='fragment')
+                elif job['status'] == 'selesai':
+                    data = read_job_result(job['id'])
+                    if data is not None:
+                        st.download_button("Unduh 📥", data=data, file_name=job['file_name'],
+                                           mime=job['mime'], key=f"{key}_download_{job['id']}")
+
+    _panel()
+
+def show_connection_status():
+    """Offline banner, and the number of journaled rows still waiting for Google Sheets."""
+    offline = get_offline_status()
+    status = get_journal_status()
+    pending = sum(status['pending'].values())
+    if pending and not status['running']:
+        wake_journal_sync()  # baris tertinggal dari proses sebelumnya
+    if offline:
+        st.warning(f"📴 **Mode offline** sejak {offline['since']}: Google Sheets tidak dapat dihubungi. "
+                   f"Data ditampilkan dari salinan lokal dan transaksi baru tetap tersimpan; {pending} baris akan "
+                   "dikirim otomatis saat koneksi kembali. Edit & hapus data belum bisa dilakukan.")
+        st.caption(f"Detail: {offline['error']}")
+    elif pending:
+        st.info(f"🔄 {pending} baris sedang dikirim ke Google Sheets.")
+
+def show_bulk_import(sheet_name, validate, key):
+    """Upload → validation report → one-click chunked import for sheet_name."""
+    spec = IMPORT_SPECS[sheet_name]
+    template_columns = spec['required'] + list(spec['defaults'])
+    st.caption(f"Kolom wajib: {', '.join(spec['required'])}. Kolom opsional: {', '.join(spec['defaults'])}.")
+    st.download_button("Unduh Template CSV", data=','.join(template_columns) + '\n',
+                       file_name=f"template_{sheet_name}.csv", mime="text/csv", key=f"{key}_template")
+    uploaded_file = st.file_uploader("Unggah File (CSV atau Excel)", type=['csv', 'xlsx'], key=f"{key}_upload")
+    if uploaded_file is None:
+        return
+    try:
+        report = summarize_import(uploaded_file, sheet_name, validate)
+    except Exception as e:
+        st.error(f"Gagal membaca file: {e}")
+        return
+    errors, total = report['errors'], report['accepted']
+    col1, col2 = st.columns(2)
+    col1.metric("Baris Valid", total)
+    col2.metric("Baris Ditolak", int(errors['baris'].nunique()) if not errors.empty else 0)
+    if not errors.empty:
+        st.warning("Baris berikut tidak akan diimpor (nomor baris sesuai file, termasuk header):")
+        show_paginated_table(errors, f"{key}_errors", search_columns=['error'])
+    if not total:
+        return
+    with st.expander("Pratinjau Data Valid"):
+        if total > len(report['preview']):
+            st.caption(f"Menampilkan {len(report['preview'])} baris pertama dari {total} baris valid.")
+        show_paginated_table(report['preview'], f"{key}_preview")
+    if st.button(f"💾 Impor {total} Baris Valid", key=f"{key}_save"):
+        bar = st.progress(0.0)
+        # File dibaca ulang: tiap potongan divalidasi lalu langsung ditulis.
+        chunks = (accepted for accepted, _ in validate_import_file(uploaded_file, sheet_name, validate))
+        written = import_rows(sheet_name, chunks, total, earliest=report['earliest'],
+                              progress=lambda fraction, message: bar.progress(fraction, text=message))
+        if written == total:
+            st.success(f"{written} baris berhasil diimpor. ✅")
+        else:
+            st.error(f"Impor berhenti: {written} dari {total} baris tersimpan. ❌")
+
+def show_paginated_table(df, key, search_columns=None, page_size=50):
+    """Renders one page of df with search, sort and page controls; only that page is sent to the browser."""
+    col_search, col_sort, col_order = st.columns([0.5, 0.3, 0.2])
+    with col_search:
+        search = st.text_input("Cari", key=f"{key}_search") if search_columns else None
+    with col_sort:
+        sort_by = st.selectbox("Urutkan berdasarkan", ["(bawaan)"] + list(df.columns), key=f"{key}_sort")
+    with col_order:
+        ascending = st.selectbox("Urutan", ["Naik", "Turun"], key=f"{key}_order") == "Naik"
+
+    page_key = f"{key}_page"
+    page_df, total_rows = query_page(
+        df, search=search, search_columns=search_columns,
+        sort_by=None if sort_by == "(bawaan)" else sort_by, ascending=ascending,
+        page=st.session_state.get(page_key, 1), page_size=page_size
+    )
+    total_pages = max(1, -(-total_rows // page_size))
+    if st.session_state.get(page_key, 1) > total_pages:
+        st.session_state[page_key] = total_pages
+
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+    col_info, col_page = st.columns([0.8, 0.2])
+    with col_page:
+        page = st.number_input("Halaman", min_value=1, max_value=total_pages, step=1, key=page_key)
+    with col_info:
+        first_row = (page - 1) * page_size + 1 if total_rows else 0
+        last_row = min(page * page_size, total_rows)
+        st.caption(f"Menampilkan {first_row}–{last_row} dari {total_rows} baris (halaman {page} dari {total_pages}).")
+
+def searchable_picker(label, df, label_func, key, search_columns, limit=50):
+    """Selectbox that only sends rows matching the search text. Returns the index label of the chosen row."""
+    search = st.text_input(f"Cari {label}", key=f"{key}_search")
+    matches, total_rows = query_page(df, search=search, search_columns=search_columns, page_size=limit)
+    if total_rows > limit:
+        st.caption(f"Menampilkan {limit} dari {total_rows} hasil. Persempit pencarian untuk melihat data lain.")
+    labels = dict(zip(matches.index, label_func(matches)))
+    return st.selectbox(label, list(labels.keys()), format_func=labels.get, key=key)
+
+def customer_picker(key):
+    """Customer autocomplete. Returns (customer_id, nama, kontak); customer_id is None for a new customer."""
+    lookup = get_customer_lookup()
+    search = st.text_input("Cari Pelanggan", key=f"{key}_search", help="Ketik awal nama pelanggan")
+    options = search_customers(search) + [None]
+    customer_id = st.selectbox("Pelanggan", options, key=key,
+                               format_func=lambda option: lookup['labels'][option] if option is not None else "➕ Pelanggan baru")
+    if customer_id is not None:
+        record = lookup['records'][customer_id]
+        return customer_id, record['nama_pelanggan'], record['kontak']
+    col_nama, col_kontak = st.columns(2)
+    with col_nama:
+        nama = st.text_input("Nama Pelanggan Baru", value=search, key=f"{key}_nama")
+    with col_kontak:
+        kontak = st.text_input("Kontak (opsional)", key=f"{key}_kontak")
+    return None, ' '.join(nama.split()), kontak.strip()
+
 def show_user_guide():
     st.title("Panduan Pengguna ℹ️")
     st.markdown("---")
@@ -616,7 +3807,7 @@ def show_user_guide():
     ---
 
     ## 🔑 Alur Global
-    1) **Login** → Masukkan *username* & *password* sesuai peran, klik **Login**.  
+    1) **Login** → Masukkan *username* & *password* sesuai peran, klik **Login**. Setelah 5 kali gagal, login untuk akun tersebut dikunci sementara (maks. 5 menit).  
     2) **Navigasi** → Gunakan **sidebar** untuk ganti halaman (menu yang tampil mengikuti peran).  
     3) **Input & Kelola Data** → Ikuti formulir di tiap halaman.  
     4) **Unduh Dokumen** → Invoice & Slip Gaji (PDF), Backup (Excel).  
@@ -624,6 +3815,15 @@ def show_user_guide():
 
     ---
 
+    ## 📴 Mode Offline
+    - Jika internet putus, aplikasi **tetap berjalan**: muncul banner **Mode offline** dan data ditampilkan dari salinan lokal terakhir.
+    - **Transaksi keluar, barang masuk, penggajian** dan data baru lainnya tetap bisa disimpan. Semua data baru dicatat dulu di jurnal lokal lalu dikirim ke Google Sheets di latar belakang, sehingga checkout tidak menunggu internet.
+    - Saat koneksi kembali, data dikirim otomatis (dicek ulang agar tidak terkirim dua kali). Jika nomor invoice/pelanggan ternyata sudah dipakai di Google Sheets, nomor diganti ke nomor berikutnya.
+    - **Edit & hapus** data belum bisa dilakukan selama offline atau selama masih ada data yang menunggu dikirim untuk sheet tersebut.
+    - Owner dapat melihat jumlah data yang menunggu, nomor yang diganti, dan tombol **🔄 Sinkronkan Sekarang** di **Monitoring Stok → Sinkronisasi Offline**.
+
+    ---
+
     ## ⌨️ Perilaku Tombol & Keyboard (Penting!)
     - Semua formulir utama menggunakan tombol **Simpan** di dalam `form`.  
       **Tekan Enter = Submit Form** *jika fokus* berada pada **input satu baris** (text/number/select).  
@@ -636,8 +3836,10 @@ def show_user_guide():
 
     ## 📈 Dashboard
     **Ringkasan bisnis**:
-    - **Total Nilai Stok** & **Total Barang** (otomatis dari master barang + pergerakan stok).  
+    - **Total Nilai Stok**, **Total Barang** & **Total Panjang (Yard)** (otomatis dari master barang + pergerakan stok).  
     - Grafik **10 stok terendah** → membantu prioritas restock.
+    - Angka & grafik dashboard disimpan dan hanya dihitung ulang ketika data barang, harga, atau pergerakan stok berubah, sehingga berpindah menu tidak memperlambat aplikasi.
+    - Panel **Perlu Restock** → item yang stoknya di bawah **Stok Minimum** (diatur di Master Barang), beserta unduhan daftar order per supplier.
     **Tips**:
     - Jika kosong, berarti **belum ada master barang** atau stok masih 0.
 
@@ -651,6 +3853,7 @@ def show_user_guide():
       - **Warna** → otomatis disimpan **lowercase**.
       - **Rak**
       - **Harga** (angka).  
+      - **Stok Minimum (Reorder)** → batas peringatan restock (0 = tanpa peringatan).
     - Klik **💾 Simpan Barang**.
     - **Validasi unik**: kombinasi **Kode barang + Warna** tidak boleh duplikat. Jika duplikat → muncul pesan **gagal**.
     - **Enter** saat fokus di input satu baris → submit form.  
@@ -661,10 +3864,17 @@ def show_user_guide():
     - **Edit**:
       - Pilih barang → ubah field yang perlu → **Simpan Perubahan**.
       - Jika mengubah **Kode/Warna** menjadi kombinasi yang **sudah ada**, penyimpanan akan **ditolak**.
+      - Mengubah **Harga** mencatat versi harga baru di **Riwayat Harga** (harga lama tetap tersimpan).  
+        Isi **Harga Berlaku Mulai** untuk menjadwalkan harga (tanggal ke depan) atau mencatat harga mundur; kosongkan agar berlaku sekarang.
     - **Hapus**:
       - Pilih barang → **Hapus Barang**.
     - Setelah **Simpan/Hapus**, halaman **refresh otomatis**.
 
+    ### C. Impor Massal
+    - Tab **📤 Impor Massal** → unduh **Template CSV**, isi, lalu unggah file **CSV/Excel**.
+    - Sistem memeriksa semua baris sekaligus: kolom wajib, angka, duplikat di file, dan kombinasi yang **sudah ada** di master.
+    - Baris bermasalah ditampilkan dengan **nomor baris** file; hanya baris valid yang disimpan lewat **💾 Impor**.
+
     ---
 
     ## 📥 Barang Masuk (Owner, Adm Gudang)
@@ -682,7 +3892,18 @@ def show_user_guide():
     - Sistem menambahkan baris dengan waktu sekarang (**Tanggal & Waktu** otomatis).
     - Halaman **refresh** dan data tampil di tabel di bawahnya.
 
-    ### B. Daftar & Kelola Barang Masuk
+    ### B. Impor Massal Barang Masuk
+    - Tab **📤 Impor Massal** → unggah **CSV/Excel** berisi `kode_bahan`, `warna`, `stok` (+ opsional `tanggal_waktu`, `yard`, `keterangan`).
+    - Kode + Warna harus ada di **Master Barang**; tanggal tidak boleh masuk periode yang sudah diarsip.
+    - Baris valid disimpan per potongan 500 baris dengan progres; baris ditolak tampil beserta alasannya.
+
+    ### C. Lokasi & Transfer Stok
+    - Setiap barang masuk dicatat di **Lokasi Simpan** (gudang/rak). Data lama tanpa lokasi dianggap berada di **Gudang Utama**.
+    - Tab **🔁 Transfer Lokasi** → pilih barang, **Dari Lokasi**, **Ke Lokasi**, jumlah → **Simpan Transfer**. Transfer tidak mengubah stok total.
+    - Kolom **Yard** boleh dikosongkan → yard ikut pindah sebanding dengan jumlah unit. Isi manual bila panjang gulungan yang dipindah berbeda.
+    - Lokasi baru ditambahkan lewat **Kelola Lokasi** di tab yang sama.
+
+    ### D. Daftar & Kelola Barang Masuk
     - Lihat riwayat **Barang Masuk** (tanggal, kode, warna, stok, yard, keterangan).
     - **Edit**:
       - Pilih baris unik (gabungan beberapa kolom) → ubah field → **Simpan Perubahan**.
@@ -698,6 +3919,7 @@ def show_user_guide():
     ### A. Menambah Item ke Keranjang
     - Pilih item dari daftar (format: `KODE - NAMA (warna)`), klik **➕ Tambah Item**.  
     - Item tampil dalam **keranjang**:
+      - Pilih **Lokasi Ambil** (urut dari stok terbanyak, tampil dengan sisa yard); stok **dan yard** dicek per lokasi saat simpan.
       - Atur **Jumlah** (dibatasi maksimal **stok tersedia**).
       - Atur **Yard** (opsional).
       - Isi **Keterangan** per item (opsional).
@@ -710,25 +3932,53 @@ def show_user_guide():
     - Di **Keterangan** (text area) → **Enter menambah baris**, bukan submit.
 
     ### B. Simpan Transaksi & Buat Invoice
-    - Isi **Nama Pelanggan** (wajib).  
+    - Di bagian **Pelanggan**, ketik awal nama di **Cari Pelanggan** lalu pilih dari daftar.  
+      Pelanggan belum terdaftar → pilih **➕ Pelanggan baru**, isi **Nama** (wajib) & **Kontak**; pelanggan otomatis disimpan ke master.
     - Klik **💾 Simpan Transaksi & Buat Invoice**.
     - Sistem akan:
       1) **Validasi stok** setiap item (tidak boleh melebihi stok tersedia).  
          Jika kurang, muncul pesan **Stok tidak mencukupi** (menyebut item & stok saat ini).
       2) Membuat **Nomor Invoice** otomatis: `INV-YYMMDD-XXX` (urut harian).
       3) Menyimpan header invoice + item detail, dan mencatat **Barang Keluar**.
-      4) Mengosongkan keranjang & menampilkan pesan **berhasil** (dengan animasi 🎈).
+      4) Mencatat pembayaran: **Lunas** → dibayar penuh; **Tempo / Sebagian** → hanya **Dibayar Sekarang** yang dicatat, sisanya menjadi piutang.
+      5) Mengosongkan keranjang & menampilkan pesan **berhasil** (dengan animasi 🎈).
 
     ### C. Riwayat & Unduh Invoice
     - Lihat tabel riwayat invoice.  
     - Pilih **No Invoice** → **Tampilkan & Unduh Invoice**:
       - Lihat rincian (item, qty, harga, total).
-      - Unduh **PDF** invoice.
+      - Lihat **Status Pembayaran** & riwayat pembayaran invoice. Jika belum lunas, isi **Jumlah Bayar** → **💳 Catat Pembayaran** (tidak boleh melebihi sisa tagihan).
+      - Klik **Buat PDF Invoice** → PDF dibuat di latar belakang, lalu tombol **Unduh** muncul di bawahnya.
+
+    ### D. Pelanggan 👥
+    - Tabel pelanggan beserta **Total Belanja**, **Jumlah Invoice**, **Pembelian Terakhir** dan **Sisa Tagihan**.
+    - **➕ Tambah Pelanggan Baru** → isi nama & kontak (nama tidak boleh sama dengan pelanggan lain).
+    - **Rekening Pelanggan** → pilih pelanggan untuk melihat semua invoicenya (dengan total berjalan) dan mengubah nama/kontak.
+    - Invoice lama otomatis dihubungkan ke pelanggan berdasarkan nama pelanggan di invoice.
+
+    ### E. Piutang 💳
+    - Ringkasan **umur piutang** (0-30, 31-60, 61-90, >90 hari sejak tanggal invoice) per pelanggan, bisa diunduh sebagai CSV.
+    - Daftar **Invoice Belum Lunas** beserta umur, total, terbayar dan sisa.
+    - Invoice yang dibuat sebelum pencatatan pembayaran dimulai dianggap **lunas**.
 
     ---
 
     ## 📊 Monitoring Stok (Owner, Adm Kasir, Adm Gudang)
-    - **Stok Saat Ini** → hitungan real-time dari (Masuk − Keluar) untuk setiap **Kode + Warna**.  
+    - **Stok Saat Ini** → hitungan real-time dari (Masuk − Keluar) untuk setiap **Kode + Warna**, beserta **Sisa Yard** (panjang tersisa).  
+    - **Saldo Stok per Tanggal** → pilih tanggal → klik **Tampilkan Saldo** untuk melihat stok pada akhir hari tersebut.
+    - **Checkpoint & Arsip Stok** (Owner):
+      - Sistem otomatis mencatat saldo penutup setiap akhir bulan (checkpoint) ke sheet `stock_snapshot`.
+      - **Buat Checkpoint Sekarang** → mencatat saldo saat ini.
+      - **Arsipkan Pergerakan** → memindahkan data masuk/keluar sampai checkpoint terakhir ke sheet `*_arsip`.
+      - Data barang masuk yang sudah diarsipkan tidak bisa diedit lagi.
+    - **Log Event & Pemeriksaan Konsistensi Stok** (Owner):
+      - Setiap perubahan stok (masuk, keluar, transfer, edit & hapus barang masuk) dicatat berurutan di sheet `stock_events`, termasuk nilai sebelum koreksi.
+      - Klik **Periksa Konsistensi** → mencocokkan invoice, item invoice, barang keluar, dan saldo dari log event dengan saldo stok. Selisih ditampilkan per jenis masalah.
+    - **Laporan Nilai Stok (Multi Tanggal)** (Owner):
+      - Pilih rentang tanggal, **Frekuensi** (akhir bulan/minggu/harian) dan pengelompokan (**Rak**, **Supplier**, **Item**).
+      - Klik **Hitung Nilai Stok** → nilai stok (saldo × harga yang **berlaku pada tanggal tersebut**) untuk setiap tanggal, bisa diunduh sebagai CSV.
+    - **Laporan Penjualan** (Owner):
+      - Pilih rentang tanggal → **Tampilkan Laporan Penjualan** → qty & omzet per item, dibandingkan dengan harga daftar yang berlaku saat transaksi.
     - **Rekam Jejak Stok**:
       - Pilih **Tanggal Mulai** & **Tanggal Selesai** → klik **Tampilkan Rekam Jejak**.
       - Tabel gabungan **Masuk** dan **Keluar** berurutan waktu.
@@ -737,6 +3987,8 @@ def show_user_guide():
         `master_barang`, `barang_masuk`, `barang_keluar`, `invoices`, `invoice_items`,
         `employees`, `payroll`.  
       - Sheet kosong tetap dibuat dengan **header** agar konsisten.
+      - Owner dapat melihat **Status Kuota API Google Sheets** (jumlah panggilan, limit 429, retry, antrean kuota).
+      - Backup dibuat di **latar belakang**: progres tampil di bawah tombol, bisa **Batalkan**, dan tombol **Unduh** muncul setelah selesai (file disimpan ±1 jam). Halaman lain tetap bisa dipakai selama proses berjalan.
 
     **Catatan Enter**:
     - Tombol backup bukan form → **Enter tidak memicu** proses. Klik tombolnya.
@@ -762,18 +4014,25 @@ def show_user_guide():
     6) Sistem menghitung **TOTAL GAJI AKHIR** otomatis.
     7) Klik **💾 Simpan Gaji**.
 
+    ### B2. Proses Massal (semua karyawan sekaligus)
+    1) Buka tab **📋 Proses Massal** dan pilih **Tanggal Gaji**.
+    2) Isi tabel (hari kerja, lembur, potongan, dll.) langsung, atau unggah file CSV/Excel dengan kolom `employee_id` / `nama_karyawan`.
+    3) Periksa hasil hitungan **Gaji Akhir** per karyawan.
+    4) Klik **💾 Simpan Semua Gaji** → data divalidasi (nilai negatif, karyawan ganda, gaji bulan yang sudah tercatat) lalu disimpan sekaligus.
+
     **Tentang Enter**:
     - Saat fokus di input angka pada form ini → **Enter = submit**.  
       **Saran:** klik tombol **Simpan Gaji** agar tidak tersubmit sebelum siap.
 
     ### C. Riwayat & Slip Gaji
-    - Pilih **Bulan Gaji** → **Unduh PDF** berisi **semua slip** untuk bulan tersebut.  
-    - Tabel riwayat menampilkan tanggal (dengan nama bulan **Indonesia**), karyawan, gaji akhir, keterangan.
+    - Pilih **Bulan Gaji** → **Buat Slip Gaji** (diproses di latar belakang) → **Unduh** PDF berisi **semua slip** untuk bulan tersebut.  
+    - Tabel riwayat menampilkan data **Bulan Gaji** yang dipilih: tanggal (dengan nama bulan **Indonesia**), karyawan, gaji akhir, keterangan.
 
     ---
 
     ## 🧩 Aturan Data & Perhitungan (Ringkas)
     - **Stok Saat Ini** = ∑(Barang Masuk) − ∑(Barang Keluar) per **Kode + Warna**.  
+    - **Stok per Lokasi** = saldo yang sama dipecah per gudang/rak (termasuk transfer), satu kolom per lokasi.  
     - **Duplikat Master Barang** ditolak jika **Kode + Warna** sudah ada.  
     - **Harga**, **Gaji**, dan komponen angka lainnya otomatis dikonversi ke numerik (non-angka → 0).  
     - **Format Invoice**: `INV-YYMMDD-XXX` (contoh: `INV-250903-001`).  
@@ -811,50 +4070,51 @@ def show_dashboard():
     st.title("Dashboard Bisnis 📈")
     st.markdown("---")
 
-    master_df = get_master_barang()
-    
-    col_total_value, col_total_items = st.columns(2)
-    if not master_df.empty:
-        # Perbaikan: Konversi harga ke numerik
-        master_df['harga'] = pd.to_numeric(master_df['harga'], errors='coerce').fillna(0)
-        
-        master_df['Stok Saat Ini'] = master_df.apply(lambda row: get_stock_balance(row['kode_bahan'], row['warna']), axis=1)
-        total_value = (master_df['Stok Saat Ini'] * master_df['harga']).sum()
-        total_items = master_df['Stok Saat Ini'].sum()
-
+    col_total_value, col_total_items, col_total_yard = st.columns(3)
+    totals = get_stock_totals()
+    if totals is not None:
         with col_total_value:
-            st.metric("Total Nilai Stok Saat Ini", f"Rp {total_value:,.2f}")
+            st.metric("Total Nilai Stok Saat Ini", f"Rp {totals['total_value']:,.2f}")
         with col_total_items:
-            st.metric("Total Barang di Gudang", f"{int(total_items)} Unit")
+            st.metric("Total Barang di Gudang", f"{totals['total_items']} Unit")
+        with col_total_yard:
+            st.metric("Total Panjang di Gudang", f"{totals['total_yard']:,.2f} Yard")
     else:
         st.info("Belum ada master barang untuk ditampilkan di dashboard.")
 
     st.markdown("---")
-    st.header("Stok 10 Item Terendah")
-    if not master_df.empty:
-        low_stock_df = master_df.sort_values(by='Stok Saat Ini', ascending=True).head(10)
-        low_stock_df['label'] = low_stock_df['nama_bahan'] + ' (' + low_stock_df['warna'] + ')'
-        
-        if not low_stock_df.empty:
-            fig = px.bar(low_stock_df, 
-                         x='label', 
-                         y='Stok Saat Ini',
-                         title='10 Item dengan Stok Terendah',
-                         labels={'label': 'Nama Item', 'Stok Saat Ini': 'Jumlah Stok'},
-                         color='Stok Saat Ini',
-                         color_continuous_scale=px.colors.sequential.Sunset
-                         )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("Semua stok barang sudah habis.")
+    st.header(f"Stok {LOW_STOCK_CHART_ITEMS} Item Terendah")
+    figure_json = get_low_stock_figure()
+    if figure_json is not None:
+        import plotly.io as pio
+        st.plotly_chart(pio.from_json(figure_json), use_container_width=True)
     else:
         st.info("Belum ada master barang untuk menampilkan grafik.")
 
+    st.markdown("---")
+    st.header("Perlu Restock ⚠️")
+    alerts = get_reorder_alerts(limit=20)
+    if alerts:
+        alerts_df = pd.DataFrame(
+            [(kode, warna, stok, min_stok, kekurangan) for (kode, warna), stok, min_stok, kekurangan in alerts],
+            columns=['kode_bahan', 'warna', 'Stok Saat Ini', 'Stok Minimum', 'Kekurangan']
+        )
+        st.dataframe(alerts_df, use_container_width=True, hide_index=True)
+        export_df = get_reorder_export()
+        st.download_button(
+            label="Unduh Daftar Order per Supplier (CSV)",
+            data=export_df.to_csv(index=False).encode('utf-8'),
+            file_name=f"reorder_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv"
+        )
+    else:
+        st.info("Tidak ada item di bawah stok minimum.")
+
 def show_master_barang():
     st.title("Master Barang 📦")
     st.markdown("---")
     
-    tab_add, tab_list = st.tabs(["➕ Tambah Barang Baru", "📝 Daftar Barang & Kelola"])
+    tab_add, tab_import, tab_list = st.tabs(["➕ Tambah Barang Baru", "📤 Impor Massal", "📝 Daftar Barang & Kelola"])
     
     with tab_add:
         with st.expander("Form Tambah Barang Baru", expanded=True):
@@ -868,34 +4128,37 @@ def show_master_barang():
                     nama_bahan = st.text_input("Nama Item")
                     rak = st.text_input("Rak")
                     harga = st.number_input("Harga", min_value=0.0)
+                    min_stok = st.number_input("Stok Minimum (Reorder)", min_value=0, step=1, help="0 = tanpa peringatan restock")
                 
                 submitted = st.form_submit_button("💾 Simpan Barang")
                 if submitted:
-                    if add_master_item(kode_bahan, nama_supplier, nama_bahan, warna, rak, harga):
+                    if add_master_item(kode_bahan, nama_supplier, nama_bahan, warna, rak, harga, min_stok):
                         st.success(f"Barang **{nama_bahan}** dengan warna **{warna}** berhasil ditambahkan. ✅")
                         st.rerun()
                     else:
                         st.error("Kombinasi Kode barang dan Warna tersebut sudah ada. ❌")
+
+    with tab_import:
+        st.subheader("Impor Master Barang dari File")
+        show_bulk_import('master_barang', validate_master_import, key="import_master")
     
     with tab_list:
         st.subheader("Daftar Barang")
         df = get_master_barang()
         if not df.empty:
-            df_display = df.copy()
-            st.dataframe(df_display, use_container_width=True, hide_index=True)
+            show_paginated_table(df, "master_table", search_columns=['kode_bahan', 'nama_bahan', 'warna', 'nama_supplier', 'rak'])
             
             st.markdown("---")
             with st.expander("Kelola Data Master"):
-                item_options_map = {f"{row['kode_bahan']} ({row['warna']})": (row['kode_bahan'], row['warna']) for _, row in df.iterrows()}
-                item_to_edit_str = st.selectbox("Pilih Kode barang (Warna)", list(item_options_map.keys()), key="select_edit_master")
+                selected_idx = searchable_picker(
+                    "Pilih Kode barang (Warna)", df,
+                    lambda rows: rows['kode_bahan'].astype(str) + ' (' + rows['warna'].astype(str) + ')',
+                    key="select_edit_master", search_columns=['kode_bahan', 'warna', 'nama_bahan']
+                )
                 
-                if item_to_edit_str:
-                    selected_kode, selected_warna = item_options_map[item_to_edit_str]
-                    
-                    filtered_df = df[(df['kode_bahan'] == selected_kode) & (df['warna'] == selected_warna)]
-
-                    if not filtered_df.empty:
-                        selected_row = filtered_df.iloc[0]
+                if selected_idx is not None:
+                    if selected_idx in df.index:
+                        selected_row = df.loc[selected_idx]
                         
                         harga_value = float(selected_row['harga']) if pd.notna(selected_row['harga']) else 0.0
 
@@ -909,11 +4172,14 @@ def show_master_barang():
                                 new_warna = st.text_input("Warna Baru", value=selected_row['warna']).lower()
                                 new_nama_supplier = st.text_input("Nama Supplier", value=selected_row['nama_supplier'])
                                 new_harga = st.number_input("Harga", value=harga_value, min_value=0.0)
+                                new_min_stok = st.number_input("Stok Minimum (Reorder)", value=int(selected_row['min_stok']), min_value=0, step=1)
+                                harga_berlaku = st.date_input("Harga Berlaku Mulai", value=None, help="Kosongkan = harga baru berlaku sekarang")
                                 
                             col_btn1, col_btn2 = st.columns(2)
                             with col_btn1:
                                 if st.form_submit_button("Simpan Perubahan"):
-                                    if update_master_item(selected_row['kode_bahan'], selected_row['warna'], new_kode_bahan, new_warna, new_nama_supplier, new_nama_bahan, new_rak, new_harga):
+                                    berlaku_mulai = datetime.combine(harga_berlaku, datetime.min.time()) if harga_berlaku else None
+                                    if update_master_item(selected_row['kode_bahan'], selected_row['warna'], new_kode_bahan, new_warna, new_nama_supplier, new_nama_bahan, new_rak, new_harga, new_min_stok, berlaku_mulai):
                                         st.success("Data berhasil diperbarui! ✅")
                                         st.rerun()
                                     else:
@@ -925,6 +4191,11 @@ def show_master_barang():
                                         st.rerun()
                                     else:
                                         st.error("Gagal menghapus data.")
+
+                        price_history = get_item_price_history(selected_row['kode_bahan'], selected_row['warna'])
+                        if not price_history.empty:
+                            st.caption("Riwayat Harga")
+                            st.dataframe(price_history[['versi', 'berlaku_mulai', 'harga', 'keterangan']].iloc[::-1], use_container_width=True, hide_index=True)
                     else:
                         st.warning("Data yang dipilih tidak ditemukan. Silakan refresh halaman atau pilih data lain.")
         else:
@@ -939,35 +4210,30 @@ def show_input_masuk():
         st.warning("Belum ada master barang. Silakan tambahkan di menu Master Barang. ⚠️")
         return
 
-    tab_add, tab_list = st.tabs(["➕ Input Barang Masuk Baru", "📝 Daftar Barang Masuk & Kelola"])
+    tab_add, tab_import, tab_transfer, tab_list = st.tabs(["➕ Input Barang Masuk Baru", "📤 Impor Massal", "🔁 Transfer Lokasi", "📝 Daftar Barang Masuk & Kelola"])
+    locations = get_locations()
 
     with tab_add:
         with st.expander("Form Input Barang Masuk", expanded=True):
-            master_df['display_option'] = master_df['kode_bahan'] + ' (' + master_df['warna'] + ')'
-            combined_options = master_df['display_option'].unique().tolist()
+            # Dropdown tunggal untuk Kode barang dan Warna. Pencarian diletakkan di luar form agar daftar langsung tersaring.
+            selected_master_idx = searchable_picker(
+                "Pilih Kode Barang (Warna)", master_df,
+                lambda rows: rows['kode_bahan'].astype(str) + ' (' + rows['warna'].astype(str) + ')',
+                key="combined_select", search_columns=['kode_bahan', 'warna', 'nama_bahan']
+            )
+            kode_bahan_selected = None
+            warna_selected = None
+            if selected_master_idx is not None:
+                kode_bahan_selected = master_df.loc[selected_master_idx, 'kode_bahan']
+                warna_selected = master_df.loc[selected_master_idx, 'warna']
             
             with st.form("input_masuk_form"):
                 col1, col2 = st.columns(2)
                 with col1:
-                    # Dropdown tunggal untuk Kode barang dan Warna
-                    selected_combined = st.selectbox(
-                        "Pilih Kode Barang (Warna)",
-                        options=combined_options,
-                        key="combined_select"
-                    )
-    
-                    # Ekstrak Kode bahan dan Warna dari string yang dipilih
-                    kode_bahan_selected = None
-                    warna_selected = None
-                    if selected_combined:
-                        try:
-                            kode_bahan_selected = selected_combined.split(' ')[0]
-                            warna_selected = selected_combined.split('(')[1].replace(')', '')
-                        except IndexError:
-                            st.error("Format pilihan tidak valid. Periksa data master.")
-                    
                     stok = st.number_input("Stok", min_value=1, key="in_stok")
                     
+                    lokasi = st.selectbox("Lokasi Simpan", locations, key="in_lokasi")
+                    
                 with col2:
                     yard = st.number_input("Yard", min_value=0.0, key="in_yard")
                     keterangan = st.text_area("Keterangan", key="in_keterangan")
@@ -976,32 +4242,83 @@ def show_input_masuk():
                 if submitted:
                     if kode_bahan_selected and warna_selected:
                         tanggal_waktu = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        if add_barang_masuk(tanggal_waktu, kode_bahan_selected, warna_selected, stok, yard, keterangan):
+                        if add_barang_masuk(tanggal_waktu, kode_bahan_selected, warna_selected, stok, yard, keterangan, lokasi):
                             st.success("Barang masuk berhasil dicatat! ✅")
-                            st.cache_data.clear()
                             st.rerun()
                         else:
                             st.error("Gagal mencatat barang masuk.")
                     else:
                         st.error("Pilihan kode barang tidak valid.")
+
+    with tab_import:
+        st.subheader("Impor Barang Masuk dari File")
+        st.caption("Tanggal kosong diisi waktu impor. Kode barang dan warna harus sudah ada di Master Barang.")
+        show_bulk_import('barang_masuk', validate_barang_masuk_import, key="import_masuk")
+
+    with tab_transfer:
+        st.subheader("Transfer Stok Antar Lokasi")
+        transfer_idx = searchable_picker(
+            "Pilih Kode Barang (Warna)", master_df,
+            lambda rows: rows['kode_bahan'].astype(str) + ' (' + rows['warna'].astype(str) + ')',
+            key="transfer_select", search_columns=['kode_bahan', 'warna', 'nama_bahan']
+        )
+        if transfer_idx is not None:
+            transfer_kode = master_df.loc[transfer_idx, 'kode_bahan']
+            transfer_warna = master_df.loc[transfer_idx, 'warna']
+            item_ledger = get_item_location_ledger(transfer_kode, transfer_warna)
+            item_stock = {lokasi: row['stok'] for lokasi, row in item_ledger.items() if row['stok'] != 0}
+            if item_stock:
+                st.caption("Stok per lokasi: " + " • ".join(f"{lokasi}: {stok} ({item_ledger[lokasi]['yard']:,.2f} yard)" for lokasi, stok in item_stock.items()))
+            else:
+                st.caption("Item ini belum punya stok di lokasi mana pun.")
+            with st.form("transfer_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    dari_lokasi = st.selectbox("Dari Lokasi", list(item_stock) or locations, key="transfer_dari")
+                    transfer_stok = st.number_input("Jumlah", min_value=1, step=1, key="transfer_stok")
+                    transfer_yard = st.number_input("Yard (kosongkan = proporsional)", min_value=0.0, value=None, key="transfer_yard")
+                with col2:
+                    ke_lokasi = st.selectbox("Ke Lokasi", locations, key="transfer_ke")
+                    transfer_keterangan = st.text_input("Keterangan", key="transfer_keterangan")
+                if st.form_submit_button("🔁 Simpan Transfer"):
+                    success, message = add_stock_transfer(transfer_kode, transfer_warna, transfer_stok, dari_lokasi, ke_lokasi, transfer_keterangan, transfer_yard)
+                    if success:
+                        st.success(f"{message} ✅")
+                        st.rerun()
+                    else:
+                        st.error(f"{message} ❌")
+
+        with st.expander("Kelola Lokasi"):
+            st.write("Lokasi terdaftar: " + ", ".join(locations))
+            with st.form("add_location_form"):
+                new_lokasi = st.text_input("Nama Lokasi Baru (gudang/rak)")
+                new_lokasi_ket = st.text_input("Keterangan")
+                if st.form_submit_button("➕ Tambah Lokasi"):
+                    if add_location(new_lokasi, new_lokasi_ket):
+                        st.success(f"Lokasi **{new_lokasi}** ditambahkan. ✅")
+                        st.rerun()
+                    else:
+                        st.error("Nama lokasi kosong atau sudah ada. ❌")
     
     with tab_list:
         st.subheader("Daftar Barang Masuk")
         df = get_barang_masuk()
         if not df.empty:
             df['tanggal_waktu'] = pd.to_datetime(df['tanggal_waktu']).dt.strftime('%Y-%m-%d %H:%M:%S')
-            st.dataframe(df, use_container_width=True, hide_index=True)
+            show_paginated_table(df, "masuk_table", search_columns=['tanggal_waktu', 'kode_bahan', 'warna', 'keterangan'])
 
             st.markdown("---")
             with st.expander("Kelola Data Barang Masuk"):
                 # Gsheets doesn't have a simple ID column, so we'll use a combination of fields as a unique identifier.
-                df_to_edit = df.copy()
-                df_to_edit['unique_key'] = df_to_edit['tanggal_waktu'] + ' - ' + df_to_edit['kode_bahan'] + ' - ' + df_to_edit['warna'] + ' - ' + df_to_edit['stok'].astype(str)
-                record_to_edit_str = st.selectbox("Pilih Data yang akan diedit/dihapus", df_to_edit['unique_key'].tolist(), key="select_edit_in")
+                # Label hanya dibuat untuk baris yang cocok dengan pencarian.
+                row_index = searchable_picker(
+                    "Pilih Data yang akan diedit/dihapus", df,
+                    lambda rows: rows['tanggal_waktu'] + ' - ' + rows['kode_bahan'].astype(str) + ' - ' + rows['warna'].astype(str) + ' - ' + rows['stok'].astype(str),
+                    key="select_edit_in", search_columns=['tanggal_waktu', 'kode_bahan', 'warna', 'keterangan']
+                )
 
-                if record_to_edit_str:
-                    selected_row = df_to_edit[df_to_edit['unique_key'] == record_to_edit_str].iloc[0]
-                    row_index = df_to_edit[df_to_edit['unique_key'] == record_to_edit_str].index.tolist()[0]
+                if row_index is not None:
+                    selected_row = df.loc[row_index]
                     
                     with st.form("edit_in_form"):
                         edit_tanggal_waktu = st.text_input("Tanggal & Waktu", value=selected_row['tanggal_waktu'])
@@ -1017,7 +4334,7 @@ def show_input_masuk():
                             
                         edit_kode_bahan = st.selectbox("Kode barang", kode_bahan_options, index=selected_kode_index, key="edit_in_kode")
                         
-                        filtered_colors_edit = master_df[master_df['kode_bahan'] == edit_kode_bahan]['warna'].tolist()
+                        filtered_colors_edit = get_master_lookup()['colors_by_kode'].get(edit_kode_bahan, [])
                         
                         # PERBAIKAN: Menambahkan blok try-except untuk menangani ValueError pada warna
                         try:
@@ -1038,11 +4355,13 @@ def show_input_masuk():
                         # PERBAIKAN: Tangani nilai NaN dari kolom keterangan
                         keterangan_value = str(selected_row['keterangan']) if pd.notna(selected_row['keterangan']) else ""
                         edit_keterangan = st.text_area("Keterangan", value=keterangan_value, key="edit_in_ket")
+                        edit_lokasi_options = locations if selected_row['lokasi'] in locations else locations + [selected_row['lokasi']]
+                        edit_lokasi = st.selectbox("Lokasi Simpan", edit_lokasi_options, index=edit_lokasi_options.index(selected_row['lokasi']), key="edit_in_lokasi")
 
                         col_btn1, col_btn2 = st.columns(2)
                         with col_btn1:
                             if st.form_submit_button("Simpan Perubahan"):
-                                if update_barang_masuk(row_index, edit_tanggal_waktu, edit_kode_bahan, edit_warna, edit_stok, edit_yard, edit_keterangan):
+                                if update_barang_masuk(row_index, edit_tanggal_waktu, edit_kode_bahan, edit_warna, edit_stok, edit_yard, edit_keterangan, edit_lokasi):
                                     st.success("Data berhasil diperbarui! ✅")
                                     st.rerun()
                                 else:
@@ -1061,15 +4380,14 @@ def show_transaksi_keluar_invoice_page():
     st.title("Transaksi Keluar (Penjualan) & Invoice 🧾")
     st.markdown("---")
     
-    tab_new_invoice, tab_history = st.tabs(["➕ Buat Transaksi & Invoice Baru", "📝 Riwayat Transaksi"])
+    tab_new_invoice, tab_history, tab_customers, tab_receivables = st.tabs(["➕ Buat Transaksi & Invoice Baru", "📝 Riwayat Transaksi", "👥 Pelanggan", "💳 Piutang"])
     
-    master_df = get_master_barang()
-    if master_df.empty:
+    master_lookup = get_master_lookup()
+    if not master_lookup['records']:
         st.warning("Belum ada master barang. Silakan tambahkan di menu Master Barang. ⚠️")
         return
 
-    master_df['display_name'] = master_df['kode_bahan'] + ' - ' + master_df['nama_bahan'] + ' (' + master_df['warna'] + ')'
-    item_options = master_df['display_name'].tolist()
+    item_labels = master_lookup['labels']
 
     if 'cart_items' not in st.session_state:
         st.session_state['cart_items'] = []
@@ -1082,22 +4400,27 @@ def show_transaksi_keluar_invoice_page():
             with st.form("add_item_form"):
                 col_item_select, col_add_btn = st.columns([0.8, 0.2])
                 with col_item_select:
-                    item_to_add_str = st.selectbox("Pilih Item yang Akan Dijual", item_options, key="item_add_select")
+                    item_to_add_key = st.selectbox("Pilih Item yang Akan Dijual", list(item_labels.keys()), format_func=item_labels.get, key="item_add_select")
                 with col_add_btn:
                     st.markdown("<br>", unsafe_allow_html=True)
                     add_item_submitted = st.form_submit_button("➕ Tambah Item")
                 
                 if add_item_submitted:
-                    selected_item_data = master_df[master_df['display_name'] == item_to_add_str].iloc[0]
-                    harga_cleaned = float(selected_item_data['harga']) if pd.notna(selected_item_data['harga']) else 0.0
+                    selected_item_data = master_lookup['records'][item_to_add_key]
+                    # Harga yang berlaku saat ini dari riwayat harga; versinya ikut dicatat di invoice.
+                    harga_cleaned, versi_harga = get_price_at(selected_item_data['kode_bahan'], selected_item_data['warna'])
+                    if harga_cleaned is None:
+                        harga_cleaned = float(selected_item_data['harga']) if pd.notna(selected_item_data['harga']) else 0.0
                     new_item = {
                         "kode_bahan": selected_item_data['kode_bahan'],
                         "nama_bahan": selected_item_data['nama_bahan'],
                         "warna": selected_item_data['warna'],
-                        "harga": harga_cleaned,
+                        "harga": float(harga_cleaned),
+                        "versi_harga": versi_harga,
                         "qty": 0,
                         "yard": 0.0,
-                        "keterangan": ""
+                        "keterangan": "",
+                        "lokasi": None
                     }
                     st.session_state['cart_items'].append(new_item)
                     st.rerun()
@@ -1118,16 +4441,29 @@ def show_transaksi_keluar_invoice_page():
                             st.session_state['cart_items'].pop(i)
                             st.rerun()
 
+        st.subheader("Pelanggan")
+        customer_id, customer_name, customer_kontak = customer_picker("checkout_customer")
+
         # The main transaction form
         with st.form("new_transaction_form"):
-            customer_name = st.text_input("Nama Pelanggan", help="Wajib diisi", key="customer_name")
             
             total_invoice = 0
             if 'cart_items' in st.session_state:
                 for i, item in enumerate(st.session_state['cart_items']):
                     with st.container(border=True):
                         st.markdown(f"**Item {i+1}:** `{item['nama_bahan']} ({item['warna']})`")
-                        stok_saat_ini = get_stock_balance(item['kode_bahan'], item['warna'])
+                        # Lokasi ambil: urut dari stok terbanyak
+                        item_ledger = get_item_location_ledger(item['kode_bahan'], item['warna'])
+                        item_stock = {lokasi: row['stok'] for lokasi, row in item_ledger.items() if row['stok'] != 0}
+                        pick_options = sorted(item_stock, key=item_stock.get, reverse=True) or [LOKASI_DEFAULT]
+                        current_lokasi = item.get('lokasi') if item.get('lokasi') in pick_options else pick_options[0]
+                        st.session_state.cart_items[i]['lokasi'] = st.selectbox(
+                            "Lokasi Ambil", pick_options, index=pick_options.index(current_lokasi),
+                            format_func=lambda lokasi: f"{lokasi} (stok {int(item_ledger.get(lokasi, {}).get('stok', 0))}, "
+                                                       f"{item_ledger.get(lokasi, {}).get('yard', 0.0):,.2f} yard)",
+                            key=f"lokasi_{i}"
+                        )
+                        stok_saat_ini = item_stock.get(st.session_state.cart_items[i]['lokasi'], 0)
                         
                         col_qty, col_yard = st.columns(2)
                         with col_qty:
@@ -1161,6 +4497,15 @@ def show_transaksi_keluar_invoice_page():
                         st.markdown(f"**Total Harga Item:** Rp {current_item_total:,.2f}")
                 
             st.markdown(f"### **Total Keseluruhan:** **Rp {total_invoice:,.2f}**")
+
+            col_status, col_dibayar, col_metode = st.columns(3)
+            with col_status:
+                payment_status = st.radio("Pembayaran", ["Lunas", "Tempo / Sebagian"], horizontal=True, key="checkout_payment_status")
+            with col_dibayar:
+                uang_muka = st.number_input("Dibayar Sekarang (Rp)", min_value=0.0, value=0.0, step=1000.0,
+                                            help="Hanya dipakai untuk Tempo / Sebagian", key="checkout_uang_muka")
+            with col_metode:
+                payment_method = st.selectbox("Metode Bayar", PAYMENT_METHODS, key="checkout_payment_method")
             
             submitted = st.form_submit_button("💾 Simpan Transaksi & Buat Invoice")
             if submitted:
@@ -1169,8 +4514,13 @@ def show_transaksi_keluar_invoice_page():
                 elif not st.session_state['cart_items'] or all(item['qty'] == 0 for item in st.session_state['cart_items']):
                     st.error("Mohon tambahkan setidaknya satu item dengan jumlah lebih dari 0.")
                 else:
+                    if customer_id is None:
+                        customer_id = add_customer(customer_name, customer_kontak)
                     new_invoice_number = generate_invoice_number()
-                    success, message = add_barang_keluar_and_invoice(new_invoice_number, customer_name, st.session_state['cart_items'])
+                    success, message = add_barang_keluar_and_invoice(
+                        new_invoice_number, customer_name, st.session_state['cart_items'], customer_id,
+                        dibayar=None if payment_status == "Lunas" else uang_muka, metode=payment_method
+                    )
                     if success:
                         st.success(f"{message} Nomor Invoice: **{new_invoice_number}** ✅")
                         st.balloons()
@@ -1184,78 +4534,271 @@ def show_transaksi_keluar_invoice_page():
         invoice_df = get_invoices()
         
         if not invoice_df.empty:
-            # Tambahkan kolom gabungan untuk pencarian dan tampilan
-            invoice_df['display_option'] = invoice_df['invoice_number'] + ' | ' + invoice_df['tanggal_waktu'] + ' | ' + invoice_df['customer_name']
-            
-            # Tambahkan input pencarian
-            search_query = st.text_input("Cari Invoice (No. Invoice, Tanggal, atau Nama Pelanggan)", key="invoice_search_query")
-            
-            # Filter DataFrame berdasarkan kueri pencarian
-            if search_query:
-                filtered_invoices = invoice_df[
-                    invoice_df['display_option'].str.contains(search_query, case=False, na=False)
-                ]
-            else:
-                filtered_invoices = invoice_df
-                
-            st.dataframe(filtered_invoices[['invoice_number', 'tanggal_waktu', 'customer_name']], use_container_width=True, hide_index=True)
+            show_paginated_table(invoice_df[['invoice_number', 'tanggal_waktu', 'customer_name']], "invoice_table",
+                                 search_columns=['invoice_number', 'tanggal_waktu', 'customer_name'])
             
             st.markdown("---")
             
-            # Buat daftar opsi yang difilter untuk selectbox
-            invoice_options = filtered_invoices['display_option'].tolist()
+            # Pencarian invoice hanya mengirim opsi yang cocok ke selectbox
+            selected_invoice_idx = searchable_picker(
+                "Invoice untuk Dilihat/Unduh", invoice_df,
+                lambda rows: rows['invoice_number'].astype(str) + ' | ' + rows['tanggal_waktu'].astype(str) + ' | ' + rows['customer_name'].astype(str),
+                key="select_invoice_to_view", search_columns=['invoice_number', 'tanggal_waktu', 'customer_name']
+            )
             
-            if not invoice_options:
+            if selected_invoice_idx is None:
                 st.info("Tidak ada invoice yang cocok dengan pencarian.")
             else:
-                selected_combined_option = st.selectbox(
-                    "Pilih Invoice untuk Dilihat/Unduh",
-                    options=invoice_options,
-                    key="select_invoice_to_view"
-                )
-                
-                if selected_combined_option:
-                    # Ekstrak nomor invoice dari string yang dipilih
-                    selected_invoice_number = selected_combined_option.split(' | ')[0]
-    
-                    invoice_data = filtered_invoices[filtered_invoices['invoice_number'] == selected_invoice_number].iloc[0]
-                    invoice_items = get_invoice_items(selected_invoice_number)
-    
-                    st.subheader(f"Detail Invoice: {selected_invoice_number}")
-                    st.write(f"**Tanggal & Waktu:** {invoice_data['tanggal_waktu']}")
-                    st.write(f"**Nama Pelanggan:** {invoice_data['customer_name']}")
-    
-                    st.dataframe(invoice_items, use_container_width=True, hide_index=True)
-    
-                    pdf_content = generate_invoice_pdf({
+                invoice_data = invoice_df.loc[selected_invoice_idx]
+                selected_invoice_number = invoice_data['invoice_number']
+                invoice_items = get_invoice_items(selected_invoice_number)
+
+                st.subheader(f"Detail Invoice: {selected_invoice_number}")
+                st.write(f"**Tanggal & Waktu:** {invoice_data['tanggal_waktu']}")
+                st.write(f"**Nama Pelanggan:** {invoice_data['customer_name']}")
+
+                st.dataframe(invoice_items, use_container_width=True, hide_index=True)
+
+                outstanding = get_invoice_outstanding(selected_invoice_number)
+                st.write(f"**Status Pembayaran:** {'Lunas' if outstanding <= 0 else f'Sisa tagihan Rp {outstanding:,.2f}'}")
+                invoice_payments = get_invoice_payments(selected_invoice_number)
+                if not invoice_payments.empty:
+                    st.dataframe(invoice_payments, use_container_width=True, hide_index=True)
+                if outstanding > 0:
+                    with st.form("invoice_payment_form"):
+                        col_jumlah, col_metode, col_ket = st.columns(3)
+                        with col_jumlah:
+                            payment_amount = st.number_input("Jumlah Bayar (Rp)", min_value=0.0, max_value=float(outstanding), value=float(outstanding), step=1000.0)
+                        with col_metode:
+                            payment_method = st.selectbox("Metode Bayar", PAYMENT_METHODS)
+                        with col_ket:
+                            payment_note = st.text_input("Keterangan")
+                        if st.form_submit_button("💳 Catat Pembayaran"):
+                            success, message = post_payment(selected_invoice_number, payment_amount, payment_method, payment_note)
+                            if success:
+                                st.success(message + " ✅")
+                                st.rerun()
+                            else:
+                                st.error(message + " ❌")
+
+                if st.button("Buat PDF Invoice", use_container_width=True):
+                    submit_job('invoice', f"Invoice {selected_invoice_number}", generate_invoice_pdf, {
                         'No Invoice': invoice_data['invoice_number'],
                         'Tanggal & Waktu': invoice_data['tanggal_waktu'],
                         'Nama Pelanggan': invoice_data['customer_name']
-                    }, invoice_items)
-    
-                    st.download_button(
-                        label="Unduh PDF Invoice",
-                        data=pdf_content,
-                        file_name=f"invoice_{selected_invoice_number}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
+                    }, invoice_items, owner=st.session_state.get('username'),
+                        file_name=f"invoice_{selected_invoice_number}.pdf", mime="application/pdf")
+                show_job_panel(['invoice'], key="invoice_jobs")
         else:
             st.info("Belum ada data transaksi keluar.")
 
+    with tab_customers:
+        st.subheader("Data Pelanggan")
+        with st.expander("➕ Tambah Pelanggan Baru", expanded=False):
+            with st.form("add_customer_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    new_customer_name = st.text_input("Nama Pelanggan")
+                with col2:
+                    new_customer_kontak = st.text_input("Kontak (No. HP/Alamat)")
+                if st.form_submit_button("Tambah Pelanggan"):
+                    if not new_customer_name.strip():
+                        st.error("Nama Pelanggan wajib diisi.")
+                    elif _customer_key(new_customer_name) in get_customer_lookup()['by_name']:
+                        st.warning("Pelanggan dengan nama tersebut sudah ada.")
+                    elif add_customer(new_customer_name, new_customer_kontak.strip()) is not None:
+                        st.success("Pelanggan berhasil ditambahkan! ✅")
+                        st.rerun()
+                    else:
+                        st.error("Gagal menambahkan pelanggan.")
+
+        customer_summary = get_customer_summary()
+        if customer_summary.empty:
+            st.info("Belum ada data pelanggan.")
+        else:
+            show_paginated_table(customer_summary, "customer_table", search_columns=['customer_id', 'nama_pelanggan', 'kontak'])
+
+            st.markdown("---")
+            st.subheader("Rekening Pelanggan")
+            statement_customer, statement_name, statement_kontak = customer_picker("statement_customer")
+            if statement_customer is None:
+                st.info("Pilih pelanggan untuk melihat rekeningnya.")
+            else:
+                entry = customer_summary.set_index('customer_id').loc[statement_customer]
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Total Belanja", f"Rp {entry['total_belanja']:,.2f}")
+                col2.metric("Jumlah Invoice", int(entry['jumlah_invoice']))
+                col3.metric("Sisa Tagihan", f"Rp {entry['sisa_tagihan']:,.2f}")
+                st.dataframe(get_customer_statement(statement_customer), use_container_width=True, hide_index=True)
+
+                with st.form("edit_customer_form"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        edit_customer_name = st.text_input("Nama Pelanggan", value=statement_name)
+                    with col2:
+                        edit_customer_kontak = st.text_input("Kontak", value=statement_kontak)
+                    if st.form_submit_button("Simpan Perubahan"):
+                        if not edit_customer_name.strip():
+                            st.error("Nama Pelanggan wajib diisi.")
+                        elif update_customer(statement_customer, edit_customer_name, edit_customer_kontak.strip()):
+                            st.success("Data pelanggan berhasil diperbarui! ✅")
+                            st.rerun()
+                        else:
+                            st.error("Gagal memperbarui data pelanggan.")
+
+    with tab_receivables:
+        st.subheader("Umur Piutang")
+        open_invoices, aging_table = compute_receivable_aging()
+        if open_invoices.empty:
+            st.info("Tidak ada invoice yang belum lunas.")
+        else:
+            bucket_columns = st.columns(len(AGING_BUCKETS))
+            for column, bucket in zip(bucket_columns, AGING_BUCKETS):
+                column.metric(bucket, f"Rp {aging_table[bucket].sum():,.2f}")
+            st.write(f"**Total Piutang:** Rp {aging_table['Total'].sum():,.2f} dari {len(open_invoices)} invoice")
+            st.dataframe(aging_table.style.format("Rp {:,.2f}"), use_container_width=True)
+            st.download_button(
+                label="Unduh Umur Piutang (CSV)",
+                data=aging_table.to_csv().encode('utf-8'),
+                file_name=f"umur_piutang_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
+            st.markdown("---")
+            st.subheader("Invoice Belum Lunas")
+            show_paginated_table(
+                open_invoices[['invoice_number', 'nama_pelanggan', 'tanggal_waktu', 'umur_hari', 'kelompok', 'total', 'terbayar', 'sisa']].astype({'kelompok': str}),
+                "open_invoice_table", search_columns=['invoice_number', 'nama_pelanggan']
+            )
+            st.caption("Pembayaran dicatat dari tab **Riwayat Transaksi** → pilih invoice → **Catat Pembayaran**.")
+
 def show_monitoring_stok():
     st.title("Monitoring Stok 📊")
     st.markdown("---")
     
     st.subheader("Stok Saat Ini")
-    master_df = get_master_barang()
+    master_df = get_columns_from_gsheets('master_barang', ['kode_bahan', 'nama_bahan', 'warna'])
     if not master_df.empty:
-        master_df['Stok Saat Ini'] = master_df.apply(lambda row: get_stock_balance(row['kode_bahan'], row['warna']), axis=1)
-        df_display = master_df[['kode_bahan', 'nama_bahan', 'warna', 'Stok Saat Ini']].copy()
+        df_display = attach_stock_balance(master_df.copy(), yard_column='Sisa Yard')
         st.dataframe(df_display, use_container_width=True, hide_index=True)
+
+        st.subheader("Stok per Lokasi")
+        # Semua lokasi berasal dari satu agregasi saldo; tabel dipivot menjadi satu kolom per lokasi.
+        location_table = get_location_stock_table()
+        lokasi_filter = st.multiselect("Tampilkan Lokasi", [col for col in location_table.columns if col not in STOCK_KEYS + ['Total', 'Total Yard']], key="monitor_lokasi")
+        stock_columns = [col for col in location_table.columns if col not in STOCK_KEYS]
+        location_table = master_df.astype({'kode_bahan': str, 'warna': str}).merge(location_table, on=STOCK_KEYS, how='left')
+        location_table[stock_columns] = location_table[stock_columns].fillna(0)
+        unit_columns = [col for col in stock_columns if col != 'Total Yard']
+        location_table[unit_columns] = location_table[unit_columns].astype(int)
+        if lokasi_filter:
+            location_table = location_table[STOCK_KEYS + ['nama_bahan'] + lokasi_filter + ['Total', 'Total Yard']]
+        show_paginated_table(location_table, "location_stock_table", search_columns=['kode_bahan', 'nama_bahan', 'warna'])
     else:
         st.warning("Belum ada master barang.")
 
+    st.markdown("---")
+    st.header("Saldo Stok per Tanggal")
+    balance_date = st.date_input("Tanggal Saldo", value=datetime.now().date(), key="balance_as_of")
+    if st.button("Tampilkan Saldo"):
+        as_of = datetime.combine(balance_date, datetime.max.time())
+        balances = compute_stock_balances(as_of).rename('Stok').reset_index()
+        balances = balances[balances['Stok'] != 0]
+        if not balances.empty:
+            st.dataframe(balances, use_container_width=True, hide_index=True)
+        else:
+            st.info("Tidak ada stok pada tanggal tersebut.")
+
+    if st.session_state.get('role') == 'owner':
+        with st.expander("Checkpoint & Arsip Stok"):
+            checkpoints = get_stock_checkpoints(include_empty=True)
+            boundary = get_archive_boundary()
+            last_checkpoint = checkpoints['tanggal_snapshot'].max() if not checkpoints.empty else None
+            st.write(f"**Checkpoint terakhir:** {last_checkpoint if last_checkpoint is not None else '-'}")
+            st.write(f"**Pergerakan diarsipkan sampai:** {boundary if boundary is not None else '-'}")
+            col_cp, col_arc = st.columns(2)
+            with col_cp:
+                if st.button("Buat Checkpoint Sekarang", use_container_width=True):
+                    if create_stock_checkpoint(datetime.now().replace(microsecond=0)):
+                        st.success("Checkpoint stok berhasil dibuat. ✅")
+                        st.rerun()
+                    else:
+                        st.error("Gagal membuat checkpoint stok.")
+            with col_arc:
+                if st.button("Arsipkan Pergerakan s/d Checkpoint Terakhir", use_container_width=True):
+                    moved = archive_stock_movements()
+                    if moved is None:
+                        st.error("Pengarsipan belum selesai. Pastikan terhubung ke Google Sheets, lalu coba lagi.")
+                    else:
+                        st.success(f"{moved} baris pergerakan dipindahkan ke arsip. ✅")
+
+        with st.expander("Log Event & Pemeriksaan Konsistensi Stok"):
+            events = get_stock_events(SHEET_SCHEMA['stock_events'])
+            st.write(f"**Jumlah event tercatat:** {len(events)}")
+            if not events.empty:
+                st.dataframe(events.tail(50).iloc[::-1], use_container_width=True, hide_index=True)
+            if st.button("Periksa Konsistensi", use_container_width=True):
+                report_labels = {
+                    'invoice_tanpa_item': "Invoice tanpa item",
+                    'item_tanpa_invoice': "Item invoice tanpa header invoice",
+                    'selisih_barang_keluar': "Selisih qty invoice vs barang keluar",
+                    'selisih_saldo': "Selisih saldo log event vs worksheet pergerakan",
+                    'seq_bermasalah': "Nomor urut event duplikat/hilang",
+                }
+                report = check_stock_consistency()
+                problems = {name: df for name, df in report.items() if not df.empty}
+                if not problems:
+                    st.success("Data stok dan invoice konsisten. ✅")
+                for name, df in problems.items():
+                    st.error(f"{report_labels[name]}: {len(df)} baris")
+                    st.dataframe(df, use_container_width=True, hide_index=True)
+
+        with st.expander("Laporan Nilai Stok (Multi Tanggal)"):
+            col_start, col_end = st.columns(2)
+            with col_start:
+                valuation_start = st.date_input("Dari Tanggal", value=datetime.now().date().replace(day=1), key="valuation_start")
+            with col_end:
+                valuation_end = st.date_input("Sampai Tanggal", value=datetime.now().date(), key="valuation_end")
+            col_freq, col_group = st.columns(2)
+            with col_freq:
+                frequency = st.selectbox("Frekuensi", ["Akhir Bulan", "Akhir Minggu", "Harian"], key="valuation_freq")
+            with col_group:
+                group_labels = {'rak': 'Rak', 'nama_supplier': 'Supplier', 'item': 'Item'}
+                group_by = st.selectbox("Kelompokkan per", list(group_labels.keys()), format_func=group_labels.get, key="valuation_group")
+            if st.button("Hitung Nilai Stok"):
+                if valuation_start > valuation_end:
+                    st.error("Tanggal awal harus sebelum tanggal akhir.")
+                else:
+                    report, _ = compute_stock_valuation(valuation_dates(valuation_start, valuation_end, frequency), group_by)
+                    st.dataframe(report.style.format("Rp {:,.2f}"), use_container_width=True)
+                    st.download_button(
+                        label="Unduh Laporan (CSV)",
+                        data=report.to_csv().encode('utf-8'),
+                        file_name=f"nilai_stok_{valuation_start}_{valuation_end}.csv",
+                        mime="text/csv"
+                    )
+
+        with st.expander("Laporan Penjualan"):
+            col_start, col_end = st.columns(2)
+            with col_start:
+                sales_start = st.date_input("Dari Tanggal", value=datetime.now().date().replace(day=1), key="sales_start")
+            with col_end:
+                sales_end = st.date_input("Sampai Tanggal", value=datetime.now().date(), key="sales_end")
+            if st.button("Tampilkan Laporan Penjualan"):
+                sales_report = compute_sales_report(sales_start, sales_end)
+                if sales_report.empty:
+                    st.info("Tidak ada penjualan pada rentang tanggal tersebut.")
+                else:
+                    col_omzet, col_selisih = st.columns(2)
+                    col_omzet.metric("Total Omzet", f"Rp {sales_report['omzet'].sum():,.2f}")
+                    col_selisih.metric("Selisih vs Harga Daftar", f"Rp {sales_report['selisih'].sum():,.2f}")
+                    st.dataframe(sales_report, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        label="Unduh Laporan Penjualan (CSV)",
+                        data=sales_report.to_csv(index=False).encode('utf-8'),
+                        file_name=f"penjualan_{sales_start}_{sales_end}.csv",
+                        mime="text/csv"
+                    )
+
     st.markdown("---")
     st.header("Rekam Jejak Stok (In & Out)")
     
@@ -1278,25 +4821,51 @@ def show_monitoring_stok():
     st.info("Klik tombol di bawah ini untuk membuat dan mengunduh semua data dari Google Sheets sebagai satu file Excel.")
     
     if st.button("Buat & Unduh Backup Data Lengkap"):
-        with st.spinner('Membuat file backup Excel...'):
-            excel_data = create_excel_backup()
-        
-        if excel_data:
-            st.success("File backup berhasil dibuat! ✅")
-            st.download_button(
-                label="Unduh File Backup Excel",
-                data=excel_data,
-                file_name=f"backup_data_bka_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        else:
-            st.error("Gagal membuat file backup.")
+        submit_job('backup', "Backup Data Lengkap", create_excel_backup,
+                   owner=st.session_state.get('username'),
+                   file_name=f"backup_data_bka_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        st.success("Backup sedang dibuat di latar belakang. File dapat diunduh di bawah setelah selesai. ✅")
+    show_job_panel(['backup'], key="backup_jobs")
+
+    if st.session_state.get('role') == 'owner':
+        with st.expander("Status Kuota API Google Sheets"):
+            metrics = get_sheets_metrics()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Panggilan API", metrics['calls'], help=f"Baca {metrics['reads']} · Tulis {metrics['writes']}")
+            col2.metric("Kena Limit (429)", metrics['rate_limited'], help=f"Retry {metrics['retries']} · Gagal {metrics['failures']}")
+            col3.metric("Menunggu Kuota", metrics['budget_waits'], help=f"Total {metrics['budget_wait_seconds']:.1f} detik")
+            col4.metric("Baca Digabung", metrics['coalesced'])
+
+        with st.expander("Sinkronisasi Offline"):
+            offline = get_offline_status()
+            status = get_journal_status()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Koneksi", "Offline" if offline else "Online")
+            col2.metric("Baris Menunggu", sum(status['pending'].values()))
+            col3.metric("Sinkron Terakhir", status['last_sync'] or "-")
+            if status['pending']:
+                st.dataframe(pd.DataFrame(list(status['pending'].items()), columns=['Worksheet', 'Baris Menunggu']),
+                             use_container_width=True, hide_index=True)
+            for sheet_name, error in status['errors'].items():
+                st.error(f"Gagal mengirim '{sheet_name}': {error}")
+            if status['conflicts']:
+                st.write("Nomor yang diganti karena sudah dipakai di Google Sheets:")
+                st.dataframe(pd.DataFrame(status['conflicts']), use_container_width=True, hide_index=True)
+            if st.button("🔄 Sinkronkan Sekarang", key="sync_journal_now"):
+                if offline:
+                    wake_journal_sync()
+                    st.info("Mencoba menghubungkan ulang ke Google Sheets di latar belakang.")
+                elif sync_journal():
+                    st.success("Semua data sudah terkirim ke Google Sheets. ✅")
+                else:
+                    st.warning("Sebagian data belum terkirim, akan dicoba lagi otomatis.")
 
 def show_payroll_page():
     st.title("Sistem Penggajian Karyawan 💰")
     st.markdown("---")
     
-    tab_master, tab_process, tab_history = st.tabs(["👥 Master Karyawan", "💸 Proses Penggajian", "📝 Riwayat Penggajian"])
+    tab_master, tab_process, tab_batch, tab_history = st.tabs(["👥 Master Karyawan", "💸 Proses Penggajian", "📋 Proses Massal", "📝 Riwayat Penggajian"])
 
     with tab_master:
         st.subheader("Data Master Karyawan")
@@ -1366,18 +4935,15 @@ def show_payroll_page():
 
     with tab_process:
         st.subheader("Proses Penggajian Bulanan")
-        employees_df = get_employees()
-        if employees_df.empty:
+        employee_lookup = get_employee_lookup()
+        if not employee_lookup['records']:
             st.warning("Tambahkan data karyawan terlebih dahulu di tab 'Master Karyawan'. ⚠️")
         else:
-            # Gsheets doesn't have an ID column by default. We'll simulate it for this session.
-            employees_df['id'] = range(1, len(employees_df) + 1)
-            employee_options = employees_df.apply(lambda row: f"{int(row['id'])} - {row['nama_karyawan']} ({row['bagian']})", axis=1).tolist()
-            selected_employee_str = st.selectbox("Pilih Karyawan", employee_options)
+            employee_labels = employee_lookup['labels']
+            employee_id = st.selectbox("Pilih Karyawan", list(employee_labels.keys()), format_func=employee_labels.get)
             
-            if selected_employee_str:
-                employee_id = int(selected_employee_str.split(' - ')[0])
-                selected_employee_data = employees_df[employees_df['id'] == employee_id].iloc[0]
+            if employee_id is not None:
+                selected_employee_data = employee_lookup['records'][employee_id]
                 
                 with st.form("payroll_form"):
                     st.write(f"**Nama:** {selected_employee_data['nama_karyawan']}")
@@ -1431,48 +4997,74 @@ def show_payroll_page():
                         else:
                             st.error("Gagal menyimpan data gaji.")
 
+    with tab_batch:
+        st.subheader("Proses Penggajian Massal")
+        grid = build_payroll_grid()
+        if grid.empty:
+            st.warning("Tambahkan data karyawan terlebih dahulu di tab 'Master Karyawan'. ⚠️")
+        else:
+            batch_date = st.date_input("Pilih Tanggal Gaji", value=datetime.now().date(), key="batch_payroll_date")
+            batch_bulan = batch_date.strftime('%B %Y')
+
+            uploaded_file = st.file_uploader(
+                "Unggah Absensi/Lembur/Potongan (CSV atau Excel, opsional)", type=['csv', 'xlsx'], key="batch_payroll_upload",
+                help="Kolom kunci: employee_id atau nama_karyawan. Kolom nilai: " + ", ".join(['hari_kerja'] + PAYROLL_AMOUNT_COLUMNS + ['keterangan'])
+            )
+            if uploaded_file is not None:
+                try:
+                    uploaded = pd.read_csv(uploaded_file) if uploaded_file.name.endswith('.csv') else pd.read_excel(uploaded_file)
+                    grid, unmatched = merge_payroll_upload(grid, uploaded)
+                    if unmatched:
+                        st.warning(f"{len(unmatched)} baris file tidak cocok dengan karyawan mana pun dan diabaikan: "
+                                   f"{', '.join(map(str, unmatched))}")
+                except Exception as e:
+                    st.error(f"Gagal membaca file: {e}")
+
+            edited = st.data_editor(
+                grid, use_container_width=True, hide_index=True, key="batch_payroll_editor",
+                disabled=['employee_id', 'nama_karyawan', 'bagian', 'gaji_per_hari']
+            )
+            computed = compute_payroll_batch(edited)
+            st.dataframe(computed[['employee_id', 'nama_karyawan', 'gaji_pokok', 'total_pendapatan', 'total_setelah_potongan', 'gaji_akhir']],
+                         use_container_width=True, hide_index=True)
+            st.markdown(f"### **Total Gaji {batch_bulan}:** **Rp {computed['gaji_akhir'].sum():,.2f}**")
+
+            if st.button("💾 Simpan Semua Gaji", key="batch_payroll_save"):
+                errors = validate_payroll_batch(computed, batch_bulan)
+                if not errors.empty:
+                    st.error(f"{len(errors)} masalah ditemukan. Tidak ada data yang disimpan. ❌")
+                    st.dataframe(errors, use_container_width=True, hide_index=True)
+                elif add_payroll_records_bulk(computed, batch_bulan):
+                    st.success(f"Penggajian {len(computed)} karyawan untuk {batch_bulan} berhasil dicatat. ✅")
+                else:
+                    st.error("Gagal menyimpan data gaji.")
+
     with tab_history:
         st.subheader("Riwayat Penggajian")
         
         st.markdown("### Unduh Semua Slip Gaji (PDF)")
-        payroll_df_all = get_data_from_gsheets('payroll')
-        if not payroll_df_all.empty:
-            payroll_months = payroll_df_all['gaji_bulan'].unique().tolist()
-            selected_month = st.selectbox("Pilih Bulan Gaji", payroll_months)
+        payroll_months = get_payroll_months()
+        if payroll_months:
+            selected_month = st.selectbox("Pilih Bulan Gaji", payroll_months, format_func=localize_month_label)
             
-            if st.button(f"Unduh Slip Gaji {selected_month}"):
+            if st.button(f"Buat Slip Gaji {localize_month_label(selected_month)}"):
                 payslip_data = get_payroll_records_by_month(selected_month)
                 if not payslip_data.empty:
-                    pdf_file = generate_payslips_pdf(payslip_data)
-                    st.download_button(
-                        label="Unduh PDF 📥",
-                        data=pdf_file,
-                        file_name=f"slip_gaji_{selected_month.replace(' ', '_')}.pdf",
-                        mime="application/pdf"
-                    )
+                    submit_job('payslip', f"Slip Gaji {localize_month_label(selected_month)}", generate_payslips_pdf, payslip_data,
+                               owner=st.session_state.get('username'),
+                               file_name=f"slip_gaji_{selected_month.replace(' ', '_')}.pdf", mime="application/pdf")
                 else:
                     st.error("Data penggajian tidak ditemukan untuk bulan tersebut. ❌")
+            show_job_panel(['payslip'], key="payslip_jobs")
         else:
             st.info("Tidak ada riwayat penggajian untuk diunduh.")
 
         st.markdown("---")
         st.subheader("Tabel Riwayat Penggajian")
-        payroll_df = get_payroll_records()
-        if not payroll_df.empty:
-            month_mapping = {
-                'January': 'Januari', 'February': 'Februari', 'March': 'Maret',
-                'April': 'April', 'May': 'Mei', 'June': 'Juni',
-                'July': 'Juli', 'August': 'Agustus', 'September': 'September',
-                'October': 'Oktober', 'November': 'November', 'December': 'Desember'
-            }
-            
-            payroll_df['tanggal_waktu'] = pd.to_datetime(payroll_df['tanggal_waktu'])
-            payroll_df['tanggal_waktu'] = payroll_df['tanggal_waktu'].dt.strftime('%d %B %Y')
-            
-            for en, idn in month_mapping.items():
-                payroll_df['tanggal_waktu'] = payroll_df['tanggal_waktu'].str.replace(en, idn)
-            
-            st.dataframe(payroll_df, use_container_width=True, hide_index=True)
+        if payroll_months:
+            payroll_df = get_payroll_records_by_month(selected_month)
+            payroll_df = payroll_df[['tanggal_tampil', 'gaji_bulan', 'nama_karyawan', 'gaji_akhir', 'keterangan']].rename(columns={'tanggal_tampil': 'tanggal_waktu'})
+            show_paginated_table(payroll_df, "payroll_table", search_columns=['tanggal_waktu', 'nama_karyawan', 'keterangan'])
         else:
             st.info("Belum ada riwayat penggajian.")
 
@@ -1485,10 +5077,20 @@ def login_page():
         password = st.text_input("Kata Sandi", type="password")
         submitted = st.form_submit_button("Login")
         if submitted:
-            success, role = check_login(username, password)
+            client = _login_client()
+            retry_after = login_retry_after(username, client)
+            if retry_after > 0:
+                st.error(f"Terlalu banyak percobaan login gagal. Coba lagi dalam {retry_after} detik. ⏳")
+                return
+            # Migrasi skema berjalan setelah login berhasil (di main). Hanya spreadsheet yang belum punya
+            # pengguna sama sekali yang disiapkan di sini, karena pengguna awal dibuat oleh migrasi itu.
+            if not get_user_index():
+                ensure_worksheets()
+            success, role = check_login(username, password, client)
             if success:
                 st.session_state['logged_in'] = True
                 st.session_state['role'] = role
+                st.session_state['username'] = username
                 st.session_state['page'] = 'Dashboard'
                 st.success(f"Berhasil Login sebagai **{role.upper()}**! ✅")
                 st.rerun()
@@ -1502,11 +5104,11 @@ def main():
     
     st.sidebar.title("PT. BERKAT KARYA ANUGERAH")
     st.sidebar.markdown("---")
+    show_connection_status()
 
     if st.session_state['logged_in']:
-        if 'sheets_checked' not in st.session_state:
-            check_and_create_worksheets()
-            st.session_state['sheets_checked'] = True
+        ensure_worksheets()
+        maybe_create_stock_checkpoint()
             
         role = st.session_state['role']
 
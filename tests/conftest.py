@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    """The app module with fresh process state and local files under tmp_path."""
+    app_module.st.cache_resource.clear()
+    app_module.st.cache_data.clear()
+    monkeypatch.setattr(app_module, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(app_module, 'JOURNAL_DIR', str(tmp_path / 'journal'))
+    monkeypatch.setattr(app_module, 'JOURNAL_PATH', str(tmp_path / 'journal' / 'journal.jsonl'))
+    return app_module
+
+
+@pytest.fixture
+def sheets(app, monkeypatch):
+    """In-memory worksheets behind get_data_from_gsheets / get_columns_from_gsheets."""
+    import pandas as pd
+
+    data = {}
+
+    def fake_get(sheet_name):
+        rows = data.get(sheet_name, [])
+        return pd.DataFrame(rows, columns=app.SHEET_SCHEMA[sheet_name]) if rows else pd.DataFrame()
+
+    def fake_columns(sheet_name, columns):
+        df = fake_get(sheet_name)
+        return df.reindex(columns=list(columns)) if not df.empty else pd.DataFrame(columns=list(columns))
+
+    monkeypatch.setattr(app, 'get_data_from_gsheets', fake_get)
+    monkeypatch.setattr(app, 'get_columns_from_gsheets', fake_columns)
+    return data
@@ -0,0 +1,49 @@
+"""Archiving movements: the boundary only moves once the main worksheets are cleaned up."""
+import pytest
+
+
+@pytest.fixture
+def movements(app, sheets, monkeypatch):
+    sheets['stock_snapshot'] = [['2026-10-01 00:00:00', 'K1', 'merah', 5, 'Gudang', 10.0]]
+    sheets['barang_masuk'] = [
+        ['2026-09-01 08:00:00', 'K1', 'merah', 5, 10.0, '', 'Gudang'],
+        ['2026-10-05 08:00:00', 'K1', 'merah', 1, 2.0, '', 'Gudang'],
+    ]
+
+    def append(sheet_name, rows):
+        sheets.setdefault(sheet_name, []).extend(rows)
+        return True
+
+    def delete(sheet_name, row_indices):
+        if deletes_fail:
+            return False
+        sheets[sheet_name] = [row for i, row in enumerate(sheets[sheet_name]) if i not in set(row_indices)]
+        return True
+
+    deletes_fail = True
+    monkeypatch.setattr(app, 'append_rows_to_gsheet', append)
+    monkeypatch.setattr(app, 'append_row_to_gsheet', lambda sheet_name, row: append(sheet_name, [row]))
+    monkeypatch.setattr(app, 'delete_rows_from_gsheet', delete)
+    monkeypatch.setattr(app, '_positional_worksheet', lambda sheet_name: object())
+
+    def allow_deletes():
+        nonlocal deletes_fail
+        deletes_fail = False
+
+    return allow_deletes
+
+
+def test_failed_delete_keeps_boundary_and_retry_does_not_duplicate(app, sheets, movements):
+    assert app.archive_stock_movements() is None
+    assert app.get_archive_boundary() is None
+    movements()
+    assert app.archive_stock_movements() == 1
+    assert len(sheets['barang_masuk_arsip']) == 1
+    assert [row[0] for row in sheets['barang_masuk']] == ['2026-10-05 08:00:00']
+    assert app.get_archive_boundary() == app.pd.Timestamp('2026-10-01')
+
+
+def test_refuses_to_archive_offline(app, sheets, movements, monkeypatch):
+    monkeypatch.setattr(app, 'get_offline_status', lambda: 'offline')
+    assert app.archive_stock_movements() is None
+    assert 'barang_masuk_arsip' not in sheets
@@ -0,0 +1,15 @@
+"""Stock checkpoints: an empty checkpoint records its date without adding an item."""
+import pytest
+
+
+def test_empty_checkpoint_is_not_an_item(app, sheets, monkeypatch):
+    sheets['barang_masuk'] = [['2026-10-02 08:00:00', 'K1', 'merah', 3, 1.5, '', 'Gudang']]
+    sheets['stock_snapshot'] = [['2026-10-01 00:00:00', '', '', 0, '', 0.0]]
+
+    assert app.get_stock_checkpoints().empty
+    assert len(app.get_stock_checkpoints(include_empty=True)) == 1
+    ledger = app.compute_stock_ledger()
+    assert ledger.index.tolist() == [('K1', 'merah')]
+    assert ledger.loc[('K1', 'merah'), 'stok'] == 3
+    monkeypatch.setattr(app, 'append_rows_to_gsheet', lambda *args: pytest.fail('checkpoint written twice'))
+    assert app.create_stock_checkpoint('2026-10-01 00:00:00') is False
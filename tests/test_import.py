@@ -0,0 +1,25 @@
+"""Bulk import: the file is validated and written one chunk at a time."""
+import io
+
+
+def upload(text, name='master.csv'):
+    buffer = io.BytesIO(text.encode('utf-8'))
+    buffer.name = name
+    return buffer
+
+
+def test_chunks_are_validated_and_appended_as_they_arrive(app, sheets, monkeypatch):
+    monkeypatch.setattr(app, 'IMPORT_CHUNK_ROWS', 2)
+    appended = []
+    monkeypatch.setattr(app, 'append_rows_to_gsheet', lambda sheet_name, rows: appended.append(len(rows)) or True)
+    monkeypatch.setattr(app, 'record_prices', lambda *args, **kwargs: True)
+    file = upload('kode_bahan,warna,nama_bahan,harga\n'
+                  'K1,Merah,Kain,100\nK2,biru,Kain,abc\nK3,hijau,Kain,50\nk1,merah,Lagi,70\nK4,hitam,Kain,10\n')
+
+    report = app.summarize_import(file, 'master_barang', app.validate_master_import)
+    assert report['accepted'] == 3
+    assert sorted(report['errors']['baris'].tolist()) == [3, 5]  # harga salah; duplikat dari potongan sebelumnya
+
+    chunks = (accepted for accepted, _ in app.validate_import_file(file, 'master_barang', app.validate_master_import))
+    assert app.import_rows('master_barang', chunks, report['accepted']) == 3
+    assert appended == [1, 1, 1]
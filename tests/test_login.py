@@ -0,0 +1,24 @@
+"""Login rate limit: per user and per client, with expired entries forgotten."""
+
+
+def test_lockout_is_per_user_and_per_client(app):
+    for _ in range(app.LOGIN_MAX_FAILURES_PER_USER):
+        app._record_login_failure('owner', '10.0.0.1')
+    assert app.login_retry_after('owner', '10.0.0.2') > 0
+    assert app.login_retry_after('kasir', '10.0.0.2') == 0
+    for i in range(app.LOGIN_MAX_FAILURES_PER_CLIENT):
+        app._record_login_failure(f'tebak-{i}', '10.0.0.3')
+    assert app.login_retry_after('kasir', '10.0.0.3') > 0
+    assert app.login_retry_after('kasir', '10.0.0.4') == 0
+
+
+def test_expired_failures_are_evicted(app, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    for i in range(20):
+        app._record_login_failure(f'acak-{i}', '10.0.0.1')
+    app.login_retry_after('tidak-pernah-gagal')
+    assert len(app._login_failures()) == 21
+    now[0] += app.LOGIN_WINDOW_SECONDS + 1
+    app._record_login_failure('owner', '10.0.0.2')
+    assert set(app._login_failures()) == {('user', 'owner'), ('client', '10.0.0.2')}
@@ -0,0 +1,154 @@
+"""Offline mode: journaled appends, replica reads, reconnect and sync with key renumbering."""
+import time
+
+import pytest
+
+
+class FakeWorksheet:
+    def __init__(self, fake, name, header):
+        self.fake, self.name, self.id = fake, name, 1
+        self.rows = [list(header)]
+
+    def get_all_records(self):
+        self.fake.check()
+        header = self.rows[0]
+        return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in self.rows[1:]]
+
+    def append_rows(self, rows):
+        self.fake.check()
+        self.rows.extend(list(row) for row in rows)
+        if self.fake.drop_reply:
+            self.fake.drop_reply = False
+            raise ConnectionError('reply lost')
+
+    def col_values(self, col):
+        self.fake.check()
+        values = [row[col - 1] if len(row) >= col else '' for row in self.rows]
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def get(self, cell_range, **kwargs):
+        self.fake.check()
+        first, last = (int(''.join(c for c in part if c.isdigit())) for part in cell_range.split(':'))
+        return [list(row) for row in self.rows[first - 1:last]]
+
+
+class FakeSpreadsheet:
+    def __init__(self, schema):
+        self.up, self.drop_reply = True, False
+        self.sheets = {name: FakeWorksheet(self, name, header) for name, header in schema.items()}
+
+    def check(self):
+        if not self.up:
+            raise ConnectionError('no route to host')
+
+    def worksheet(self, name):
+        self.check()
+        return self.sheets[name]
+
+    def fetch_sheet_metadata(self):
+        self.check()
+        return {}
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def spreadsheet(app, monkeypatch):
+    fake = FakeSpreadsheet(app.SHEET_SCHEMA)
+    monkeypatch.setattr(app, 'SHEETS_BUDGET_PER_MINUTE', {'read': 10 ** 6, 'write': 10 ** 6})
+    monkeypatch.setattr(app, 'JOURNAL_SETTLE_SECONDS', 0)
+    monkeypatch.setattr(app, 'JOURNAL_SYNC_INTERVAL', 0.2)
+
+    def open_spreadsheet():
+        fake.check()
+        return fake
+
+    monkeypatch.setattr(app, '_open_spreadsheet', open_spreadsheet)
+    yield fake
+    journal = app._journal()
+    app.st.cache_resource.clear()  # the sync thread of this test stops at its next round
+    journal['wake'].set()
+    if journal['thread'] is not None:
+        journal['thread'].join(timeout=5)
+
+
+def test_append_is_journaled_and_synced(app, spreadsheet):
+    invoices = spreadsheet.sheets['invoices']
+    invoices.rows.append(['INV-261019-001', '2026-10-19 09:00:00', 'Budi', 1])
+    assert len(app.get_data_from_gsheets('invoices')) == 1
+    app.append_row_to_gsheet('invoices', ['INV-261019-002', '2026-10-19 10:00:00', 'Ani', 2])
+    assert app.get_data_from_gsheets('invoices')['invoice_number'].tolist() == ['INV-261019-001', 'INV-261019-002']
+    assert wait_for(lambda: len(invoices.rows) == 3)
+    assert app.get_journal_status()['pending'] == {}
+
+
+def test_read_only_session_reconnects(app, spreadsheet):
+    spreadsheet.up = False
+    assert app.get_data_from_gsheets('invoices').empty
+    assert app.get_offline_status() is not None
+    spreadsheet.up = True
+    assert wait_for(lambda: app.get_offline_status() is None)
+
+
+def test_offline_writes_sync_once_with_renumbered_keys(app, spreadsheet):
+    invoices = spreadsheet.sheets['invoices']
+    invoices.rows.append(['INV-261019-001', '2026-10-19 09:00:00', 'Budi', 1])
+    app.get_data_from_gsheets('invoices')
+    spreadsheet.up = False
+    app.bump_data_version('invoices')
+    assert len(app.get_data_from_gsheets('invoices')) == 1  # dari salinan lokal
+    app.append_rows_to_gsheet('invoices', [['INV-261019-002', '2026-10-19 11:00:00', 'Cici', 3]])
+    app.append_rows_to_gsheet('invoice_items', [['INV-261019-002', 'K1', 'Kain', 1, 100, 100, 'merah', 1]])
+    assert len(app.get_data_from_gsheets('invoices')) == 2
+    assert app.update_row_in_gsheet('invoices', 0, ['x']) is False
+    # Nomor yang sama dipakai di tempat lain selama offline, dan balasan append pertama hilang.
+    invoices.rows.append(['INV-261019-002', '2026-10-19 11:30:00', 'Lain', 9])
+    spreadsheet.drop_reply = True
+    spreadsheet.up = True
+    assert wait_for(lambda: app.get_offline_status() is None and not app.get_journal_status()['pending'])
+    assert [row[0] for row in invoices.rows[1:]] == ['INV-261019-001', 'INV-261019-002', 'INV-261019-003']
+    assert spreadsheet.sheets['invoice_items'].rows[1][0] == 'INV-261019-003'
+
+
+def test_positional_write_does_not_wait_for_the_sync(app, spreadsheet, monkeypatch):
+    invoices = spreadsheet.sheets['invoices']
+    invoices.rows.append(['INV-261019-001', '2026-10-19 09:00:00', 'Budi', 1])
+    wakes, warnings = [], []
+    monkeypatch.setattr(app, 'wake_journal_sync', lambda: wakes.append(1))  # baris tetap di jurnal
+    monkeypatch.setattr(app.st, 'warning', warnings.append)
+    monkeypatch.setattr(app, 'sync_journal', lambda: pytest.fail('page thread ran the sync'))
+    app.append_row_to_gsheet('invoices', ['INV-261019-002', '2026-10-19 10:00:00', 'Ani', 2])
+    wakes.clear()
+    assert app.update_row_in_gsheet('invoices', 0, ['x']) is False
+    assert warnings and wakes
+
+
+def test_configuration_error_is_not_offline(app, monkeypatch):
+    def broken_secrets():
+        raise KeyError('connections')
+
+    errors = []
+    monkeypatch.setattr(app, '_open_spreadsheet', broken_secrets)
+    monkeypatch.setattr(app.st, 'error', errors.append)
+    monkeypatch.setattr(app.st, 'stop', lambda: None)
+    assert app.get_gsheet_connection() is None
+    assert errors and app.get_offline_status() is None
+
+
+def test_network_errors_are_told_apart_from_configuration_errors(app):
+    import requests
+
+    assert app._is_network_error(requests.exceptions.ConnectionError('dns'))
+    assert app._is_network_error(requests.exceptions.ReadTimeout('slow'))
+    assert app._is_network_error(ConnectionError('no route'))
+    assert not app._is_network_error(FileNotFoundError('secrets.toml'))
+    assert not app._is_network_error(KeyError('connections'))
@@ -0,0 +1,36 @@
+"""get_sheet_page reads only the requested rows when it can."""
+import pytest
+
+
+class WindowWorksheet:
+    def __init__(self, rows):
+        self.rows, self.requests = rows, []
+
+    def batch_get(self, ranges, **kwargs):
+        self.requests.append(ranges)
+        header, column_a, window = ranges
+        first, last = (int(''.join(c for c in part if c.isdigit())) for part in window.split(':'))
+        return [[self.rows[0]], [[row[0]] for row in self.rows[1:]], [list(row) for row in self.rows[first - 1:last]]]
+
+
+@pytest.fixture
+def worksheet(app, monkeypatch):
+    header = app.SHEET_SCHEMA['barang_masuk']
+    rows = [header] + [[f'2026-10-{day:02d} 08:00:00', f'K{day}', 'merah', day, 1.0, '', 'Gudang'] for day in range(1, 26)]
+    fake = WindowWorksheet(rows)
+    monkeypatch.setattr(app, 'get_worksheet', lambda sheet_name: fake)
+    monkeypatch.setattr(app, 'get_data_from_gsheets', lambda sheet_name: pytest.fail('read the whole sheet'))
+    return fake
+
+
+def test_reads_only_the_requested_rows(app, worksheet):
+    page, total = app.get_sheet_page('barang_masuk', page=2, page_size=10)
+    assert total == 25
+    assert page['kode_bahan'].tolist() == [f'K{day}' for day in range(11, 21)]
+    assert page.index.tolist() == list(range(10, 20))
+    assert worksheet.requests == [['1:1', 'A2:A', 'A12:G21']]
+
+
+def test_page_past_the_end_shows_the_last_page(app, worksheet):
+    page, total = app.get_sheet_page('barang_masuk', page=9, page_size=10)
+    assert total == 25 and page['kode_bahan'].tolist() == [f'K{day}' for day in range(21, 26)]
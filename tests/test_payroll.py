@@ -0,0 +1,30 @@
+import pandas as pd
+
+
+def test_payroll_grid_from_employees(app, sheets):
+    sheets['employees'] = [['Andi', 'Gudang', 100000, 1], ['Budi', 'Kasir', '120000', '2']]
+    grid = app.build_payroll_grid(default_hari_kerja=20)
+    assert list(grid.columns) == app.PAYROLL_GRID_COLUMNS
+    assert grid['employee_id'].tolist() == [1, 2]
+    assert grid['gaji_per_hari'].tolist() == [100000.0, 120000.0]
+    assert (grid['hari_kerja'] == 20).all()
+
+
+def test_payroll_grid_without_employees(app, sheets):
+    assert app.build_payroll_grid().empty
+
+
+def test_upload_matches_ids_read_as_text_or_float(app, sheets):
+    sheets['employees'] = [['Andi', 'Gudang', 100000, 1], ['Budi', 'Kasir', 120000, 2]]
+    grid = app.build_payroll_grid(default_hari_kerja=20)
+    uploaded = pd.DataFrame({'employee_id': ['1', 2.0, '7', 'x'], 'hari_kerja': [22, 18, 5, 3]})
+    merged, unmatched = app.merge_payroll_upload(grid, uploaded)
+    assert merged['hari_kerja'].tolist() == [22, 18]
+    assert merged['employee_id'].tolist() == [1, 2] and merged['employee_id'].dtype == grid['employee_id'].dtype
+    assert unmatched == [7, 'x']
+
+
+def test_upload_by_name(app, sheets):
+    sheets['employees'] = [['Andi', 'Gudang', 100000, 1]]
+    merged, unmatched = app.merge_payroll_upload(app.build_payroll_grid(), pd.DataFrame({'nama_karyawan': [' Andi ', 'Cici'], 'kasbon': [5000, 1]}))
+    assert merged['kasbon'].tolist() == [5000.0] and unmatched == ['Cici']
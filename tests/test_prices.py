@@ -0,0 +1,55 @@
+"""update_master_item writes the price version only after the master row is updated."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def master(app, sheets, monkeypatch):
+    sheets['master_barang'] = [['K1', 'Sup', 'Kain', 'merah', 'R1', 100, 0]]
+    sheets['harga_barang'] = [[1, 'K1', 'merah', 100, app.PRICE_HISTORY_START, 'harga awal']]
+    calls = []
+
+    def update_row(sheet_name, row_index, values):
+        calls.append(('update', values[5]))
+        return master.accept
+
+    def append_rows(sheet_name, rows):
+        calls.append(('price', rows[0][3]))
+        sheets[sheet_name].extend(rows)
+        app.bump_data_version(sheet_name)
+        return True
+
+    monkeypatch.setattr(app, 'find_row_for_write', lambda sheet_name, *key: 0)
+    monkeypatch.setattr(app, 'update_row_in_gsheet', update_row)
+    monkeypatch.setattr(app, 'append_rows_to_gsheet', append_rows)
+    master.accept, master.calls = True, calls
+    return master
+
+
+def update(app, harga, berlaku_mulai=None):
+    return app.update_master_item('K1', 'merah', 'K1', 'merah', 'Sup', 'Kain', 'R1', harga, 0, berlaku_mulai)
+
+
+def test_refused_update_records_no_price(app, sheets, master):
+    master.accept = False
+    assert update(app, 150) is False
+    assert master.calls == [('update', 150)] and len(sheets['harga_barang']) == 1
+
+
+def test_price_version_follows_the_update(app, sheets, master):
+    assert update(app, 150)
+    assert master.calls == [('update', 150), ('price', 150.0)]
+    assert app.get_price_at('K1', 'merah')[0] == 150.0
+
+
+def test_scheduled_price_leaves_master_price(app, sheets, master):
+    assert update(app, 200, datetime.now() + timedelta(days=3))
+    assert master.calls == [('update', 100), ('price', 200.0)]
+
+
+def test_backdated_price_superseded_by_a_later_version(app, sheets, master):
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    sheets['harga_barang'].append([2, 'K1', 'merah', 120, yesterday, 'perubahan harga'])
+    assert update(app, 90, datetime.now() - timedelta(days=5))
+    assert master.calls == [('update', 120), ('price', 90.0)]
@@ -0,0 +1,29 @@
+class RowsWorksheet:
+    """row_values over the same in-memory rows the `sheets` fixture serves."""
+
+    def __init__(self, app, sheets, sheet_name):
+        self.app, self.sheets, self.sheet_name = app, sheets, sheet_name
+
+    def row_values(self, row, **kwargs):
+        rows = [self.app.SHEET_SCHEMA[self.sheet_name]] + self.sheets.get(self.sheet_name, [])
+        return list(rows[row - 1]) if row <= len(rows) else []
+
+
+def test_find_row_for_write_follows_external_edits(app, sheets, monkeypatch):
+    sheets['master_barang'] = [['A1', 'Sup', 'Kain', 'merah', 'R1', 100, 0], ['B2', 'Sup', 'Kain', 'biru', 'R1', 100, 0]]
+    monkeypatch.setattr(app, 'get_worksheet', lambda name: RowsWorksheet(app, sheets, name))
+    assert app.find_row('master_barang', 'B2', 'biru') == 1
+    # Baris pertama dihapus langsung di spreadsheet: indeks di state proses sudah basi.
+    del sheets['master_barang'][0]
+    assert app.find_row('master_barang', 'B2', 'biru') == 1
+    assert app.find_row_for_write('master_barang', 'B2', 'biru') == 0
+    assert app.find_row_for_write('master_barang', 'A1', 'merah') is None
+
+
+def test_row_index_rebuilt_after_ttl(app, sheets, monkeypatch):
+    sheets['employees'] = [['Andi', 'Gudang', 100000, 1]]
+    assert app.find_row('employees', 'Andi') == 0
+    sheets['employees'].insert(0, ['Budi', 'Kasir', 90000, 2])
+    assert app.find_row('employees', 'Andi') == 0
+    monkeypatch.setattr(app, 'STATE_INDEX_TTL', 0)
+    assert app.find_row('employees', 'Andi') == 1
@@ -0,0 +1,146 @@
+"""Drives sheets_call through gspread against a local fake Sheets API that injects 429s and latency."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+SHEETS_API = 'https://sheets.googleapis.com'
+HEADER = ['invoice_number', 'tanggal_waktu', 'customer_name', 'customer_id']
+ROWS = [['INV-1', '2026-01-01 10:00:00', 'Budi', 1]]
+
+
+class FakeSheets:
+    """Counts requests; the next `fail` value requests answer `fail_status`, every response waits `delay` seconds."""
+
+    def __init__(self):
+        self.fail = 0
+        self.fail_status = 429
+        self.delay = 0.0
+        self.value_requests = 0
+        self.lock = threading.Lock()
+
+    def respond(self, path):
+        time.sleep(self.delay)
+        if '/values/' not in path:
+            return 200, {'spreadsheetId': 'sheet', 'properties': {'title': 'toko'}, 'sheets': [{'properties': {
+                'title': 'invoices', 'sheetId': 1, 'index': 0,
+                'gridProperties': {'rowCount': 100, 'columnCount': len(HEADER)}}}]}
+        with self.lock:
+            self.value_requests += 1
+            if self.fail:
+                self.fail -= 1
+                return self.fail_status, {'error': {'code': self.fail_status, 'message': 'injected', 'status': 'UNAVAILABLE'}}
+        return 200, {'range': 'invoices!A1:D2', 'majorDimension': 'ROWS', 'values': [HEADER] + ROWS}
+
+
+@pytest.fixture
+def fake_sheets(app, monkeypatch):
+    fake = FakeSheets()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = fake.respond(self.path)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    local = f'http://127.0.0.1:{server.server_address[1]}'
+
+    class LocalAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = request.url.replace(SHEETS_API, local)
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    session.mount(SHEETS_API, LocalAdapter())
+    monkeypatch.setattr(app, 'SHEETS_BACKOFF_BASE', 0.05)
+    monkeypatch.setattr(app, 'SHEETS_BUDGET_PER_MINUTE', {'read': 6000, 'write': 6000})
+    client = app.create_sheets_client(None, session=session)
+    fake.worksheet = app.sheets_call('read', client.open_by_key, 'sheet').worksheet('invoices')
+    yield fake
+    server.shutdown()
+
+
+def test_retries_429_with_backoff(app, fake_sheets):
+    fake_sheets.fail = 2
+    records = app.sheets_call('read', fake_sheets.worksheet.get_all_records)
+    assert records[0]['invoice_number'] == 'INV-1'
+    assert fake_sheets.value_requests == 3
+    metrics = app.get_sheets_metrics()
+    assert metrics['rate_limited'] == 2 and metrics['retries'] == 2
+
+
+def test_gives_up_after_max_retries(app, fake_sheets, monkeypatch):
+    monkeypatch.setattr(app, 'SHEETS_MAX_RETRIES', 1)
+    fake_sheets.fail = 5
+    with pytest.raises(Exception) as excinfo:
+        app.sheets_call('read', fake_sheets.worksheet.get_all_records)
+    assert app._sheets_error_status(excinfo.value) == 429
+    assert fake_sheets.value_requests == 2
+
+
+def test_writes_retry_429_but_not_5xx(app, fake_sheets):
+    fake_sheets.fail = 1
+    app.sheets_call('write', fake_sheets.worksheet.append_rows, [['INV-2', '2026-01-02 10:00:00', 'Ani', 2]])
+    assert fake_sheets.value_requests == 2
+    # 503 setelah append bisa berarti baris sudah tersimpan: tidak diulang.
+    fake_sheets.fail, fake_sheets.fail_status = 1, 503
+    with pytest.raises(Exception) as excinfo:
+        app.sheets_call('write', fake_sheets.worksheet.append_rows, [['INV-3', '2026-01-03 10:00:00', 'Cici', 3]])
+    assert app._sheets_error_status(excinfo.value) == 503
+    assert fake_sheets.value_requests == 3
+    # Pembacaan tetap diulang pada 5xx.
+    fake_sheets.fail = 1
+    app.sheets_call('read', fake_sheets.worksheet.get_all_records)
+    assert fake_sheets.value_requests == 5
+
+
+def test_overlapping_reads_share_one_request(app, fake_sheets):
+    fake_sheets.delay = 0.3
+    results = []
+
+    def read():
+        results.append(app.sheets_call('read', fake_sheets.worksheet.get_all_records, coalesce_key=('records', 'invoices')))
+
+    threads = [threading.Thread(target=read) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(results) == 5 and all(result == results[0] for result in results)
+    assert fake_sheets.value_requests == 1
+    assert app.get_sheets_metrics()['coalesced'] == 4
+
+
+def test_follower_holding_state_lock_does_not_block_a_backing_off_leader(app, fake_sheets):
+    fake_sheets.fail = 1
+    fake_sheets.delay = 0.2
+    key = ('records', 'invoices')
+    leader = threading.Thread(target=app.sheets_call, args=('read', fake_sheets.worksheet.get_all_records), kwargs={'coalesce_key': key}, daemon=True)
+    leader.start()
+    time.sleep(0.05)
+    done = threading.Event()
+
+    def follower():
+        with app.get_app_state()['lock']:
+            app.sheets_call('read', fake_sheets.worksheet.get_all_records, coalesce_key=key)
+        done.set()
+
+    threading.Thread(target=follower, daemon=True).start()
+    assert done.wait(timeout=10), "leader stuck behind the state lock held by its follower"
+    leader.join(timeout=10)
+    assert fake_sheets.value_requests == 2
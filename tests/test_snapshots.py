@@ -0,0 +1,41 @@
+"""Snapshots: the reconcile thread is started by the uncached read wrapper, once per worksheet."""
+import threading
+
+import pytest
+
+
+def test_reconcile_starts_once_outside_the_cache(app, monkeypatch):
+    df = app.pd.DataFrame([['K1', 'Gudang']], columns=['kode_bahan', 'lokasi'])
+    assert app.save_snapshot('master_barang', df)
+    reconciled = threading.Event()
+    calls = []
+
+    def reconcile(sheet_name):
+        calls.append(sheet_name)
+        reconciled.set()
+
+    monkeypatch.setattr(app, '_reconcile_snapshot', reconcile)
+    monkeypatch.setattr(app, '_fetch_sheet_records', lambda sheet_name: pytest.fail('snapshot not served'))
+    assert app.serve_snapshot('master_barang', app.get_data_version('master_barang')) is None
+    assert app.get_data_from_gsheets('master_barang')['kode_bahan'].tolist() == ['K1']
+    app.get_data_from_gsheets('master_barang')
+    app.get_columns_from_gsheets('master_barang', ['kode_bahan'])
+    assert reconciled.wait(5)
+    assert calls == ['master_barang']
+
+
+def test_users_never_reach_the_disk(app, monkeypatch, tmp_path):
+    users = app.pd.DataFrame([['owner', 'rahasia', 'owner']], columns=app.SHEET_SCHEMA['users'])
+    leftover, _ = app._snapshot_paths('users')
+    app.os.makedirs(app.SNAPSHOT_DIR, exist_ok=True)
+    open(leftover, 'wb').close()
+    assert not app.save_snapshot('users', users)
+    assert not app.os.path.exists(leftover)
+    assert app.load_snapshot('users') is None
+
+    fetched = []
+    monkeypatch.setattr(app, '_fetch_sheet_records', lambda sheet_name: fetched.append(sheet_name) or users)
+    app.warm_local_replica()
+    assert 'users' not in fetched and fetched == app.SNAPSHOT_WORKSHEETS
+    assert sorted(app.os.listdir(app.SNAPSHOT_DIR)) == sorted(
+        name + ext for name in app.SNAPSHOT_WORKSHEETS for ext in ('.arrow', '.json'))